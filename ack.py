@@ -0,0 +1,65 @@
+# acknowledgements of received packets
+# instead of echoing every data packet back, the receiver records the packet numbers it got
+# and sends a small ACK frame (largest packet number + ranges) after every ack_every
+# ack-eliciting packets or at most ack_delay seconds after the first unacknowledged one.
+# Packets that arrive out of order are acknowledged at once, so the sender learns about
+# gaps quickly.
+
+from quic import AckFrame
+from reassembly import RangeSet
+
+
+class AckTracker:
+    # receiver side: which packet numbers arrived and when the next ACK is due
+    def __init__(self, ack_every=2, ack_delay=0.025, max_ranges=32):
+        """
+        :param ack_every: acknowledge after this many ack-eliciting packets.
+        :param ack_delay: seconds an acknowledgement may be delayed.
+        :param max_ranges: most ranges in one ACK frame, the oldest ones are left out.
+        """
+        self.ack_every = ack_every
+        self.ack_delay = ack_delay
+        self.max_ranges = max_ranges
+        self.received = RangeSet()      # received packet numbers as [first, last + 1) ranges
+        self.largest = None
+        self.largest_time = 0
+        self.unacknowledged = 0         # packets received since the last ACK
+        self.deadline = None            # time the delayed ACK must be sent
+        self.duplicates = 0
+
+    def on_packet(self, packet_number, now):
+        """
+        Record a received packet.
+
+        :return: True if an ACK should be sent right away.
+        """
+        if not self.received.add(packet_number, packet_number + 1):
+            self.duplicates += 1
+            return True     # the ACK was probably lost, repeat it
+        in_order = self.largest is None or packet_number == self.largest + 1
+        if self.largest is None or packet_number > self.largest:
+            self.largest = packet_number
+            self.largest_time = now
+        self.unacknowledged += 1
+        if self.unacknowledged >= self.ack_every or not in_order:
+            return True
+        if self.deadline is None:
+            self.deadline = now + self.ack_delay
+        return False
+
+    def due(self, now):
+        # the delayed ACK timer expired
+        return self.deadline is not None and now >= self.deadline
+
+    def build(self, now):
+        """
+        Make the ACK frame of everything received so far and reset the delayed ACK state.
+        """
+        ranges = []
+        for start, end in zip(reversed(self.received.starts), reversed(self.received.ends)):
+            ranges.append((start, end - 1))
+            if len(ranges) == self.max_ranges:
+                break
+        self.unacknowledged = 0
+        self.deadline = None
+        return AckFrame(self.largest, now - self.largest_time, ranges)
@@ -0,0 +1,895 @@
+# microbenchmarks for the QUIC implementation
+# run with: python bench.py [name ...]
+# every benchmark prints one line per measured case
+#
+# the reproducible suite runs a matrix of loopback transfers with warmup and repeated trials and
+# reports the median and percentiles of every metric, optionally against a saved baseline:
+#   python bench.py suite --flows 1 4 10 --scheduler round_robin weighted_fair --trials 5 \
+#       --json results.json --baseline baseline.json
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import itertools
+import json
+import platform
+import io
+import os
+import random
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from quic import *
+from reassembly import StreamBuffer
+from source import BufferSource, MappedFileSource
+from client import Client
+from server import Server
+from workers import WorkerPool
+from ring import RecvRing, set_receive_buffer
+from relay import LossyRelay, PROFILES
+from scheduler import SCHEDULERS
+import pmtu
+import resumption
+from tracing import Tracer, read_events, stream_timelines, run_rates
+
+
+def legacy_deserialize(data):
+    # the original decoder: re-slices the remaining bytes after every frame and decodes the payload to str
+    header = struct.unpack("!IIB", data[:9])
+    data = data[9:]
+    frames = []
+    while data:
+        frame_size = 18 + struct.unpack("!Q", data[10:18])[0]
+        frame_data = data[:frame_size]
+        stream_id, offset, data_length = struct.unpack("!HQQ", frame_data[:18])
+        frames.append(Frame(stream_id, offset, data_length, frame_data[18:].decode('utf-8')))
+        data = data[frame_size:]
+    return header, frames
+
+
+def make_datagram(frames_per_packet, packet_size=1500, version=WIRE_VERSION):
+    """
+    Build a serialized data packet of about packet_size bytes split into frames_per_packet frames.
+    """
+    frame_size = max(1, packet_size // frames_per_packet)
+    frames = [Frame(i, i * frame_size, frame_size, "a" * frame_size) for i in range(frames_per_packet)]
+    return Quic_packet(0b00000010, 1, 1, frames, version).serialize()
+
+
+def measure(function, duration=0.5):
+    """
+    Call function repeatedly for about duration seconds.
+
+    :return: calls per second.
+    """
+    calls = 0
+    batch = 1
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < duration:
+        for _ in range(batch):
+            function()
+        calls += batch
+        batch *= 2
+        elapsed = time.perf_counter() - start
+    return calls / elapsed
+
+
+def bench_decode(frame_counts=(1, 10, 100)):
+    # packets/sec of the legacy, eager and lazy decoders for 1, 10 and 100 frames per packet
+    results = {}
+    for frames_per_packet in frame_counts:
+        datagram = make_datagram(frames_per_packet)
+        legacy_datagram = make_datagram(frames_per_packet, version=1)
+
+        def consume_lazy():
+            for frame in Quic_packet.deserialize(datagram, lazy=True).frames:
+                pass
+
+        results[frames_per_packet] = {
+            "legacy": measure(lambda: legacy_deserialize(legacy_datagram)),
+            "eager": measure(lambda: Quic_packet.deserialize(datagram)),
+            "lazy": measure(consume_lazy),
+        }
+        rates = results[frames_per_packet]
+        print(f"decode {frames_per_packet:>3} frames/packet: legacy {rates['legacy']:>10.0f} pkt/s, "
+              f"eager {rates['eager']:>10.0f} pkt/s, lazy {rates['lazy']:>10.0f} pkt/s")
+    return results
+
+
+def bench_reassembly(stream_size=2 * 1024 * 1024, frame_size=1000):
+    # MB/s of placing a 2MB stream: the old str concatenation against StreamBuffer in order and shuffled
+    payload = "a" * stream_size
+    frames = [(offset, payload[offset:offset + frame_size]) for offset in range(0, stream_size, frame_size)]
+    byte_frames = [(offset, memoryview(chunk.encode('utf-8'))) for offset, chunk in frames]
+    shuffled = byte_frames[:]
+    random.Random(0).shuffle(shuffled)
+
+    def concatenate():
+        files = [""]
+        for offset, chunk in frames:
+            files[0] += chunk
+
+    def place(frames_list):
+        stream = StreamBuffer()
+        for offset, chunk in frames_list:
+            stream.write(offset, chunk)
+
+    results = {}
+    for name, function in (("concatenation", concatenate),
+                           ("in order", lambda: place(byte_frames)),
+                           ("shuffled", lambda: place(shuffled))):
+        results[name] = measure(function) * stream_size / 1e6
+        print(f"reassembly {name:>13}: {results[name]:>10.1f} MB/s")
+    return results
+
+
+def build_all_packets(client, data):
+    # run the client's packet builder over all the streams without sending anything
+    client.begin_transfer(data)
+    packet_number = 1
+    with contextlib.redirect_stdout(io.StringIO()):
+        while client.scheduler.has_data():
+            client.create_packet(packet_number).serialize()
+            packet_number += 1
+    return packet_number
+
+
+def legacy_create_packets(sizes, chunk_size, percentage=60):
+    """
+    The original packet builder: frames from the lowest indices of 60% of the streams, chunk_size
+    split evenly, finished streams popped.
+
+    :return: (payload bytes of each packet, index of the packet that completed each stream).
+    """
+    remaining = list(enumerate(sizes))
+    payloads = []
+    completed = [0 for _ in sizes]
+    while remaining:
+        frames_num = min(round(len(remaining) * (percentage / 100)), len(remaining)) or 1
+        frame_size = round(chunk_size / frames_num)
+        payload = 0
+        for position in range(frames_num):
+            stream_id, left = remaining[position]
+            length = min(frame_size, left)
+            payload += 18 + length
+            remaining[position] = (stream_id, left - length)
+            if left - length <= 0:
+                completed[stream_id] = len(payloads)
+        payloads.append(payload)
+        remaining = [stream for stream in remaining if stream[1] > 0]
+    return payloads, completed
+
+
+def bench_source(num_files=4, file_size=16 * 1024 * 1024):
+    # peak Python memory and time of building every packet: files read up front vs mapped sources
+    client = Client("127.0.0.1", 0)
+    client.chunk_size = 1500
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(num_files):
+            paths.append(os.path.join(directory, f"file_{i}"))
+            with open(paths[-1], "wb") as f:
+                f.write(os.urandom(file_size))
+
+        results = {}
+        for name, load in (("read up front", lambda: [BufferSource(open(path, 'rb').read()) for path in paths]),
+                           ("mapped", lambda: [MappedFileSource(path) for path in paths])):
+            tracemalloc.start()
+            start = time.perf_counter()
+            packets = build_all_packets(client, load())
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[name] = {"peak_bytes": peak, "packets_per_sec": packets / elapsed}
+            print(f"source {name:>13}: peak {peak / 1e6:>8.2f} MB, {packets / elapsed:>10.0f} packets/s")
+    client.close()
+    return results
+
+
+@contextlib.contextmanager
+def scratch_directory():
+    # the server and client print every event and the server writes its output files to the cwd: run
+    # silenced in a temporary directory, the working directory is restored even when a transfer raises
+    with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(cwd)
+
+
+def run_transfer(data, engine="thread", send_interval=None, client_options=None, address=("127.0.0.1", 0),
+                 **server_options):
+    """
+    Transfer data from a client to a server on loopback with the threaded or the asyncio engine.
+
+    :param client_options: attributes set on the Client (wire_version, ...).
+    :param address: where the server listens, a free port by default.
+    :param server_options: passed to the Server (ack_every, ...).
+
+    :return: (seconds from handshake to the server closing, server).
+    """
+    with scratch_directory():
+        server = Server(*address, **server_options)
+        host, port = server.server_socket.getsockname()
+        client = Client(host, port)
+        client.send_interval = send_interval
+        for name, value in (client_options or {}).items():
+            setattr(client, name, value)
+        if engine == "asyncio":
+            server_thread = threading.Thread(target=asyncio.run, args=(server.handle_packet_async(),))
+        else:
+            server_thread = threading.Thread(target=server.handle_packet)
+        server_thread.start()
+        start = time.perf_counter()
+        if engine == "asyncio":
+            asyncio.run(client.run_async(data))
+        else:
+            client.send_syn()
+            client.receive_ack()
+            client.send_all_packets(data)
+            client.close()
+        server_thread.join()
+        elapsed = time.perf_counter() - start
+    return elapsed, server
+
+
+def bench_engine(num_streams=4, stream_size=512 * 1024):
+    # loopback throughput of the blocking threaded engine against the asyncio engine
+    data = [os.urandom(stream_size) for _ in range(num_streams)]
+    results = {}
+    for send_interval in (0.0005, None):
+        for engine in ("thread", "asyncio"):
+            elapsed, server = run_transfer(data, engine, send_interval)
+            received = sum(len(stream) for stream in server.files)
+            result = {"seconds": elapsed, "bytes_per_sec": received / elapsed, "complete": server.files == data}
+            results[(engine, send_interval)] = result
+            pacing = "paced" if send_interval is None else f"interval {send_interval * 1000:.1f} ms"
+            print(f"engine {engine:>8}, {pacing:>16}: {received / elapsed / 1e6:>8.2f} MB/s "
+                  f"in {elapsed:.2f} s, {server.total_packets} packets, complete: {result['complete']}")
+    return results
+
+
+def bench_connections(client_counts=(1, 8, 32), stream_size=64 * 1024):
+    # aggregate throughput of one serve_forever server absorbing many simultaneous clients
+    results = {}
+    for num_clients in client_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            server = Server("127.0.0.1", 0, rcvbuf=4 * 1024 * 1024)
+            host, port = server.server_socket.getsockname()
+            server_thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+            server_thread.start()
+
+            def send():
+                client = Client(host, port)
+                client.send_syn()
+                client.receive_ack()
+                client.send_all_packets([os.urandom(stream_size)])
+                client.close()
+
+            start = time.perf_counter()
+            client_threads = [threading.Thread(target=send) for _ in range(num_clients)]
+            for thread in client_threads:
+                thread.start()
+            for thread in client_threads:
+                thread.join()
+            deadline = time.time() + 5
+            while server.finished_connections < num_clients and time.time() < deadline:
+                time.sleep(0.001)
+            elapsed = time.perf_counter() - start
+            server.stop()
+            server_thread.join()
+        results[num_clients] = {"bytes_per_sec": server.total_bytes / elapsed,
+                                "finished": server.finished_connections}
+        print(f"connections {num_clients:>3} clients: {server.total_bytes / elapsed / 1e6:>8.2f} MB/s, "
+              f"{server.finished_connections}/{num_clients} finished")
+    return results
+
+
+def bench_workers(worker_counts=(1, 2, 4), num_clients=16, stream_size=256 * 1024):
+    # aggregate goodput of a pool of 1, 2 and 4 SO_REUSEPORT worker processes, it only
+    # scales with the worker count when there are at least as many cores
+    results = {}
+    for workers in worker_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool = WorkerPool("127.0.0.1", 0, workers=workers, quiet=True)
+            pool.start()
+
+            def send():
+                client = Client("127.0.0.1", pool.port)
+                client.send_syn()
+                client.receive_ack()
+                client.send_all_packets([os.urandom(stream_size)])
+                client.close()
+
+            start = time.perf_counter()
+            client_threads = [threading.Thread(target=send) for _ in range(num_clients)]
+            for thread in client_threads:
+                thread.start()
+            for thread in client_threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            time.sleep(0.5)
+            total = pool.stop()
+        results[workers] = {"bytes_per_sec": total["total_bytes"] / elapsed, "total_bytes": total["total_bytes"],
+                            "finished_connections": total["finished_connections"]}
+        print(f"workers {workers}: {total['total_bytes'] / elapsed / 1e6:>8.2f} MB/s, "
+              f"{total['total_bytes']} of {num_clients * stream_size} bytes, "
+              f"{total['finished_connections']}/{num_clients} connections, {os.cpu_count()} cores")
+    return results
+
+
+def bench_receive(num_datagrams=1000, rounds=20, datagram_size=1400):
+    # packets/sec and bytes allocated to drain a burst: recvfrom(10MB) per packet against the ring
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    set_receive_buffer(receiver, 8 * 1024 * 1024)
+    receiver.bind(("127.0.0.1", 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagram = make_datagram(1, datagram_size)
+
+    def burst():
+        for _ in range(num_datagrams):
+            sender.sendto(datagram, receiver.getsockname())
+
+    def drain_recvfrom():
+        received = 0
+        while received < num_datagrams:
+            packet, client_address = receiver.recvfrom(1024 * 1024 * 10)
+            Quic_packet.deserialize(packet)
+            received += 1
+
+    ring = RecvRing(receiver, slots=64)
+
+    def drain_ring():
+        received = 0
+        while received < num_datagrams:
+            for view, client_address in ring.receive_batch():
+                Quic_packet.deserialize(view)
+                received += 1
+
+    results = {}
+    for name, drain in (("recvfrom", drain_recvfrom), ("ring", drain_ring)):
+        receiver.setblocking(name == "recvfrom")
+        elapsed = 0
+        tracemalloc.start()
+        for _ in range(rounds):
+            burst()
+            start = time.perf_counter()
+            drain()
+            elapsed += time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {"packets_per_sec": num_datagrams * rounds / elapsed, "peak_bytes": peak}
+        print(f"receive {name:>8}: {num_datagrams * rounds / elapsed:>10.0f} packets/s, "
+              f"peak allocation {peak / 1e6:>8.2f} MB")
+    sender.close()
+    receiver.close()
+    return results
+
+
+def bench_acks(num_streams=4, stream_size=512 * 1024, ack_every_values=(1, 2, 8)):
+    # reverse path bytes: echoing every data packet (the old ACK) against ACK frames
+    data = [random.Random(i).randbytes(stream_size) for i in range(num_streams)]
+    print("\n== acks: server to client bytes per transfer ==")
+    for ack_every in ack_every_values:
+        elapsed, server = run_transfer(data, ack_every=ack_every)
+        forward = server.total_bytes + server.total_packets * HEADER_SIZE    # at least what an echo returns
+        print(f"  ack_every={ack_every}: {server.bytes_sent:>9} bytes back vs {forward:>9} echoed "
+              f"({server.bytes_sent / forward:.2%}), {elapsed:.3f} s")
+
+
+def run_relay_transfer(data, loss, seed=1, server_options=None, relay_options=None, **client_options):
+    """
+    Transfer data from a client to a server through a LossyRelay on loopback.
+
+    :param server_options: keyword arguments of the Server (flow control windows, ...).
+    :param relay_options: keyword arguments of the LossyRelay (delay, jitter, bandwidth, ...).
+    :param client_options: attributes set on the Client (congestion_control, send_interval, ...).
+    :return: (seconds from handshake to the server closing, server, client, relay).
+    """
+    with scratch_directory():
+        server = Server("127.0.0.1", 0, **(server_options or {}))
+        relay = LossyRelay(server.server_socket.getsockname(), loss=loss, seed=seed, **(relay_options or {}))
+        relay.start()
+        client = Client(*relay.address)
+        for name, value in client_options.items():
+            setattr(client, name, value)
+        server_thread = threading.Thread(target=server.handle_packet)
+        server_thread.start()
+        start = time.perf_counter()
+        client.send_syn()
+        client.receive_ack()
+        client.send_all_packets(data)
+        client.close()
+        server_thread.join()
+        elapsed = time.perf_counter() - start
+        relay.stop()
+    return elapsed, server, client, relay
+
+
+def bench_loss(loss_rates=(0.0, 0.01, 0.05), num_streams=4, stream_size=256 * 1024):
+    # transfers through a lossy relay: all the data must arrive
+    data = [random.Random(i).randbytes(stream_size) for i in range(num_streams)]
+    print("\n== loss: transfer through a lossy relay ==")
+    for loss in loss_rates:
+        elapsed, server, client, relay = run_relay_transfer(data, loss)
+        print(f"  loss={loss:.0%}: {elapsed:.3f} s, {client.packet_number - 1} packets, "
+              f"{client.retransmitted_packets} retransmissions, {relay.dropped} dropped, correct={data == server.files}")
+
+
+def bench_congestion(loss_rates=(0.0, 0.01, 0.03, 0.05), num_streams=4, stream_size=512 * 1024):
+    # throughput and loss of the congestion controllers against the fixed 0.5 ms spacing of before
+    data = [random.Random(i).randbytes(stream_size) for i in range(num_streams)]
+    total = num_streams * stream_size
+    senders = {"fixed 0.5 ms": {"send_interval": 0.0005}, "newreno": {"congestion_control": "newreno"},
+               "cubic": {"congestion_control": "cubic"}}
+    print("\n== congestion: throughput through a lossy relay ==")
+    for loss in loss_rates:
+        for name, options in senders.items():
+            elapsed, server, client, relay = run_relay_transfer(data, loss, **options)
+            sent = client.packet_number - 1
+            print(f"  loss={loss:.0%} {name:>12}: {total / elapsed / 1e6:>6.2f} MB/s, {sent} packets, "
+                  f"{client.recovery.lost_packets / sent:.1%} declared lost, {relay.dropped} dropped by the relay, "
+                  f"{client.congestion.congestion_events} congestion events, correct={data == server.files}")
+
+
+def bench_varint(stream_counts=(1, 10), stream_size=256 * 1024):
+    # bytes on the wire and goodput of the fixed-size fields (version 1) against varints (version 2)
+    print("\n== varint: frame overhead of the packets built by the client ==")
+    client = Client("127.0.0.1", 0)
+    client.chunk_size = 1500
+    for num_streams in stream_counts:
+        data = [os.urandom(stream_size) for _ in range(num_streams)]
+        for version in (1, 2):
+            client.wire_version = version
+            client.begin_transfer(data)
+            wire = packets = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                while client.scheduler.has_data():
+                    wire += len(client.create_packet(packets + 1).serialize())
+                    packets += 1
+            payload = num_streams * stream_size
+            print(f"  {num_streams:>2} streams, version {version}: {wire:>9} bytes on the wire for {payload} payload bytes, "
+                  f"{(wire - payload) / wire:.2%} overhead, {packets} packets")
+    client.close()
+    for version in (1, 2):
+        datagram = make_datagram(10, version=version)
+        print(f"  decode 10 frames/packet, version {version}: {measure(lambda: Quic_packet.deserialize(datagram)):>10.0f} pkt/s")
+    data = [os.urandom(512 * 1024) for _ in range(10)]
+    payload = sum(len(item) for item in data)
+    for version in (1, 2):
+        elapsed, server = run_transfer(data, client_options={"wire_version": version})
+        print(f"  transfer 10 x 512 KiB, version {version}: goodput {payload / elapsed / 1e6:>6.2f} MB/s, "
+              f"{server.total_packets} packets received, correct={server.files == data}")
+
+
+def bench_scheduler(sizes=(256 * 1024,) * 8 + (32 * 1024,) * 4, chunk_size=1400):
+    # packet fill and completion fairness of the original builder against the schedulers
+    print("\n== scheduler: packet fill and stream completion fairness ==")
+    from connection import jain_index
+
+    def report(name, payloads, completed):
+        full = sum(1 for payload in payloads[:-1] if payload == chunk_size)
+        rates = [size / (index + 1) for size, index in zip(sizes, completed)]
+        print(f"  {name:>22}: {len(payloads)} packets, {full / max(len(payloads) - 1, 1):.0%} filled to {chunk_size} bytes, "
+              f"mean fill {sum(payloads) / len(payloads) / chunk_size:.1%}, Jain index of stream rates {jain_index(rates):.3f}, "
+              f"last stream done at packet {max(completed) + 1}")
+
+    report("legacy (60% of streams)", *legacy_create_packets(sizes, chunk_size))
+    client = Client("127.0.0.1", 0)
+    client.chunk_size = chunk_size
+    for scheduling, weights in (("round_robin", None), ("weighted_fair", [1, 2] * (len(sizes) // 2)), ("priority", None)):
+        client.scheduling = scheduling
+        client.stream_weights = weights
+        client.stream_priorities = list(range(len(sizes))) if scheduling == "priority" else None
+        client.begin_transfer([bytes(size) for size in sizes])
+        payloads = []
+        completed = [0 for _ in sizes]
+        with contextlib.redirect_stdout(io.StringIO()):
+            while client.scheduler.has_data():
+                packet = client.create_packet(len(payloads) + 1)
+                payloads.append(len(packet.serialize()) - len(packet.header.serialize()))
+                for frame in packet.frames:
+                    if frame.offset + frame.data_length >= sizes[frame.stream_id]:
+                        completed[frame.stream_id] = len(payloads) - 1
+        report(scheduling, payloads, completed)
+    client.close()
+
+
+def bench_flow(num_streams=16, stream_size=1024 * 1024, loss=0.02):
+    # data the server buffers behind the holes of lost packets, with and without flow control windows
+    data = [random.Random(i).randbytes(stream_size) for i in range(num_streams)]
+    print(f"\n== flow: {num_streams} streams of {stream_size // 1024} KiB, {loss:.0%} loss ==")
+    unlimited = 1 << 40    # flow control that never blocks, to measure the unconstrained buffering
+    for name, options in (("no limit", dict(stream_window=unlimited, connection_window=unlimited, max_window=unlimited)),
+                          ("default windows", {}),
+                          ("64K / 256K windows", dict(stream_window=64 * 1024, connection_window=256 * 1024)),
+                          ("16K / 64K, no autotune", dict(stream_window=16 * 1024, connection_window=64 * 1024,
+                                                          autotune=False))):
+        elapsed, server, client, relay = run_relay_transfer(data, loss, server_options=options)
+        flow = server.connection.flow
+        print(f"  {name:>22}: {num_streams * stream_size / elapsed / 1e6:.2f} MB/s, peak buffered "
+              f"{flow.peak_buffered / 1024:.0f} KiB, {client.flow_blocked_packets} blocked packets, "
+              f"{flow.violations} violations, correct={data == server.files}")
+
+
+def bench_impairment(profiles=("loopback", "lan", "wan", "lossy", "wifi", "capped"), num_streams=4,
+                     stream_size=512 * 1024):
+    # goodput and completion time through the relay profiles (see relay.PROFILES)
+    data = [random.Random(i).randbytes(stream_size) for i in range(num_streams)]
+    print(f"\n== impairment: {num_streams} streams of {stream_size // 1024} KiB through the relay profiles ==")
+    for profile in profiles:
+        options = dict(PROFILES[profile])
+        elapsed, server, client, relay = run_relay_transfer(data, options.pop("loss", 0.0), relay_options=options)
+        completion = max(server.connection.completion_times)
+        print(f"  {profile:>8}: goodput {num_streams * stream_size / elapsed / 1e6:>6.2f} MB/s, last stream after "
+              f"{completion * 1000:.0f} ms, srtt {client.recovery.rtt.smoothed_rtt * 1000:.1f} ms, "
+              f"{client.retransmitted_packets} retransmissions, relay {relay.statistics()}, correct={data == server.files}")
+
+
+def bench_trace(num_streams=4, stream_size=1024 * 1024, trials=7):
+    # cost of tracing every packet on the client and the server, median CPU time of the transfers
+    # (client and server run in this process, the wall-clock time of a loopback run is noisier)
+    data = [random.Random(i).randbytes(stream_size) for i in range(num_streams)]
+    print(f"\n== trace: {num_streams} streams of {stream_size // 1024} KiB, median of {trials} transfers ==")
+    with tempfile.TemporaryDirectory() as directory:
+        server_path, client_path = os.path.join(directory, "server.trace"), os.path.join(directory, "client.trace")
+        cpu = {"off": [], "on": []}
+        dropped = 0
+        for trial in range(trials):
+            for mode in ("off", "on"):
+                tracer = Tracer(client_path) if mode == "on" else None
+                start = time.process_time()
+                elapsed, server = run_transfer(data, client_options={"tracer": tracer},
+                                               trace_path=server_path if mode == "on" else None)
+                cpu[mode].append((time.process_time() - start) / server.total_packets)
+                if tracer is not None:
+                    dropped += tracer.dropped + server.tracer.dropped
+        off, on = percentile(cpu["off"], 0.5), percentile(cpu["on"], 0.5)
+        print(f"  CPU per packet, tracing off: {off * 1e6:.1f} us, on: {on * 1e6:.1f} us ({on / off - 1:+.1%}), "
+              f"trace sizes {os.path.getsize(server_path) // 1024} + {os.path.getsize(client_path) // 1024} KiB, "
+              f"{dropped} events dropped")
+        timelines = stream_timelines(read_events(server_path))
+        print(f"  analyzer: {run_rates(read_events(server_path))}, stream timelines "
+              f"{[(stream_id, round(timeline['last'], 3)) for stream_id, timeline in sorted(timelines.items())]}")
+
+def bench_handshake(sizes=(1024, 32 * 1024), num_streams=4, delay=0.01, trials=5, ack_every=2):
+    # connection setup of small transfers through a relay with a round trip of 2 * delay: the SYN /
+    # SYN-ACK handshake before the data, data in the SYN (0-RTT) at first contact, and with a token.
+    # The delayed ACK of an odd last packet adds up to ack_delay to the completion, see ack_every=1
+    results = []
+    with scratch_directory():
+        server = Server("127.0.0.1", 0, ack_every=ack_every)
+        closed = []
+        server.on_connection_closed = closed.append
+        relay = LossyRelay(server.server_socket.getsockname(), delay=delay)
+        relay.start()
+        server_thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+        server_thread.start()
+        for size in sizes:
+            data = [random.Random(i).randbytes(size) for i in range(num_streams)]
+            for mode in ("handshake", "early", "resumed"):
+                first_byte, completion = [], []
+                for trial in range(trials + 1):     # the first one is a warmup, it also gets a token
+                    if mode == "early":
+                        resumption.TOKENS.pop(relay.address, None)
+                    client = Client(*relay.address)
+                    start = time.perf_counter()
+                    if mode == "handshake":
+                        client.send_syn()
+                        client.receive_ack()
+                        client.send_all_packets(data)
+                    else:
+                        client.send_all_packets_early(data)
+                    elapsed = time.perf_counter() - start
+                    client.close()
+                    while not closed:
+                        time.sleep(0.001)   # the server closes the connection as it sends the FIN-ACK
+                    connection = closed.pop()
+                    if trial:
+                        first_byte.append(connection.stats.connection.first_time - start)
+                        completion.append(elapsed)
+                results.append((size, mode, percentile(first_byte, 0.5), percentile(completion, 0.5),
+                                connection.resumed))
+        server.stop()
+        server_thread.join()
+        relay.stop()
+    print(f"\n== handshake: {num_streams} streams, {delay * 2000:.0f} ms round trip, ACK every {ack_every} packets, "
+          f"median of {trials} connections ==")
+    for size, mode, first_byte, completion, resumed in results:
+        print(f"  {size // 1024:>3} KiB streams, {mode:>9}: first byte after {first_byte * 1000:.1f} ms, "
+              f"done after {completion * 1000:.1f} ms (resumed={resumed})")
+
+
+def bench_pmtu(mtus=(1500, 9000, None), num_streams=4, stream_size=2 * 1024 * 1024):
+    # fixed packet sizes against path MTU discovery through relays that drop larger datagrams
+    data = [random.Random(i).randbytes(stream_size) for i in range(num_streams)]
+    total = num_streams * stream_size
+    senders = {"fixed 1200": {"chunk_size": pmtu.payload_size(pmtu.BASE_DATAGRAM_SIZE, WIRE_VERSION)},
+               "fixed 1472": {"chunk_size": pmtu.payload_size(1472, WIRE_VERSION)},
+               "discovery": {"pmtu_discovery": True}}
+    print("\n== pmtu: fixed datagram sizes and path MTU discovery ==")
+    for mtu in mtus:
+        limit = mtu - pmtu.IP_UDP_OVERHEAD if mtu else None
+        for name, options in senders.items():
+            elapsed, server, client, relay = run_relay_transfer(data, 0.0, relay_options={"mtu": limit}, **options)
+            found = ""
+            if client.pmtu is not None:
+                found = (f", {client.pmtu.size} byte datagrams after {client.pmtu.probes_sent} probes "
+                         f"({client.pmtu.probes_lost} lost)")
+            print(f"  MTU {mtu or 'loopback':>8} {name:>10}: {total / elapsed / 1e6:>6.2f} MB/s, "
+                  f"{client.packet_number - 1} packets{found}, correct={data == server.files}")
+
+
+def bench_fec(loss_rates=(0.01, 0.03, 0.05), num_streams=4, stream_size=256 * 1024, delay=0.005, trials=5):
+    # completion time through a lossy relay with retransmissions only and with parity packets, the
+    # median of trials relay seeds (the same seeds for every sender)
+    data = [random.Random(i).randbytes(stream_size) for i in range(num_streams)]
+    senders = {"retransmit": {}, "fec 1/8": {"fec": True, "fec_ratio": 1 / 8}, "fec adaptive": {"fec": True}}
+    print(f"\n== fec: {num_streams} x {stream_size // 1024} KiB, {delay * 2000:.0f} ms round trip, "
+          f"median of {trials} seeds ==")
+    for loss in loss_rates:
+        for name, options in senders.items():
+            times, retransmitted, parity, rebuilt, correct = [], 0, 0, 0, True
+            for seed in range(1, trials + 1):
+                elapsed, server, client, relay = run_relay_transfer(data, loss, seed, relay_options={"delay": delay},
+                                                                    **options)
+                times.append(elapsed)
+                retransmitted += client.retransmitted_packets
+                if client.parity is not None:
+                    parity += client.parity.parity_packets
+                    rebuilt += server.connection.parity.recovered
+                correct = correct and data == server.files
+            print(f"  loss={loss:.0%} {name:>12}: {percentile(times, 0.5):.3f} s (p90 {percentile(times, 0.9):.3f}), "
+                  f"{retransmitted / trials:.0f} retransmissions, {parity / trials:.0f} parity packets, "
+                  f"{rebuilt / trials:.0f} rebuilt, correct={correct}")
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "reassembly": bench_reassembly,
+    "source": bench_source,
+    "engine": bench_engine,
+    "connections": bench_connections,
+    "workers": bench_workers,
+    "receive": bench_receive,
+    "acks": bench_acks,
+    "loss": bench_loss,
+    "congestion": bench_congestion,
+    "varint": bench_varint,
+    "scheduler": bench_scheduler,
+    "flow": bench_flow,
+    "impairment": bench_impairment,
+    "trace": bench_trace,
+    "handshake": bench_handshake,
+    "pmtu": bench_pmtu,
+    "fec": bench_fec,
+}
+
+
+
+# the reproducible suite
+
+SUITE_MATRIX = {
+    # parameter: default values, every combination is one case
+    "flows": [1, 4, 10],
+    "chunk_size": [1400],
+    "file_size": [256 * 1024],
+    "scheduler": ["round_robin"],
+    "pacing": ["paced"],
+    "engine": ["thread"],
+}
+HIGHER_IS_BETTER = {"bytes_per_sec", "packets_per_sec", "ops_per_sec"}
+SUITE_METRICS = ["bytes_per_sec", "packets_per_sec", "first_byte_latency", "completion_p50", "completion_max",
+                 "cpu_seconds", "seconds"]
+
+
+def make_files(num_flows, file_size, seed=0):
+    # the same random content for the same arguments, every run and every case
+    return [random.Random(seed * 1000 + i).randbytes(file_size) for i in range(num_flows)]
+
+
+def percentile(values, q):
+    # linear interpolation between the closest ranks, q in [0, 1]
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def summarize(values):
+    return {
+        "median": percentile(values, 0.5),
+        "mean": sum(values) / len(values),
+        "min": min(values),
+        "p25": percentile(values, 0.25),
+        "p75": percentile(values, 0.75),
+        "p90": percentile(values, 0.9),
+        "max": max(values),
+    }
+
+
+def run_trial(data, chunk_size=1400, scheduler="round_robin", pacing="paced", engine="thread", seed=0,
+              address=("127.0.0.1", 0)):
+    """
+    One loopback transfer of data, measured.
+
+    :param pacing: "paced" for the congestion controller's pacer, or a fixed interval in seconds.
+    :return: (dict of metrics, server).
+    """
+    random.seed(seed)       # the client draws its connection id (and a default chunk size) from it
+    gc.collect()
+    send_interval = None if pacing == "paced" else float(pacing)
+    cpu_start = time.process_time()
+    elapsed, server = run_transfer(data, engine, send_interval, {"chunk_size": chunk_size, "scheduling": scheduler},
+                                   address)
+    cpu_seconds = time.process_time() - cpu_start
+    connection = server.connection
+    payload = sum(len(item) for item in data)
+    completions = [completion for completion in connection.completion_times if completion > 0] or [elapsed]
+    first_frame = connection.stats.connection.first_time
+    metrics = {
+        "seconds": elapsed,
+        "bytes_per_sec": payload / elapsed,
+        "packets_per_sec": server.total_packets / elapsed,
+        # from the SYN to the first data packet, and to the last frame of each stream
+        "first_byte_latency": first_frame - connection.start_time if first_frame is not None else elapsed,
+        "completion_p50": percentile(completions, 0.5),
+        "completion_max": max(completions),
+        # of the whole process, the client and the server run in it
+        "cpu_seconds": cpu_seconds,
+        "complete": server.files == data,
+    }
+    return metrics, server
+
+
+def case_name(params):
+    return ",".join(f"{name}={value}" for name, value in params.items())
+
+
+def run_matrix(matrix, trials=5, warmup=1, seed=0, progress=print):
+    """
+    Run every combination of the matrix, warmup trials are not measured.
+
+    :param matrix: {parameter: list of values}, parameters missing from it take the first SUITE_MATRIX value.
+    :return: {case name: {"params", "trials", "summary"}}.
+    """
+    matrix = dict(SUITE_MATRIX, **matrix)
+    cases = {}
+    for values in itertools.product(*matrix.values()):
+        params = dict(zip(matrix, values))
+        data = make_files(params["flows"], params["file_size"], seed)
+        options = {name: params[name] for name in ("chunk_size", "scheduler", "pacing", "engine")}
+        for i in range(warmup):
+            run_trial(data, seed=seed + i, **options)
+        results = [run_trial(data, seed=seed + i, **options)[0] for i in range(trials)]
+        summary = {metric: summarize([result[metric] for result in results]) for metric in SUITE_METRICS}
+        summary["complete"] = all(result["complete"] for result in results)
+        name = case_name(params)
+        cases[name] = {"params": params, "trials": results, "summary": summary}
+        progress(f"  {name}: {summary['bytes_per_sec']['median'] / 1e6:.2f} MB/s median "
+                 f"(p25 {summary['bytes_per_sec']['p25'] / 1e6:.2f}, p75 {summary['bytes_per_sec']['p75'] / 1e6:.2f}), "
+                 f"completion {summary['completion_max']['median'] * 1000:.1f} ms, "
+                 f"cpu {summary['cpu_seconds']['median']:.3f} s, complete={summary['complete']}")
+    return cases
+
+
+def codec_cases():
+    # name: function, the microbenchmarks of quic.py
+    cases = {}
+    for version in (1, 2):
+        for frames_per_packet in (1, 10, 100):
+            packet = Quic_packet.deserialize(make_datagram(frames_per_packet, version=version))
+            datagram = packet.serialize()
+            cases[f"encode_v{version}_{frames_per_packet}_frames"] = packet.serialize
+            cases[f"decode_v{version}_{frames_per_packet}_frames"] = lambda datagram=datagram: Quic_packet.deserialize(datagram)
+            cases[f"encode_into_v{version}_{frames_per_packet}_frames"] = (
+                lambda packet=packet, buffer=bytearray(65536): packet.serialize_into(buffer))
+    ack = Quic_packet(ACK_FLAG, 7, 1, [AckFrame(1000, 0.001, [(i * 10, i * 10 + 5) for i in range(100, 0, -1)])])
+    ack_datagram = ack.serialize()
+    cases["encode_ack_100_ranges"] = ack.serialize
+    cases["decode_ack_100_ranges"] = lambda: Quic_packet.deserialize(ack_datagram)
+    varints = [serialize_varint(value) for value in (5, 300, 70000, 2 ** 40)]
+    cases["varint_encode"] = lambda: [serialize_varint(value) for value in (5, 300, 70000, 2 ** 40)]
+    cases["varint_decode"] = lambda: [deserialize_varint(encoded, 0) for encoded in varints]
+    return cases
+
+
+def run_codec(trials=5, duration=0.2, progress=print):
+    # calls per second of every codec case, measured trials times
+    results = {}
+    for name, function in codec_cases().items():
+        function()      # warmup
+        rates = [measure(function, duration) for _ in range(trials)]
+        results[name] = {"trials": rates, "summary": {"ops_per_sec": summarize(rates)}}
+        progress(f"  {name}: {results[name]['summary']['ops_per_sec']['median']:.0f} ops/s median")
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compare the medians of results with those of a baseline run (cases of both).
+
+    :param tolerance: relative change that counts as a regression (0.1 = 10% worse).
+    :return: list of (case, metric, baseline median, median, relative change) regressions.
+    """
+    regressions = []
+    for section in ("cases", "codec"):
+        for name, case in results.get(section, {}).items():
+            old_case = baseline.get(section, {}).get(name)
+            if old_case is None:
+                continue
+            for metric, summary in case["summary"].items():
+                if not isinstance(summary, dict) or metric not in old_case["summary"]:
+                    continue
+                old, new = old_case["summary"][metric]["median"], summary["median"]
+                if old == 0:
+                    continue
+                change = (new - old) / old
+                worse = -change if metric in HIGHER_IS_BETTER else change
+                if worse > tolerance:
+                    regressions.append((name, metric, old, new, change))
+    return regressions
+
+
+def suite_main(argv):
+    parser = argparse.ArgumentParser(prog="bench.py suite", description="Reproducible loopback benchmark matrix.")
+    parser.add_argument("--flows", type=int, nargs="+", default=SUITE_MATRIX["flows"])
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=SUITE_MATRIX["chunk_size"])
+    parser.add_argument("--file-size", type=int, nargs="+", default=SUITE_MATRIX["file_size"])
+    parser.add_argument("--scheduler", nargs="+", default=SUITE_MATRIX["scheduler"], choices=list(SCHEDULERS))
+    parser.add_argument("--pacing", nargs="+", default=SUITE_MATRIX["pacing"],
+                        help='"paced" or a fixed interval between packets in seconds')
+    parser.add_argument("--engine", nargs="+", default=SUITE_MATRIX["engine"], choices=["thread", "asyncio"])
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-codec", action="store_true", help="skip the quic.py codec microbenchmarks")
+    parser.add_argument("--no-transfers", action="store_true", help="only the codec microbenchmarks")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change reported as a regression")
+    args = parser.parse_args(argv)
+
+    matrix = {"flows": args.flows, "chunk_size": args.chunk_size, "file_size": args.file_size,
+              "scheduler": args.scheduler, "pacing": args.pacing, "engine": args.engine}
+    results = {
+        "config": dict(matrix, trials=args.trials, warmup=args.warmup, seed=args.seed),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+    }
+    if not args.no_transfers:
+        print("\n== suite: loopback transfers ==")
+        results["cases"] = run_matrix(matrix, args.trials, args.warmup, args.seed)
+    if not args.no_codec:
+        print("\n== suite: codec ==")
+        results["codec"] = run_codec(args.trials)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\n== suite: {len(regressions)} regressions against {args.baseline} ==")
+        for name, metric, old, new, change in regressions:
+            print(f"  {name} {metric}: {old:.6g} -> {new:.6g} ({change:+.1%})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["suite"]:
+        sys.exit(suite_main(sys.argv[2:]))
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
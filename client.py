@@ -8,11 +8,26 @@ import os
 
 # each packet contains frames from diffrent streams,where each stream have the same size of the quic packet
 from quic import *
+from source import StreamSource, BufferSource, MappedFileSource
+from recovery import LossRecovery, INITIAL_RTT
+from congestion import CONTROLLERS, Pacer, INITIAL_WINDOW_PACKETS
+from scheduler import SCHEDULERS, StreamState, frame_cost
+from flow_control import SendCredit
+from collections import deque
+import errno
+import select
 import socket
 import threading
 import time
 import random
-import string
+
+import corpus
+import fec
+import integrity
+import pmtu
+import resumption
+import tracing
+import transport
 
 
 class Client:
@@ -20,95 +35,500 @@ class Client:
         self.server_address = (ip, port)
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.chunk_size = random.randint(1000, 2000)  # Consistent chunk size for each packet
-        self.stream_id_counter = 0
-
+        self.connection_id = random.randint(1, 2 ** 32 - 1)    # the server tells our transfers apart by it
+        self.wire_version = WIRE_VERSION    # 1 for the fixed-size header and frame fields
+        self.bytes_sent = 0
+        self.congestion_control = "newreno"     # or "cubic", see congestion.CONTROLLERS
+        self.scheduling = "round_robin"     # or "weighted_fair" / "priority", see scheduler.SCHEDULERS
+        self.quantum = 1200             # bytes of a stream's turn in the scheduler
+        self.stream_weights = None      # weight of each stream (weighted_fair), 1 by default
+        self.stream_priorities = None   # priority of each stream (priority, lower first), 0 by default
+        self.send_interval = None       # optional least time between two data packets (seconds)
+        self.transport = None           # asyncio datagram transport, set by transport.connect
+        self.acked_packets = 0
+        self.largest_acked = 0
+        self.delivered_bytes = 0
+        self.retransmitted_packets = 0
+        self.fin_retries = 5            # FIN packets sent before giving up on the FIN-ACK
+        self.fin_acked = False
+        self.max_probe_timeouts = 5     # probe timeouts in a row before giving up on the server (about 20 s)
+        self.idle_timeout = 30.0        # seconds without a packet of the server before giving up on the transfer
+        self.last_received = None
+        self.recovery = LossRecovery()
+        self.retransmit_queue = deque()     # (stream_id, offset, length) ranges to send again
+        self.scheduler = None
+        self.stream_hashes = []         # running hash of the data sent on each stream, sent in the FIN
+        self.credit = SendCredit()      # flow control limits of the server, from the SYN-ACK and the ACKs
+        self.flow_blocked_packets = 0   # packets sent to ask for credits while blocked
+        self.send_buffer = bytearray(65536)     # every packet is written into it, no bytes object per packet
+        self.send_view = memoryview(self.send_buffer)
+        self.frame_pool = FramePool()   # frames of the sent packets, reused by the next ones
+        self.tracer = None              # tracing.Tracer recording the packet events, closed with the client
+        self.tokens = resumption.TOKENS     # resumption tokens by server address, from the SYN-ACKs
+        self.syn_acked = False
+        self.syn_timeout = 2.0          # seconds to wait for the SYN-ACK
+        self.pmtu_discovery = False     # search the path MTU and size the packets by it instead of chunk_size
+        self.max_datagram_size = None   # upper bound of the search, the route's MTU by default
+        self.pmtu = None                # pmtu.PathMtu of the transfer with pmtu_discovery
+        self.fec = False                # send parity packets the server rebuilds lost packets from
+        self.fec_ratio = None           # parity packets per data packet, None to follow the loss rate
+        self.parity = None              # fec.ParityEncoder of the transfer with fec
 
-    def generate_random_files(self, num_flows):
+    def generate_random_files(self, num_flows, file_size=2 * 1024 * 1024, seed=None, cache_dir=corpus.CACHE_DIR):
         """
-                Generate random binary files for the given number of flows (streams).
-                Each file is 2MB in size.
+                Generate random files of letters and digits for the given number of flows (streams).
+                Each file is 2MB in size by default.
 
                 :param num_flows: Number of files (streams) to generate.
+                :param file_size: Size of each file in bytes.
+                :param seed: Same seed, same files (generated once and cached), None for new random files.
+                :param cache_dir: Directory of the cached seeded files.
                 :return: List of generated file paths.
                 """
         files = []
-        file_size = 2 * 1024 * 1024  # 2MB in bytes
+        if seed is not None:
+            cached = corpus.cached_corpus(num_flows, file_size, seed, cache_dir)
         for i in range(num_flows):
             file_name = f'random_file_{i}.txt'
-            with open(file_name, 'w') as f:
-                # Generate random bytes of size 2MB (2 * 1024 * 1024 bytes)
-                random_data = ''.join(random.choices(string.ascii_letters + string.digits, k=file_size))
-                f.write(random_data)
+            if seed is None:
+                corpus.write_file(file_name, file_size)
+            else:
+                corpus.place(cached[i], file_name)
             files.append(file_name)
         return files
 
-    def create_packet(self, packet_number, data, offsets, percentage=60):
+    def create_packet(self, packet_number):
+        """
+        Build the next data packet with the frames chosen by the scheduler, its payload (frame
+        headers and data) is chunk_size bytes unless the streams run out of data.
 
-        flags = 0b00000010  # Data flag indicating this packet contains data frames
-        total_streams = len(data)
-        frame_percentage = round(total_streams * (percentage / 100))
-        frames_num = min(frame_percentage, total_streams)
-        frame_size = round(self.chunk_size / frames_num)
+        :param packet_number: The packet number of the new packet.
+        """
         frames = []
-        streams_to_remove = []
-
-        # Iterate over streams in sequential order (0 to len(data)-1)
-        for stream_id in range(total_streams):
-            if len(frames) >= frames_num:
-                break
-
-            if stream_id >= len(data):
-                continue
-
-            stream_data = data[stream_id]
-            chunk_data = stream_data[offsets[stream_id]:offsets[stream_id] + frame_size]
-            frames.append(Frame(stream_id + self.stream_id_counter, offsets[stream_id], len(chunk_data), chunk_data))
-            offsets[stream_id] += len(chunk_data)
+        for stream, offset, length in self.scheduler.fill(self.packet_space(), self.wire_version, self.credit.available()):
+            chunk_data = stream.source.read(offset, length)     # zero-copy view pulled on demand
+            self.stream_hashes[stream.stream_id].update(chunk_data)     # new data comes in offset order
+            self.credit.sent += length
+            frames.append(self.frame_pool.acquire(stream.stream_id, offset, len(chunk_data), chunk_data))
 
             # Check if the entire stream has been sent
-            if offsets[stream_id] >= len(stream_data):
-                streams_to_remove.append(stream_id)
-                print(f"File corresponding to stream {stream_id + self.stream_id_counter} fully sent with size {len(stream_data)} bytes")
-
-        # Remove fully sent streams
-        for stream_id in sorted(streams_to_remove, reverse=True):
-            if stream_id < len(data):
-                data.pop(stream_id)
-                self.stream_id_counter += 1
-                offsets.pop(stream_id)
-        packet = Quic_packet(flags=flags, packet_number=packet_number, connection_id=1, frames=frames)
-        return packet, data, offsets
+            if stream.finished and stream.finish_time is None:
+                stream.finish_time = time.monotonic()
+                print(f"File corresponding to stream {stream.stream_id} fully sent with size {stream.size} bytes")
+        return Quic_packet(flags=DATA_FLAG, packet_number=packet_number, connection_id=self.connection_id, frames=frames,
+                           version=self.wire_version)
 
     def send_packet(self, packet):
         """
         Send the given packet to the server.
 
         :param packet: The QUIC packet to be sent.
+        :return: size of the datagram, it stays in send_view until the next packet (or path MTU probe).
         """
-        serialized_packet = packet.serialize()
-        self.client_socket.sendto(serialized_packet, self.server_address)
+        if self.parity is not None and packet.header.flags == DATA_FLAG:
+            packet.header.flags |= PARITY_FLAG
+        size = packet.serialize_into(self.send_view)  # through the view, a bytearray would copy the data first
+        # keep the stream ranges of the packet until it is acknowledged, to send them again if it is lost
+        # (the resumption token of a SYN is not stream data)
+        ranges = [(frame.stream_id, frame.offset, frame.data_length) for frame in packet.frames
+                  if frame.stream_id != resumption.CONTROL_STREAM_ID]
+        now = time.monotonic()
+        self.recovery.on_packet_sent(packet.header.packet_number, ranges, size, now)
+        self.congestion.on_packet_sent(size)
+        self.pacer.on_packet_sent(size, now)
+        self.last_send_time = now
+        self.probes_pending = max(self.probes_pending - 1, 0)
+        self.sendto(self.send_view[:size], self.server_address)
+        if self.tracer is not None:
+            self.tracer.record(tracing.PACKET_SENT, self.connection_id, 0, packet.header.packet_number, size,
+                               int(self.congestion.cwnd))
+        if packet.header.flags & PARITY_FLAG:
+            payload = fec.payload_size(packet.frames, self.wire_version)
+            # the parity of a group goes out after its last packet, or at once when there is nothing more to send
+            if self.parity.add(packet.header.packet_number, self.send_view[size - payload:size]) or not self.has_data():
+                self.send_parity()
+        self.frame_pool.release(packet.frames)
+        if self.pmtu is not None and not packet.header.flags & SYN_FLAG:
+            self.send_probe(now)
         # print(f"Sent packet to {self.server_address} with packet number {packet.header.packet_number}")
+        return size
+
+    def send_parity(self):
+        # the parity packet of the open group, congestion controlled but never sent again
+        packet = self.parity.build(self.packet_number, self.connection_id)
+        self.packet_number += 1
+        size = packet.serialize_into(self.send_view)
+        now = time.monotonic()
+        self.recovery.on_packet_sent(packet.header.packet_number, [], size, now)
+        self.congestion.on_packet_sent(size)
+        self.pacer.on_packet_sent(size, now)
+        self.sendto(self.send_view[:size], self.server_address)
+
+    def hold_lost(self, packets):
+        # the lost packets whose parity is on its way are only sent again if the server cannot rebuild them
+        if self.parity is None:
+            return packets
+        if self.parity.in_open_group(packets):
+            self.send_parity()
+        return self.parity.hold(packets, self.recovery.sent)
+
+    def release_held(self):
+        if self.parity is not None:
+            self.retransmit(self.parity.release(self.recovery.acked, self.recovery.sent))
+
+    def send_probe(self, now):
+        # a path MTU probe when one is due, after a data packet. It is neither congestion controlled
+        # nor sent again, a probe without an ACK within the probe timeout counts as lost (the server
+        # acknowledges probes right away, the timeout leaves out its ACK delay)
+        rtt = self.recovery.rtt
+        size = self.pmtu.due(now, rtt.pto() - rtt.max_ack_delay)
+        if size is None:
+            return
+        probe_number = self.pmtu.probes_sent + 1    # probes have packet numbers of their own
+        datagram_size = pmtu.build_probe(self.send_view, size, probe_number, self.connection_id, self.wire_version)
+        try:
+            self.sendto(self.send_view[:datagram_size], self.server_address)
+        except OSError as e:
+            if e.errno != errno.EMSGSIZE:
+                raise
+            self.pmtu.on_too_large(size)    # larger than the MTU of the interface
+            return
+        self.pmtu.on_probe_sent(probe_number, size, now)
+
+    def on_path_mtu(self):
+        # the packets are built for the datagram size the path MTU search confirmed
+        self.chunk_size = pmtu.payload_size(self.pmtu.size, self.wire_version)
+        self.congestion.set_max_datagram_size(self.pmtu.size)
+
+    def on_path_losses(self, acked, lost, timeout=False):
+        # losses of large packets with nothing acknowledged may be a path MTU black hole (a route change)
+        size = self.pmtu.size
+        if timeout:
+            self.pmtu.on_timeout(lost)
+        else:
+            self.pmtu.on_packets(acked, lost)
+        if self.pmtu.size != size:
+            print(f"Path MTU black hole, back to {self.pmtu.size} byte datagrams")
+            self.on_path_mtu()
 
     def send_all_packets(self, data):
+        # blocking sender: packets go out as the congestion window and the pacer allow until every
+        # packet is acknowledged, then FIN. The ACKs of the server are read while waiting
+        self.begin_transfer(data)
+        self.transfer()
+
+    def send_all_packets_early(self, data):
+        """
+        Handshake and transfer at once (0-RTT): the SYN carries the first data frames. With a
+        resumption token of the server the next packets follow right away, without one they wait
+        for the SYN-ACK, which brings a token for the next connection.
+
+        :param data: list of stream sources, bytes-like objects or strings (one per stream).
+        """
+        self.credit = SendCredit()      # a new connection, the SYN-ACK brings its limits
+        self.syn_acked = False
+        self.begin_transfer(data)
+        token = self.tokens.get(self.server_address)
+        packet = self.next_packet()
+        packet.header.flags |= SYN_FLAG
+        if token is not None:
+            packet.frames.append(resumption.token_frame(token))
+        size = self.send_packet(packet)
+        print(f"Sent SYN packet with data to {self.server_address}, resumption token: {token is not None}")
+        if token is None:
+            self.wait_syn_ack(bytes(self.send_view[:size]))
+        self.transfer()
+
+    def wait_syn_ack(self, syn):
+        # wait for the SYN-ACK (or an ACK of the data of the SYN), the SYN is sent again every probe timeout
+        deadline = time.monotonic() + self.syn_timeout
+        while not self.syn_acked and not self.acked_packets:
+            now = time.monotonic()
+            if now >= deadline:
+                print("No response received from the server. Closing the connection.")
+                self.close()
+                raise Exception("No response received from the server. Closing the connection.")
+            until = min(deadline, now + self.recovery.rtt.pto())
+            self.receive_packets(until)
+            if not self.syn_acked and not self.acked_packets and time.monotonic() >= until:
+                self.sendto(syn, self.server_address)
+
+    def transfer(self):
+        # the sending loop of the prepared streams, then FIN
+        while self.has_data() or self.in_flight():
+            send_time = self.send_time()
+            if send_time is not None and send_time <= time.monotonic():
+                self.send_packet(self.next_packet())
+                self.receive_packets(time.monotonic())  # only the ACKs already queued
+            else:
+                self.receive_packets(self.wake_time())
+            self.check_timeout()
+        self.end_transfer()
+        for _ in range(self.fin_retries - 1):
+            until = time.monotonic() + self.recovery.rtt.pto()
+            while not self.fin_acked and time.monotonic() < until:
+                self.receive_packets(until)
+            if self.fin_acked:
+                break
+            self.send_fin_massage(self.server_address, self.packet_number, self.connection_id)
+
+    def receive_packets(self, until):
+        # wait until a packet of the server arrives or the monotonic time until (None: no limit), then handle
+        # the queued ones
+        timeout = max(until - time.monotonic(), 0) if until is not None else None
+        while select.select([self.client_socket], [], [], timeout)[0]:
+            data, server_address = self.client_socket.recvfrom(65536)
+            self.on_packet(Quic_packet.deserialize(data))
+            timeout = 0
+
+    async def send_all_packets_async(self, data):
+        """
+        Same as send_all_packets but paced by the running event loop, ACKs are received concurrently.
+        The socket must have been attached with connect_async first.
+        """
+        await transport.send_all(self, data)
+
+    async def connect_async(self):
+        # SYN / SYN-ACK handshake on the running event loop
+        await transport.connect(self)
+
+    async def run_async(self, data):
+        # handshake, send every stream and close, all on one event loop
+        await self.connect_async()
+        await self.send_all_packets_async(data)
+        self.close()
+
+    def begin_transfer(self, data):
+        """
+        Prepare the streams of data for next_packet.
+
+        :param data: list of stream sources, bytes-like objects or strings (one per stream).
+        """
         if self.check_data(data) == False:
-            raise TypeError("Data must be a list of strings.")
+            raise TypeError("Data must be a list of stream sources, bytes-like objects or strings.")
 
-        packet_number = 1
-        offsets = [0 for _ in range(len(data))]
-        fin_sent = False
+        # every stream is read on demand from a source, in-memory files are wrapped as zero-copy
+        # views (str files are encoded once here as a compatibility shim)
+        self.sources = [item if isinstance(item, StreamSource) else BufferSource(item) for item in data]
+        # the stream ID of a file is its index in data for the whole transfer
+        self.scheduler = SCHEDULERS[self.scheduling](self.quantum)
+        for stream_id, source in enumerate(self.sources):
+            weight = self.stream_weights[stream_id] if self.stream_weights else 1
+            priority = self.stream_priorities[stream_id] if self.stream_priorities else 0
+            if weight <= 0:
+                raise ValueError(f"The weight of stream {stream_id} must be positive.")
+            self.scheduler.add(StreamState(stream_id, source, weight, priority))
+        self.credit.apply(self.scheduler.streams)
+        self.stream_hashes = [integrity.new_hash() for _ in self.sources]
+        self.packet_number = 1
+        self.fin_acked = False
+        self.last_received = time.monotonic()
+        self.recovery = LossRecovery()
+        self.retransmit_queue.clear()
+        self.parity = fec.ParityEncoder(self.wire_version, self.fec_ratio) if self.fec else None
+        self.pmtu = None
+        if self.pmtu_discovery:
+            self.pmtu = pmtu.PathMtu(min(pmtu.route_limit(self.server_address),
+                                         self.max_datagram_size or pmtu.MAX_UDP_PAYLOAD))
+            pmtu.set_dont_fragment(self.client_socket)
+            self.chunk_size = pmtu.payload_size(self.pmtu.size, self.wire_version)
+        self.congestion = CONTROLLERS[self.congestion_control](self.chunk_size + HEADER_SIZE)
+        self.pacer = Pacer(INITIAL_WINDOW_PACKETS * self.congestion.max_datagram_size, self.congestion.cwnd / INITIAL_RTT)
+        self.last_send_time = None
+        self.probes_pending = 0     # probe packets may be sent beyond the congestion window
+
+    def has_data(self):
+        return self.scheduler.has_data() or bool(self.retransmit_queue)
+
+    def in_flight(self):
+        # data packets that were neither acknowledged nor declared lost
+        return bool(self.recovery.sent)
+
+    @property
+    def unacked_packets(self):
+        return self.recovery.sent
+
+    def flow_blocked(self):
+        # new data waits for flow control credits of the server
+        return not self.retransmit_queue and not self.scheduler.ready(self.credit.available())
+
+    def next_packet(self):
+        # build the next data packet of the transfer, lost ranges go before new data
+        if self.retransmit_queue:
+            packet = self.create_retransmission(self.packet_number)
+        elif self.flow_blocked():
+            packet = self.create_blocked_packet(self.packet_number)
+        else:
+            packet = self.create_packet(self.packet_number)
+        self.packet_number += 1
+        return packet
+
+    def packet_space(self):
+        # payload of a data packet, with fec the parity packet covering it is larger by the parity header
+        if self.parity is not None:
+            return self.chunk_size - self.parity.overhead
+        return self.chunk_size
+
+    def create_retransmission(self, packet_number):
+        # a new packet with lost stream ranges, as many as fit in chunk_size (frame headers included).
+        # A range larger than the space left is split, the packets may have become smaller (pmtu.py)
+        frames = []
+        space = self.packet_space()
+        while self.retransmit_queue:
+            stream_id, offset, length = self.retransmit_queue[0]
+            fit = max_frame_data(offset, space, self.wire_version)
+            if fit <= 0 and frames:
+                break
+            self.retransmit_queue.popleft()
+            if length > fit > 0:
+                self.retransmit_queue.appendleft((stream_id, offset + fit, length - fit))
+                length = fit
+            chunk_data = self.scheduler.streams[stream_id].source.read(offset, length)
+            frames.append(self.frame_pool.acquire(stream_id, offset, len(chunk_data), chunk_data))
+            space -= frame_cost(offset, length, self.wire_version)
+        self.retransmitted_packets += 1
+        return Quic_packet(flags=DATA_FLAG, packet_number=packet_number, connection_id=self.connection_id, frames=frames,
+                           version=self.wire_version)
+
+    def create_blocked_packet(self, packet_number):
+        # an empty frame at the end of a blocked stream, the server answers it with all its limits
+        # again. Only sent with nothing in flight (no ACK would bring credits), it is sent again if lost
+        stream = next(stream for stream in self.scheduler.active if stream.remaining > 0)
+        self.flow_blocked_packets += 1
+        return Quic_packet(flags=DATA_FLAG, packet_number=packet_number, connection_id=self.connection_id,
+                           frames=[Frame(stream.stream_id, stream.sent, 0, b"")], version=self.wire_version)
+
+    def send_time(self):
+        # monotonic time the next data packet may be sent, None while the congestion window is full
+        # or flow control blocks the streams until the ACKs of the packets in flight
+        if not self.has_data():
+            return None
+        if self.in_flight() and self.flow_blocked():
+            return None
+        if not self.congestion.can_send() and not self.probes_pending:
+            return None
+        send_time = self.pacer.next_send_time(time.monotonic())
+        if self.send_interval and self.last_send_time is not None:
+            send_time = max(send_time, self.last_send_time + self.send_interval)
+        return send_time
+
+    def next_timeout(self):
+        # monotonic time of the next loss or probe timer, None when nothing is in flight
+        return self.recovery.deadline()
+
+    def wake_time(self):
+        # the sender has nothing to do before this monotonic time unless an ACK arrives
+        times = [t for t in (self.send_time(), self.next_timeout(), self.idle_deadline()) if t is not None]
+        return min(times) if times else None
+
+    def idle_deadline(self):
+        # monotonic time the transfer is given up at unless a packet of the server arrives
+        return self.last_received + self.idle_timeout if self.last_received is not None else None
+
+    def give_up(self):
+        # the server does not answer (gone, or it dropped the connection): FIN and close
+        print("No response received from the server. Closing the connection.")
+        self.end_transfer()
+        self.close()
+        raise Exception("No response received from the server. Closing the connection.")
 
-        while data:
-            packet, data, offsets = self.create_packet(packet_number, data, offsets)
-            self.send_packet(packet)
-            time.sleep(0.0005)
-            packet_number += 1
+    def check_timeout(self):
+        # queue the ranges of the packets lost when the recovery timer expired
+        deadline = self.recovery.deadline()
+        now = time.monotonic()
+        if now >= self.idle_deadline():
+            self.give_up()
+        if deadline is not None and now >= deadline:
+            probe = self.recovery.loss_time is None
+            if probe and self.recovery.pto_count >= self.max_probe_timeouts:
+                self.give_up()
+            packets = self.recovery.on_timeout(now)
+            if probe and self.parity is not None and packets and not packets[0].ranges:
+                # a parity packet is not probed, it is given up and what its group lost is sent again
+                del self.recovery.sent[packets[0].packet_number]
+                self.congestion.on_packets_lost(packets, now)
+            elif probe:
+                self.probes_pending += 1    # still in flight, the copy is not limited by the window
+            else:
+                self.congestion.on_packets_lost(packets, now)
+            if self.pmtu is not None:
+                self.on_path_losses([], packets, timeout=True)
+            if self.tracer is not None:
+                self.tracer.record(tracing.LOSS_TIMEOUT, self.connection_id, 0, 0, len(packets), probe)
+            self.retransmit(packets if probe else self.hold_lost(packets))
+            self.release_held()
 
-        if not fin_sent:
-            self.send_fin_massage(self.server_address, packet_number, 1)
-            fin_sent = True
+    def retransmit(self, packets):
+        for packet in packets:
+            self.retransmit_queue.extend(packet.ranges)
 
+    def end_transfer(self):
+        self.send_fin_massage(self.server_address, self.packet_number, self.connection_id)
+        for source in self.sources:
+            source.close()
         print("All data has been sent")
 
+    def on_credits(self, packet):
+        # new flow control limits, the MaxDataFrame is the last frame of the packet
+        if not packet.header.flags & MAX_DATA_FLAG:
+            return
+        self.credit.on_frame(packet.frames[-1])
+        if self.scheduler is not None:
+            self.credit.apply(self.scheduler.streams)
+
+    def on_syn_ack(self, packet):
+        # the handshake is done, keep the limits and the resumption token of the server
+        self.syn_acked = True
+        self.on_credits(packet)
+        token = resumption.find_token(packet)
+        if token is not None:
+            self.tokens[self.server_address] = token
+
+    def on_packet(self, packet):
+        # a packet from the server acknowledging data (or the FIN), or the SYN-ACK of a handshake with data
+        self.last_received = time.monotonic()
+        if packet.header.flags & SYN_FLAG:
+            self.on_syn_ack(packet)
+            return
+        if packet.header.flags & PROBE_FLAG:
+            if self.pmtu is not None and self.pmtu.on_ack(packet.frames[0]):
+                self.on_path_mtu()
+            return
+        self.on_credits(packet)
+        if packet.header.flags & FIN_FLAG:
+            self.fin_acked = True
+        if not packet.header.flags & ACK_FLAG:
+            return
+        frame = packet.frames[0]
+        self.largest_acked = max(self.largest_acked, frame.largest_acknowledged)
+        now = time.monotonic()
+        largest_acked = self.recovery.largest_acked
+        acked, lost = self.recovery.on_ack_received(frame, now)
+        self.acked_packets += len(acked)
+        self.delivered_bytes += sum(sent.size for sent in acked)
+        self.congestion.on_packets_acked(acked, now, self.recovery.rtt)
+        self.congestion.on_packets_lost(lost, now)
+        self.pacer.set_rate(self.congestion.cwnd, self.recovery.rtt.smoothed_rtt, self.congestion.in_slow_start())
+        if self.parity is not None:
+            # a loss the server repaired before it was noticed shows as a late acknowledgement
+            late = 0 if largest_acked is None else sum(1 for sent in acked if sent.packet_number < largest_acked)
+            self.parity.on_ack(len(acked), len(lost) + late)
+        if self.pmtu is not None:
+            self.on_path_losses(acked, lost)
+        self.retransmit(self.hold_lost(lost))
+        self.release_held()
+        if self.tracer is not None:
+            self.tracer.record(tracing.ACK_RECEIVED, self.connection_id, 0, packet.header.packet_number, len(acked),
+                               len(lost))
+
+    def sendto(self, datagram, address):
+        # send through the asyncio transport when the event loop drives the client, else the socket
+        self.bytes_sent += len(datagram)
+        if self.transport is not None:
+            self.transport.sendto(datagram, address)
+        else:
+            self.client_socket.sendto(datagram, address)
+
     def send_syn(self):
         """
                Send a SYN packet to initiate the connection with the server.
@@ -116,13 +536,14 @@ class Client:
         # Set up a QUIC packet with the SYN flag set (assuming SYN is the first bit)
         flags = 0b00000001  # SYN flag
         packet_number = 1
-        connection_id = 1
+        connection_id = self.connection_id
         # frame will contain the word "SYN"
         frame = Frame(1, 0, 3, "SYN")
+        self.credit = SendCredit()      # a new connection, the SYN-ACK brings its limits
 
-        packet = Quic_packet(flags, packet_number, connection_id, [frame])
+        packet = Quic_packet(flags, packet_number, connection_id, [frame], self.wire_version)
         serialized_packet = packet.serialize()
-        self.client_socket.sendto(serialized_packet, self.server_address)
+        self.sendto(serialized_packet, self.server_address)
         print(f"Sent SYN packet to {self.server_address} with flags {flags}")
 
     def receive_ack(self):
@@ -134,9 +555,10 @@ class Client:
             data, server_address = self.client_socket.recvfrom(1024)
             print(f"Received packet from {server_address}")
             packet = Quic_packet.deserialize(data)
+            self.on_syn_ack(packet)
 
             if packet.header.flags & 0b00000011:
-                print(f"Received packet with packet number {packet.header.packet_number} and connection ID {packet.header.connection_id} and data {packet.frames[0].data}")
+                print(f"Received packet with packet number {packet.header.packet_number} and connection ID {packet.header.connection_id} and data {str(packet.frames[0].data, 'utf-8')}")
         except socket.timeout:
             print("No response received from the server. Closing the connection.")
             self.close()
@@ -146,25 +568,33 @@ class Client:
         """
                 Close the client socket connection.
          """
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        if self.tracer is not None:
+            self.tracer.close()
         self.client_socket.close()
 
     def send_fin_massage(self, server_address, packet_number, connection_id):
         flags = 0b00000100
-        frame = Frame(1, 0, 3, "FIN")
-        packet = Quic_packet(flags, packet_number, connection_id, [frame])
+        # the size and digest of every stream, the server checks the received data with them
+        frames = []
+        if self.scheduler is not None:
+            frames = integrity.fin_frames(self.stream_hashes, [stream.size for stream in self.scheduler.streams])
+        packet = Quic_packet(flags, packet_number, connection_id, frames or [Frame(1, 0, 3, "FIN")], self.wire_version)
         serialized_packet = packet.serialize()
-        self.client_socket.sendto(serialized_packet, server_address)
+        self.sendto(serialized_packet, server_address)
         print(f"Sent FIN packet to {server_address}")
 
     def start(self, num_flows):
         client = Client("localhost", 12346)
         client.send_syn()
-        client.receive_ack()
         num_files = num_flows  # Number of files
-        files = client.generate_random_files(num_files)  # Generate X random files
+        files = client.generate_random_files(num_files)  # Generate X random files while the SYN-ACK is on its way
+        client.receive_ack()
 
-        # Load the content of the generated files into memory
-        data = [open(file, 'r').read() for file in files]
+        # Map the generated files, their chunks are read lazily while sending
+        data = [MappedFileSource(file) for file in files]
         # data = [(file_id, file_data) for file_id, file_data in files]
 
         client.send_all_packets(data)  # Send packets until all files are fully transmitted
@@ -175,6 +605,6 @@ class Client:
         if not isinstance(data, list):
             return False
         for item in data:
-            if not isinstance(item, str):
+            if not isinstance(item, (str, bytes, bytearray, memoryview, StreamSource)):
                 return False
         return True
\ No newline at end of file
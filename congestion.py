@@ -0,0 +1,150 @@
+# congestion control and pacing of the sender
+# the congestion controller keeps a congestion window (cwnd): the most bytes that may be in
+# flight, i.e. sent but neither acknowledged nor declared lost. The window grows with every ACK
+# and shrinks when packets are lost (NewReno after RFC 9002, or CUBIC after RFC 9438). The
+# packets of a window are not sent in one burst but spread by a token-bucket pacer over the
+# round trip time, at a rate of about cwnd / smoothed RTT, so the rate follows the path.
+
+INITIAL_WINDOW_PACKETS = 10
+MINIMUM_WINDOW_PACKETS = 2
+LOSS_REDUCTION_FACTOR = 0.5
+
+
+class NewReno:
+    # slow start, then one packet more per window acknowledged, half the window on a loss
+    def __init__(self, max_datagram_size=1500):
+        self.max_datagram_size = max_datagram_size
+        self.cwnd = INITIAL_WINDOW_PACKETS * max_datagram_size
+        self.minimum_window = MINIMUM_WINDOW_PACKETS * max_datagram_size
+        self.ssthresh = float("inf")
+        self.bytes_in_flight = 0
+        self.recovery_start_time = None     # packets sent before it do not cause another reduction
+        self.congestion_events = 0
+
+    def set_max_datagram_size(self, size):
+        # the path MTU search changed the size of the packets (pmtu.py), the window keeps its bytes
+        self.max_datagram_size = size
+        self.minimum_window = MINIMUM_WINDOW_PACKETS * size
+        self.cwnd = max(self.cwnd, self.minimum_window)
+
+    def can_send(self):
+        return self.bytes_in_flight < self.cwnd
+
+    def in_slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    def on_packet_sent(self, size):
+        self.bytes_in_flight += size
+
+    def on_packets_acked(self, packets, now, rtt):
+        """
+        :param packets: the newly acknowledged SentPackets.
+        :param rtt: the RttEstimator, updated with this ACK.
+        """
+        for packet in packets:
+            self.bytes_in_flight -= packet.size
+            if self.in_recovery(packet.time_sent):
+                continue    # no growth for what was sent before the last reduction
+            if self.in_slow_start():
+                self.cwnd += packet.size
+            else:
+                self.increase(packet.size, now, rtt)
+
+    def increase(self, acked_bytes, now, rtt):
+        # congestion avoidance: about one datagram per window acknowledged
+        self.cwnd += self.max_datagram_size * acked_bytes / self.cwnd
+
+    def on_packets_lost(self, packets, now):
+        if not packets:
+            return
+        for packet in packets:
+            self.bytes_in_flight -= packet.size
+        if not self.in_recovery(max(packet.time_sent for packet in packets)):
+            self.recovery_start_time = now
+            self.congestion_events += 1
+            self.reduce(now)
+
+    def reduce(self, now):
+        self.ssthresh = max(self.cwnd * LOSS_REDUCTION_FACTOR, self.minimum_window)
+        self.cwnd = self.ssthresh
+
+    def in_recovery(self, time_sent):
+        return self.recovery_start_time is not None and time_sent <= self.recovery_start_time
+
+
+class Cubic(NewReno):
+    # the window follows a cubic function of the time since the last loss: it returns quickly
+    # to the window of the loss (w_max), stays around it, then probes beyond it
+    C = 0.4         # in datagrams / second^3
+    BETA = 0.7      # window kept on a loss
+
+    def __init__(self, max_datagram_size=1500):
+        super().__init__(max_datagram_size)
+        self.w_max = 0
+        self.k = 0
+        self.epoch_start = None
+        self.w_est = 0      # window a Reno sender would have, CUBIC is never slower
+
+    def increase(self, acked_bytes, now, rtt):
+        segment = self.max_datagram_size
+        if self.epoch_start is None:
+            self.epoch_start = now
+            self.w_max = max(self.w_max, self.cwnd)
+            self.k = ((self.w_max - self.cwnd) / segment / self.C) ** (1 / 3)
+            self.w_est = self.cwnd
+        t = now - self.epoch_start + rtt.smoothed_rtt
+        target = self.C * (t - self.k) ** 3 * segment + self.w_max
+        target = min(max(target, self.cwnd), 1.5 * self.cwnd)
+        alpha = 3 * (1 - self.BETA) / (1 + self.BETA)
+        self.w_est += alpha * segment * acked_bytes / self.cwnd
+        if self.w_est > target:
+            target = self.w_est
+        if target > self.cwnd:
+            self.cwnd += (target - self.cwnd) * acked_bytes / self.cwnd
+
+    def reduce(self, now):
+        if self.cwnd < self.w_max:
+            self.w_max = self.cwnd * (1 + self.BETA) / 2    # fast convergence, leave room for other flows
+        else:
+            self.w_max = self.cwnd
+        self.ssthresh = max(self.cwnd * self.BETA, self.minimum_window)
+        self.cwnd = self.ssthresh
+        self.epoch_start = None
+
+
+CONTROLLERS = {"newreno": NewReno, "cubic": Cubic}
+
+
+class Pacer:
+    # token bucket: tokens (bytes) refill at the pacing rate up to a burst, a packet may be sent
+    # while there are tokens left, sending takes its size from the bucket
+    def __init__(self, burst, rate):
+        """
+        :param burst: size of the bucket in bytes, the most sent back to back.
+        :param rate: refill rate in bytes per second.
+        """
+        self.burst = burst
+        self.rate = rate
+        self.tokens = burst
+        self.last_update = None
+
+    def set_rate(self, cwnd, smoothed_rtt, slow_start):
+        # spread a window over the RTT, faster in slow start so the window can still double
+        gain = 2.0 if slow_start else 1.25
+        self.rate = gain * cwnd / max(smoothed_rtt, 0.0001)
+
+    def refill(self, now):
+        if self.last_update is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+
+    def next_send_time(self, now):
+        # monotonic time from which the next packet may be sent
+        self.refill(now)
+        if self.tokens > 0:
+            return now
+        return now - self.tokens / self.rate
+
+    def on_packet_sent(self, size, now):
+        self.refill(now)
+        self.tokens -= size
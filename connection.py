@@ -0,0 +1,216 @@
+# per-connection state of the server
+# every client connection is identified by (client address, connection id) from the packet
+# header, so one server can receive many transfers at the same time: each Connection keeps
+# its own streams and statistics, and the ConnectionTable finds the connection of a packet,
+# evicts connections that were idle for too long and bounds how many are kept at once.
+
+import os
+import time
+from collections import OrderedDict
+
+from ack import AckTracker
+from flow_control import FlowController
+from integrity import StreamDigest
+from quic import WIRE_VERSION
+from reassembly import StreamBuffer
+from stats import ConnectionStats
+from sink import DiskSink
+
+
+class Connection:
+    def __init__(self, client_address, connection_id, sink_dir=None, write_buffer=1024 * 1024, preallocate=0,
+                 ack_every=2, ack_delay=0.025, flow_control=True, **flow_options):
+        """
+        :param flow_control: grant the client credits so at most a window of data is buffered.
+        :param flow_options: stream_window, connection_window, max_window and autotune of the FlowController.
+        """
+        self.client_address = client_address
+        self.connection_id = connection_id
+        self.streams = []               # reassembly buffer (or sink file) of each stream
+        self.digests = []               # running hash of the contiguous data of each stream
+        self.expected_digests = {}      # {stream id: (size, digest)} of the client, from the FIN
+        self.bytes_per_stream = []
+        self.packets_per_stream = []
+        self.total_bytes = 0
+        self.total_packets = 0
+        self.total_time = 0
+        self.stats = ConnectionStats()  # rates and histograms of the connection and of each stream
+        self.start_time = time.perf_counter()
+        self.completion_times = []      # seconds from the connection start to the last frame of each stream
+        self.sink = None
+        if sink_dir is not None:
+            # the output files of every connection go to their own directory
+            name = f"{client_address[0]}_{client_address[1]}_{connection_id}"
+            self.sink = DiskSink(os.path.join(sink_dir, name), write_buffer, preallocate)
+        self.acks = AckTracker(ack_every, ack_delay)   # packet numbers to acknowledge
+        self.packet_number = 0          # of the packets the server sends on this connection
+        self.version = WIRE_VERSION     # wire version of the client, the server answers in it
+        self.flow = FlowController(**flow_options) if flow_control else None
+        self.last_activity = time.monotonic()
+        self.resumed = False            # the SYN carried a valid resumption token
+        self.early_packet = None        # data of a SYN without a valid token, held until the next packet
+        self.parity = None              # fec.ParityDecoder, once the client protects its packets
+        self.closed = False
+
+    @property
+    def key(self):
+        return self.client_address, self.connection_id
+
+    def next_packet_number(self):
+        self.packet_number += 1
+        return self.packet_number
+
+    def process_data_packet(self, packet):
+        """
+        Place the frames of a data packet in their streams and update the statistics.
+        """
+        start_time = time.perf_counter()
+        for frame in packet.frames:
+            if frame.stream_id >= len(self.streams):  # Check if the stream ID is within the expected range
+                self.streams += [self.open_stream(i) for i in range(len(self.streams), frame.stream_id + 1)]    # Add empty buffers for new streams
+                self.digests += [StreamDigest() for _ in range(frame.stream_id - len(self.digests) + 1)]
+                self.bytes_per_stream += [0 for _ in range(frame.stream_id - len(self.bytes_per_stream) + 1)]   # Add 0 bytes for new streams
+                self.packets_per_stream += [0 for _ in range(frame.stream_id - len(self.packets_per_stream) + 1)]   # Add 0 packets for new streams
+                self.completion_times += [0 for _ in range(frame.stream_id - len(self.completion_times) + 1)]
+            stream = self.streams[frame.stream_id]
+            stream.write(frame.offset, frame.data)   # Place the data at its offset, duplicates are dropped
+            self.digests[frame.stream_id].update(stream, frame.offset, frame.data)
+        finish_time = time.perf_counter()
+        if self.flow is not None:
+            # what was delivered in order is consumed, only the data after a hole stays buffered
+            for frame in packet.frames:
+                self.flow.on_data(frame.stream_id, frame.offset + frame.data_length,
+                                  self.streams[frame.stream_id].contiguous(), finish_time)
+        received = 0
+        for frame in packet.frames: # Update the statistics for the received packet
+            self.bytes_per_stream[frame.stream_id] += len(frame.data)   # Update the total bytes received for the stream
+            self.packets_per_stream[frame.stream_id] += 1   # Update the total packets received for the stream
+            received += len(frame.data)
+            self.completion_times[frame.stream_id] = finish_time - self.start_time
+            self.stats.on_frame(frame.stream_id, frame.data_length, finish_time)    # arrival of the stream's frame
+        self.total_bytes += received    # Update the total bytes received
+        self.total_packets += 1  # Update the total packets received
+        self.total_time += finish_time - start_time # Update the total time
+        self.stats.on_packet(received, finish_time)
+        return received, finish_time - start_time
+
+    def credits_due(self):
+        # new flow control limits wait to be sent to the client
+        return self.flow is not None and self.flow.update_due()
+
+    def verify(self, stream_id):
+        """
+        Compare a received stream with the size and digest the client sent in the FIN.
+
+        :return: True or False, None when the client sent no digest for the stream.
+        """
+        if stream_id not in self.expected_digests:
+            return None
+        size, digest = self.expected_digests[stream_id]
+        if stream_id >= len(self.streams):
+            return size == 0 and digest == StreamDigest().digest()     # an empty stream has no frames
+        received = self.digests[stream_id]
+        return received.hashed == size and len(self.streams[stream_id]) == size and received.digest() == digest
+
+    def fairness(self):
+        """
+        Jain's fairness index of the per-stream rates (bytes / completion time): 1 when every
+        stream got the same rate, 1/n when one of n streams got everything.
+        """
+        rates = [received / completion for received, completion in zip(self.bytes_per_stream, self.completion_times)
+                 if completion > 0]
+        return jain_index(rates)
+
+    def open_stream(self, stream_id):
+        # where the frames of a new stream are placed: on disk in sink mode, in memory otherwise
+        if self.sink is not None:
+            return self.sink.open(stream_id)
+        return StreamBuffer()
+
+    @property
+    def files(self):
+        # the received data of each stream (in memory mode)
+        if self.sink is not None:
+            raise ValueError("The streams are written to disk in sink mode, read the files at paths instead.")
+        return [stream.data for stream in self.streams]
+
+    @property
+    def paths(self):
+        # the output file of each stream (in sink mode)
+        if self.sink is None:
+            raise ValueError("The streams are kept in memory without a sink directory, see files instead.")
+        return [stream.path for stream in self.streams]
+
+    def close(self):
+        # flush the output files, the in-memory streams stay readable
+        self.closed = True
+        if self.sink is not None:
+            self.sink.close()
+
+
+def jain_index(values):
+    # (sum x)^2 / (n * sum x^2), 1 for an empty list
+    square_sum = sum(value * value for value in values)
+    if not values or square_sum == 0:
+        return 1.0
+    return sum(values) ** 2 / (len(values) * square_sum)
+
+
+class ConnectionTable:
+    # connections by (client address, connection id), least recently active first
+    def __init__(self, idle_timeout=30.0, max_connections=1024, **connection_options):
+        """
+        :param idle_timeout: seconds without packets after which a connection is evicted.
+        :param max_connections: the least recently active connection is evicted beyond this.
+        :param connection_options: passed to every new Connection (sink_dir, write_buffer, preallocate,
+                                   ack_every, ack_delay, flow_control and the window sizes).
+        """
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.connection_options = connection_options
+        self.connections = OrderedDict()
+
+    def get(self, client_address, connection_id, create=True):
+        """
+        Find the connection of a packet and mark it active.
+
+        :param create: open a new connection if there is none.
+        :return: (connection or None, list of connections evicted to make room).
+        """
+        key = (client_address, connection_id)
+        connection = self.connections.get(key)
+        evicted = []
+        if connection is not None:
+            self.connections.move_to_end(key)
+        elif create:
+            while len(self.connections) >= self.max_connections:
+                evicted.append(self.connections.popitem(last=False)[1])
+            connection = Connection(client_address, connection_id, **self.connection_options)
+            self.connections[key] = connection
+        if connection is not None:
+            connection.last_activity = time.monotonic()
+        return connection, evicted
+
+    def remove(self, connection):
+        self.connections.pop(connection.key, None)
+
+    def evict_idle(self, now=None):
+        """
+        Remove the connections that were idle for longer than idle_timeout.
+
+        :return: the evicted connections.
+        """
+        now = time.monotonic() if now is None else now
+        evicted = []
+        while self.connections:
+            connection = next(iter(self.connections.values()))
+            if now - connection.last_activity < self.idle_timeout:
+                break   # ordered by activity, the others are more recent
+            evicted.append(self.connections.popitem(last=False)[1])
+        return evicted
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __iter__(self):
+        return iter(list(self.connections.values()))
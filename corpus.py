@@ -0,0 +1,83 @@
+# fast generation of the random test files
+# random.choices draws one character at a time, millions of Python calls for a 2 MB file.
+# Instead random bytes are drawn in bulk (randbytes of a seeded generator, or os.urandom) and
+# mapped to letters and digits with bytes.translate, one C call per chunk. 256 is not a multiple
+# of the 62 characters, so the 8 highest byte values are deleted by the same translate call
+# (rejection sampling) and every character keeps exactly the same probability, as with choices.
+# The files are written chunk by chunk, their size is only bounded by the disk. Seeded files are
+# kept in a cache directory by (seed, size, count) and generated only once.
+
+import os
+import random
+import shutil
+import string
+import tempfile
+
+ALPHABET = (string.ascii_letters + string.digits).encode()
+ACCEPTED = 256 // len(ALPHABET) * len(ALPHABET)     # 248, the byte values mapped uniformly
+TABLE = bytes(ALPHABET[value % len(ALPHABET)] for value in range(ACCEPTED)) + bytes(256 - ACCEPTED)
+REJECTED = bytes(range(ACCEPTED, 256))
+CHUNK_SIZE = 1024 * 1024
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "quic_corpus")
+
+
+def iter_chunks(size, seed=None, chunk_size=CHUNK_SIZE):
+    """
+    Random letters and digits, in chunks of at most chunk_size bytes.
+
+    :param size: total number of bytes.
+    :param seed: the same seed gives the same bytes (a shorter size gives a prefix of them),
+                 None draws them from os.urandom.
+    """
+    draw = os.urandom if seed is None else random.Random(seed).randbytes
+    while size > 0:
+        chunk = draw(chunk_size).translate(TABLE, REJECTED)[:size]
+        size -= len(chunk)
+        yield chunk
+
+
+def generate_bytes(size, seed=None):
+    return b"".join(iter_chunks(size, seed))
+
+
+def write_file(path, size, seed=None):
+    # written beside and renamed, a file that exists is always complete
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        for chunk in iter_chunks(size, seed):
+            f.write(chunk)
+    os.replace(temporary, path)
+    return path
+
+
+def file_seed(seed, index):
+    # the seed of each file of a corpus, different files of one seed are unrelated
+    return f"{seed}:{index}"
+
+
+def cached_corpus(count, size, seed, cache_dir=CACHE_DIR):
+    """
+    Paths of count files of size random bytes each, generated on the first call only.
+
+    :param seed: the files of a (seed, size, count) are always the same.
+    :param cache_dir: directory of the cached corpora.
+    """
+    directory = os.path.join(cache_dir, f"{seed}-{size}-{count}")
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"file_{i}.txt")
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            write_file(path, size, file_seed(seed, i))
+        paths.append(path)
+    return paths
+
+
+def place(source, destination):
+    # a hard link costs nothing whatever the size, copy where the file system has none
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
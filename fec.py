@@ -0,0 +1,203 @@
+# forward error correction of the data packets with XOR parity
+# the client groups consecutive data packets (flags DATA | PARITY) and after the last one of a
+# group sends a parity packet (flag PARITY alone): one frame of the control stream whose offset is
+# the first packet number of the group and whose data is the group size, the XOR of the payload
+# lengths and the XOR of the payloads (the serialized frames). The server keeps the payloads of
+# the recent protected packets, and when a parity packet arrives with one packet of its group
+# missing it rebuilds that packet and handles it as if it had arrived, so its ACK reaches the
+# client about when the parity does instead of a retransmission a round trip after the loss was
+# noticed. The client holds back the lost packets of a group until the parity is acknowledged (or
+# lost) and only sends again what was not rebuilt. The groups are sized by the observed loss rate:
+# the larger the loss, the smaller the group, so that two losses in one group stay rare.
+
+import struct
+from collections import deque
+
+from quic import DATA_FLAG, PARITY_FLAG, Frame, Quic_packet, WIRE_VERSION, decode_frames
+from resumption import CONTROL_STREAM_ID
+
+PARITY_STRUCT = struct.Struct("!BH")    # group size, XOR of the payload lengths
+MIN_GROUP = 4
+MAX_GROUP = 32
+TARGET_UNRECOVERABLE = 0.02     # share of the groups that may lose two packets or more
+LOSS_WINDOW = 200               # packets over which the loss rate is averaged
+
+
+def group_size(loss_rate):
+    # the largest group of which at most TARGET_UNRECOVERABLE lose two packets or more (the parity included)
+    p = loss_rate
+    for size in range(MAX_GROUP, MIN_GROUP, -1):
+        n = size + 1
+        if 1 - (1 - p) ** n - n * p * (1 - p) ** (n - 1) <= TARGET_UNRECOVERABLE:
+            return size
+    return MIN_GROUP
+
+
+def payload_size(frames, version=WIRE_VERSION):
+    return sum(frame.header_size(version) + frame.data_length for frame in frames)
+
+
+def serialize_payload(frames, version=WIRE_VERSION):
+    # the payload of a received packet as the client serialized it
+    buffer = bytearray(payload_size(frames, version))
+    end = 0
+    for frame in frames:
+        end = frame.serialize_into(buffer, end, version)
+    return buffer
+
+
+class ParityEncoder:
+    # sending side: the open group, the groups whose parity is in flight and the lost packets they may rebuild
+    def __init__(self, version=WIRE_VERSION, ratio=None):
+        """
+        :param ratio: parity packets per data packet (0.1 for one per 10), None to follow the loss rate.
+        """
+        self.version = version
+        self.ratio = ratio
+        self.loss_rate = 0.0
+        # a parity packet is this much larger than the largest payload of its group
+        self.overhead = Frame(CONTROL_STREAM_ID, 2 ** 32 - 1, 2 ** 16, b"").header_size(version) + PARITY_STRUCT.size
+        self.group = []             # packet numbers of the open group
+        self.xor = 0                # the payloads of the open group as little endian integers, XORed
+        self.lengths = 0
+        self.longest = 0
+        self.group_size = self.next_group_size()
+        self.groups = deque()       # (first packet number, size, parity packet number) of the sent parity packets
+        self.held = {}              # lost packets waiting for their parity: packet number: (SentPacket, parity)
+        self.parity_packets = 0
+        self.recovered = 0
+        self.retransmitted = 0
+
+    def next_group_size(self):
+        if self.ratio:
+            return min(max(round(1 / self.ratio), 1), MAX_GROUP)
+        return group_size(self.loss_rate)
+
+    def add(self, packet_number, payload):
+        """
+        Add a data packet to the open group, packet numbers follow each other within a group.
+
+        :return: True when the group is complete and its parity packet is due.
+        """
+        self.group.append(packet_number)
+        self.xor ^= int.from_bytes(payload, "little")
+        self.lengths ^= len(payload)
+        self.longest = max(self.longest, len(payload))
+        return len(self.group) >= self.group_size
+
+    def build(self, packet_number, connection_id):
+        # the parity packet of the open group, the next group starts empty
+        data = PARITY_STRUCT.pack(len(self.group), self.lengths) + self.xor.to_bytes(self.longest, "little")
+        self.groups.append((self.group[0], len(self.group), packet_number))
+        self.group = []
+        self.xor = self.lengths = self.longest = 0
+        self.group_size = self.next_group_size()
+        self.parity_packets += 1
+        return Quic_packet(PARITY_FLAG, packet_number, connection_id,
+                           [Frame(CONTROL_STREAM_ID, self.groups[-1][0], len(data), data)], self.version)
+
+    def on_ack(self, acked, lost):
+        # packets acknowledged and declared lost by an ACK, the loss rate sizes the next groups
+        n = acked + lost
+        if n:
+            self.loss_rate += min(n / LOSS_WINDOW, 1.0) * (lost / n - self.loss_rate)
+
+    def in_open_group(self, packets):
+        return any(packet.packet_number in self.group for packet in packets)
+
+    def parity_of(self, packet_number):
+        for first, size, parity in reversed(self.groups):
+            if first <= packet_number < first + size:
+                return parity
+        return None
+
+    def hold(self, packets, in_flight):
+        """
+        Keep the lost packets whose parity packet is in flight, the open group must have been
+        sent with build first.
+
+        :param in_flight: the SentPackets in flight by packet number.
+        :return: the packets to send again now.
+        """
+        retransmit = []
+        for packet in packets:
+            parity = self.parity_of(packet.packet_number)
+            if parity is not None and parity in in_flight:
+                self.held[packet.packet_number] = (packet, parity)
+            else:
+                retransmit.append(packet)
+        return retransmit
+
+    def release(self, acked, in_flight):
+        """
+        Resolve the held packets whose parity packet was acknowledged or lost.
+
+        :param acked: RangeSet of the acknowledged packet numbers.
+        :return: the packets the server could not rebuild, to send again.
+        """
+        retransmit = []
+        for packet_number, (packet, parity) in list(self.held.items()):
+            if acked.contains(packet_number, packet_number + 1):
+                self.recovered += 1
+            elif parity in in_flight:
+                continue
+            else:
+                retransmit.append(packet)
+                self.retransmitted += 1
+            del self.held[packet_number]
+        while self.groups and self.groups[0][2] not in in_flight:
+            self.groups.popleft()
+        return retransmit
+
+
+class ParityDecoder:
+    # receiving side: the payloads of the recent protected packets of a connection
+    def __init__(self, window=4 * MAX_GROUP):
+        """
+        :param window: payloads kept, parity packets arriving later than that many packets are of no use.
+        """
+        self.payloads = {}          # packet number: (payload as little endian integer, length)
+        self.order = deque()
+        self.window = window
+        self.recovered = 0
+        self.unrecoverable = 0
+
+    def on_packet(self, packet_number, frames, version=WIRE_VERSION):
+        payload = serialize_payload(frames, version)
+        self.payloads[packet_number] = (int.from_bytes(payload, "little"), len(payload))
+        self.order.append(packet_number)
+        while len(self.order) > self.window:
+            self.payloads.pop(self.order.popleft(), None)
+
+    def recover(self, packet, received):
+        """
+        :param packet: a parity packet.
+        :param received: RangeSet of the packet numbers received on the connection.
+        :return: the data packet of its group that was lost, rebuilt, None when none or several were lost.
+        """
+        frame = packet.frames[0]
+        size, lengths = PARITY_STRUCT.unpack_from(frame.data)
+        xor = int.from_bytes(frame.data[PARITY_STRUCT.size:], "little")
+        missing = None
+        for packet_number in range(frame.offset, frame.offset + size):
+            entry = self.payloads.pop(packet_number, None)
+            if entry is not None:
+                xor ^= entry[0]
+                lengths ^= entry[1]
+            elif received.contains(packet_number, packet_number + 1):
+                return None     # received before the window, its payload is gone
+            elif missing is None:
+                missing = packet_number
+            else:
+                self.unrecoverable += 1
+                return None
+        if missing is None:
+            return None
+        version = packet.header.version
+        try:
+            frames = decode_frames(memoryview(xor.to_bytes(lengths, "little")), 0, version)
+        except (OverflowError, ValueError):
+            self.unrecoverable += 1
+            return None
+        self.recovered += 1
+        return Quic_packet(DATA_FLAG, missing, packet.header.connection_id, frames, version)
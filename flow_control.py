@@ -0,0 +1,145 @@
+# flow control of the streams and of the connection
+# the server only keeps a bounded amount of data that it cannot deliver yet: it grants the
+# client credits, the highest offset it may send on each stream (max stream data) and the most
+# stream bytes it may send on the whole connection (max data). As the received data is consumed
+# (delivered in order, without holes) the server moves the limits forward and sends them in a
+# MaxDataFrame with the ACKs, so the sender can never run further ahead of the receiver than
+# the window. The window of a stream (and of the connection) is doubled, up to max_window, when
+# its credits are used up faster than twice per round trip, so a fast path is not slowed down.
+
+from quic import MaxDataFrame
+
+STREAM_WINDOW = 256 * 1024
+CONNECTION_WINDOW = 1024 * 1024
+MAX_WINDOW = 16 * 1024 * 1024
+
+
+class FlowController:
+    # the receiving side, one per connection
+    def __init__(self, stream_window=STREAM_WINDOW, connection_window=CONNECTION_WINDOW, max_window=MAX_WINDOW,
+                 autotune=True):
+        """
+        :param stream_window: bytes a stream may be received beyond what was consumed of it.
+        :param connection_window: the same for all the streams of the connection together.
+        :param max_window: auto-tuning does not grow a window beyond this.
+        :param autotune: double a window that is used up within two round trips.
+        """
+        self.stream_window = stream_window      # initial window of every stream
+        self.connection_window = connection_window
+        self.max_window = max_window
+        self.autotune = autotune
+        self.windows = {}           # window of each stream, once auto-tuning changed it
+        self.max_stream_data = {}   # limit of each stream that got an update, stream_window for the others
+        self.max_data = connection_window
+        self.highest = {}           # highest offset received on each stream
+        self.consumed = {}          # bytes of each stream delivered in order
+        self.received = 0           # sum of the highest offsets, what max data limits
+        self.consumed_total = 0
+        self.pending = set()        # streams whose new limit was not sent yet
+        self.max_data_pending = False
+        self.last_update = {}       # time of the last update of each stream, key None for the connection
+        self.handshake_time = None
+        self.rtt = None             # from the SYN-ACK to the first data packet
+        self.peak_buffered = 0      # most bytes received but not consumed at once
+        self.violations = 0         # frames beyond the limits (a misbehaving sender)
+
+    def on_handshake(self, now):
+        self.handshake_time = now
+
+    def stream_limit(self, stream_id):
+        return self.max_stream_data.get(stream_id, self.stream_window)
+
+    @property
+    def buffered(self):
+        return self.received - self.consumed_total
+
+    def on_data(self, stream_id, end, consumed, now):
+        """
+        Account for a received frame and move the limits forward when half a window is used.
+
+        :param end: offset after the frame data.
+        :param consumed: bytes of the stream delivered in order after this frame.
+        :param now: time of a monotonic clock.
+        """
+        if self.rtt is None and self.handshake_time is not None:
+            self.rtt = now - self.handshake_time
+        highest = self.highest.get(stream_id, 0)
+        if end > highest:
+            self.highest[stream_id] = end
+            self.received += end - highest
+            if end > self.stream_limit(stream_id) or self.received > self.max_data:
+                self.violations += 1
+        if consumed > self.consumed.get(stream_id, 0):
+            self.consumed_total += consumed - self.consumed.get(stream_id, 0)
+            self.consumed[stream_id] = consumed
+        self.peak_buffered = max(self.peak_buffered, self.buffered)
+
+        window = self.windows.get(stream_id, self.stream_window)
+        if self.stream_limit(stream_id) - consumed < window / 2:
+            window = self.windows[stream_id] = self.tune(stream_id, window, now)
+            self.max_stream_data[stream_id] = consumed + window
+            self.pending.add(stream_id)
+        if self.max_data - self.consumed_total < self.connection_window / 2:
+            self.connection_window = self.tune(None, self.connection_window, now)
+            self.max_data = self.consumed_total + self.connection_window
+            self.max_data_pending = True
+
+    def tune(self, key, window, now):
+        # a window whose previous update was less than two round trips ago limits the rate, double it
+        last = self.last_update.get(key)
+        self.last_update[key] = now
+        if self.autotune and last is not None and self.rtt is not None and now - last < 2 * self.rtt:
+            window = min(window * 2, self.max_window)
+        return window
+
+    def resend(self):
+        # the sender is blocked: send every limit again, the last update may have been lost
+        self.pending.update(self.max_stream_data)
+        self.max_data_pending = True
+
+    def update_due(self):
+        return self.max_data_pending or bool(self.pending)
+
+    def build(self):
+        # the frame of the new limits, they count as sent
+        frame = MaxDataFrame(self.max_data, {stream_id: self.max_stream_data[stream_id]
+                                             for stream_id in sorted(self.pending)})
+        self.pending.clear()
+        self.max_data_pending = False
+        return frame
+
+    def initial_frame(self):
+        # the limits of the SYN-ACK
+        return MaxDataFrame(self.max_data, {}, self.stream_window)
+
+
+class SendCredit:
+    # the sending side: the limits granted by the server, None as long as it set none
+    def __init__(self):
+        self.max_data = None
+        self.initial_max_stream_data = None
+        self.max_stream_data = {}
+        self.sent = 0       # new stream bytes sent, what max data limits
+
+    def on_frame(self, frame):
+        # limits only move forward, an older frame arriving late changes nothing
+        self.max_data = frame.max_data if self.max_data is None else max(self.max_data, frame.max_data)
+        if frame.initial_max_stream_data:
+            self.initial_max_stream_data = max(self.initial_max_stream_data or 0, frame.initial_max_stream_data)
+        for stream_id, limit in frame.max_stream_data.items():
+            self.max_stream_data[stream_id] = max(self.max_stream_data.get(stream_id, 0), limit)
+
+    def stream_limit(self, stream_id):
+        limit = self.max_stream_data.get(stream_id)
+        if limit is None or self.initial_max_stream_data is None:
+            return limit if limit is not None else self.initial_max_stream_data
+        return max(limit, self.initial_max_stream_data)
+
+    def available(self):
+        # new stream bytes the connection may still send, None for no limit
+        return None if self.max_data is None else self.max_data - self.sent
+
+    def apply(self, streams):
+        # the current limit of every StreamState
+        for stream in streams:
+            stream.limit = self.stream_limit(stream.stream_id)
@@ -3,32 +3,35 @@ from client import *
 
 import threading
 import matplotlib.pyplot as plt
+import stats
+import bench
 
 # Statistics Arrays For The Graphs
 average_bytes_statistics = []
 average_packets_statistics = []
+snapshots = []     # statistics snapshot of every run, see stats.py
 
-def run_server(host, port):
-    server1 = Server(host, port)
-    server1.handle_packet()
-    avg_bytes, avg_packets = server1.print_statistics()
-    average_bytes_statistics.append(sum(avg_bytes) / len(avg_bytes))
-    average_packets_statistics.append(sum(avg_packets) / len(avg_packets))
-
-def run_client(host, port, num_flows):
-    client1 = Client(host, port)
-    client1.start(num_flows)
-
-def run_both(host, port, num_flows):
+def run_both(host, port, num_flows, file_size=2 * 1024 * 1024, trials=1):
+    """
+    Transfer 1..num_flows files of file_size bytes on loopback, one benchmark case of bench.py
+    per number of flows (see python bench.py suite for the full matrix and repeated trials).
+    """
     for i in range(1, num_flows+1):
         print(f"\n~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ Running test with {i} flows ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~ ~\n")
-        server_thread = threading.Thread(target=run_server, args=(host, port))
-        server_thread.start()
-        time.sleep(1)
-        client_thread = threading.Thread(target=run_client(host, port, i), args=(host, port, num_flows))
-        client_thread.start()
-        server_thread.join()
-        client_thread.join()
+        data = bench.make_files(i, file_size)     # the same files in every run
+        results = []
+        trial_snapshots = []
+        for trial in range(trials):
+            metrics, server = bench.run_trial(data, seed=trial, address=(host, port))
+            results.append(metrics)
+            trial_snapshots.append(server.connection.stats.snapshot())
+        # the median of the trials, wall-clock rates of the connection from its first to its last data packet
+        rates = [snapshot["connection"] for snapshot in trial_snapshots]
+        average_bytes_statistics.append(bench.percentile([rate["bytes_per_sec"] for rate in rates], 0.5))
+        average_packets_statistics.append(bench.percentile([rate["packets_per_sec"] for rate in rates], 0.5))
+        snapshots.append(trial_snapshots[-1])
+        print(f"{average_bytes_statistics[-1]:.0f} bytes/sec, {average_packets_statistics[-1]:.0f} packets/sec, "
+              f"complete: {all(metrics['complete'] for metrics in results)}")
 
     plt.figure(figsize=(12, 6))
     plt.plot([i for i in range(1, num_flows + 1)], average_bytes_statistics, marker='o')
@@ -57,7 +60,10 @@ def save_stats_to_file(average_bytes_statistics, average_packets_statistics, fil
             f.write(f"Average number of bytes per second: {average_bytes_statistics[i]:.2f}\n")
             f.write(f"Average number of packets per second: {average_packets_statistics[i]:.2f}\n")
             f.write("\n")
-
+    # the full snapshots, also as a Prometheus text file with one series per run
+    stats.write_file(os.path.splitext(filename)[0] + ".json", stats.to_json(snapshots))
+    stats.write_file(os.path.splitext(filename)[0] + ".prom",
+                     stats.to_prometheus([({"run": str(i + 1)}, snapshot) for i, snapshot in enumerate(snapshots)]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+# datagram packetization layer path MTU discovery (after RFC 8899, DPLPMTUD)
+# the client starts with datagrams of BASE_DATAGRAM_SIZE bytes, which any IPv4 path carries, and
+# searches for the largest size that arrives unfragmented: now and then it sends a probe, a
+# packet with the PROBE flag padded to the size to try, which the server acknowledges right away
+# and otherwise ignores. An acknowledged probe raises the size the packets are built with, a probe
+# lost MAX_PROBES times in a row lowers the upper end of the search (a binary search between the
+# two). The sockets set the don't-fragment bit, so a datagram too large for the path is dropped
+# (or refused by the kernel) instead of being fragmented. Probes are not stream data: they are not
+# sent again when lost, their loss is not congestion and they are numbered apart from the data
+# packets (the server answers each with an ACK of its own), so they leave no gaps in the ACKs of
+# the data. The search tries the common path sizes (Ethernet, jumbo frames) first, the usual paths
+# are found after a round trip or two. After the search the path is probed again every
+# raise_interval seconds, and packets of the confirmed size that keep getting lost while nothing
+# is acknowledged (a black hole, e.g. a route change) bring the size back to the base.
+
+import socket
+import sys
+
+from quic import Frame, Header, HEADER_SIZE, PROBE_FLAG, SHORT_HEADER_STRUCT, max_frame_data
+from resumption import CONTROL_STREAM_ID
+
+BASE_DATAGRAM_SIZE = 1200       # carried by every path (also the smallest QUIC datagram)
+MAX_UDP_PAYLOAD = 65507         # of an IPv4 datagram
+IP_UDP_OVERHEAD = 28            # IPv4 and UDP headers, the path MTU minus this is the datagram size
+MAX_PROBES = 3                  # a size is too large after this many lost probes
+SEARCH_GRANULARITY = 16         # the search ends when the bounds are this close
+RAISE_INTERVAL = 30.0           # seconds between two searches
+BLACK_HOLE_LOSSES = 3           # packets lost in a row before falling back to the base size
+PLATEAUS = (1472, 8972)         # datagrams of the Ethernet and jumbo frame MTUs, probed before the search
+PADDING = bytes(MAX_UDP_PAYLOAD)
+
+# Linux socket options, the socket module does not have all of them on every version
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10)
+IP_PMTUDISC_PROBE = getattr(socket, "IP_PMTUDISC_PROBE", 3)     # set DF, ignore the kernel's path MTU cache
+IP_MTU = getattr(socket, "IP_MTU", 14)
+
+
+def set_dont_fragment(sock):
+    # True if the datagrams of sock are sent with DF set (Linux only)
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+    except OSError:
+        return False
+    return True
+
+
+def route_limit(address):
+    """
+    Largest datagram the route to address allows, from the MTU of the outgoing interface.
+
+    :return: datagram size, MAX_UDP_PAYLOAD when the MTU cannot be read.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect(address)
+        mtu = sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return MAX_UDP_PAYLOAD
+    finally:
+        sock.close()
+    return min(mtu - IP_UDP_OVERHEAD, MAX_UDP_PAYLOAD)
+
+
+class PathMtu:
+    def __init__(self, max_size=MAX_UDP_PAYLOAD, base_size=BASE_DATAGRAM_SIZE, raise_interval=RAISE_INTERVAL,
+                 max_probes=MAX_PROBES, granularity=SEARCH_GRANULARITY):
+        """
+        :param max_size: largest datagram to try (e.g. route_limit of the server address).
+        :param base_size: datagram size used until a probe confirms a larger one.
+        :param raise_interval: seconds after a search before the next one.
+        """
+        self.base_size = base_size
+        self.max_size = max(max_size, base_size)
+        self.raise_interval = raise_interval
+        self.max_probes = max_probes
+        self.granularity = granularity
+        self.size = base_size           # largest confirmed datagram, what the packets are built with
+        self.low = base_size            # bounds of the search, low works and high + 1 does not
+        self.high = self.max_size
+        self.probe = None               # (packet number, size, time sent) of the probe in flight
+        self.sent_probes = {}           # size of the probes of this search by packet number, lost ones too
+        self.attempts = 0               # probes of the current size that were lost
+        self.search_end = None          # time the last search ended, None while searching
+        self.black_hole_losses = 0
+        self.probes_sent = 0
+        self.probes_acked = 0
+        self.probes_lost = 0
+
+    def probe_size(self):
+        # size of the next probe, None when the search is over. The plateaus and the largest size
+        # go first, a binary search between the bounds once one of them was too large
+        if self.high - self.low < self.granularity:
+            return None
+        for plateau in PLATEAUS + (self.max_size,):
+            if self.low < plateau <= self.high:
+                return plateau
+        return (self.low + self.high + 1) // 2
+
+    def due(self, now, timeout):
+        """
+        :param timeout: seconds after which a probe without ACK counts as lost.
+        :return: size of a probe to send now, None if none.
+        """
+        if self.probe is not None:
+            if now - self.probe[2] < timeout:
+                return None
+            self.on_probe_lost()
+        if self.search_end is not None:
+            if now - self.search_end < self.raise_interval:
+                return None
+            self.low, self.high, self.search_end = self.size, self.max_size, None   # probe again, the path may allow more
+            self.sent_probes.clear()
+        size = self.probe_size()
+        if size is None:
+            self.search_end = now
+        return size
+
+    def on_probe_sent(self, packet_number, size, now):
+        self.probe = (packet_number, size, now)
+        self.sent_probes[packet_number] = size
+        self.probes_sent += 1
+
+    def on_ack(self, frame):
+        """
+        An ACK frame of the server. A probe that was taken for lost but is acknowledged late
+        still counts, its size fits the path after all.
+
+        :return: True if it confirmed a larger size.
+        """
+        acked = [packet_number for packet_number in self.sent_probes
+                 if any(first <= packet_number <= last for first, last in frame.ranges)]
+        if not acked:
+            return False
+        size = max(self.sent_probes.pop(packet_number) for packet_number in acked)
+        self.probes_acked += len(acked)
+        if self.probe is not None and self.probe[0] in acked:
+            self.probe = None
+            self.attempts = 0
+        if size <= self.size:
+            return False
+        self.low = self.size = size
+        self.high = max(self.high, size)
+        return True
+
+    def on_probe_lost(self):
+        _, size, _ = self.probe
+        self.probe = None
+        self.probes_lost += 1
+        self.attempts += 1
+        if self.attempts >= self.max_probes:
+            self.on_too_large(size)
+
+    def on_too_large(self, size):
+        # the path does not carry datagrams of size (lost probes, or the kernel refused it)
+        self.probe = None
+        self.attempts = 0
+        self.high = min(self.high, size - 1)
+
+    def on_packets(self, acked, lost):
+        # black hole detection on the data packets: a run of losses of full-size packets with nothing acknowledged
+        if acked:
+            self.black_hole_losses = 0      # packets get through, the losses are congestion
+            return
+        self.add_losses(sum(1 for packet in lost if packet.size > self.base_size))
+
+    def on_timeout(self, packets):
+        # an expired recovery timer counts as one loss, however many packets it gave up on
+        self.add_losses(int(any(packet.size > self.base_size for packet in packets)))
+
+    def add_losses(self, count):
+        self.black_hole_losses += count
+        if self.black_hole_losses >= BLACK_HOLE_LOSSES and self.size > self.base_size:
+            self.size = self.low = self.base_size
+            self.high = self.max_size
+            self.search_end = None
+            self.black_hole_losses = 0
+
+
+def payload_size(datagram_size, version):
+    # chunk_size of the packets of a datagram size, with the largest packet header of the version
+    if version == 1:
+        return datagram_size - HEADER_SIZE
+    return datagram_size - SHORT_HEADER_STRUCT.size - 8
+
+
+def build_probe(buffer, size, packet_number, connection_id, version):
+    """
+    Write a probe packet of at most size bytes (the varint of the padding length can make it a
+    byte shorter) into buffer.
+
+    :return: the datagram size.
+    """
+    header = Header(connection_id, packet_number, PROBE_FLAG, version)
+    end = header.serialize_into(buffer, 0)
+    padding = max(max_frame_data(0, size - end, version), 0)
+    frame = Frame(CONTROL_STREAM_ID, 0, padding, memoryview(PADDING)[:padding])
+    return frame.serialize_into(buffer, end, version)
@@ -1,9 +1,9 @@
 # file for implementation of QUIC packet
 # serilization and deserialization functions.
 # each quic packet has a header and a payload
-# header is 9 bytes
+# header is 9 bytes (version 1) or 6 to 13 bytes (version 2)
 # 1 byte for 4 flags(ack, syn, fin,data)
-# 4 bytes for packet number
+# 4 bytes (version 2: a variable-length integer) for packet number
 # 4 bytes for connection id
 
 # paylode contains frames
@@ -15,12 +15,21 @@
 # Flags (1 byte): Four flags (ACK, SYN, FIN, DATA) packed into a single byte.
 # Packet Number (4 bytes): A unique identifier for the packet within the connection.
 # Connection ID (4 bytes): Identifies the connection to which this packet belongs.
+# A packet with the ACK flag carries a single ACK frame (largest acknowledged packet number,
+# ACK delay and ranges of received packet numbers) instead of stream frames.
+# Wire version 2 (the default) orders the header as connection ID, flags with the VARINT flag
+# (0x80) set, then the packet number as a variable-length integer. Version 1 packet numbers stay
+# below 2^31, so the high bit of byte 4 tells the two versions apart and both are decoded.
+# A packet with the MAX_DATA flag starts its payload with a MaxDataFrame of flow control credits
+# (how far the receiver lets the sender go on the connection and on each stream), the ACK or
+# stream frames follow it.
 
 # Payload
 # Contains multiple frames, each of which carries a part of a stream of data. A frame is defined by:
 # Stream ID (2 bytes): Identifies the stream within the connection.
 # Offset (variable size): Indicates where this frame’s data fits into the stream.
 # Data Length (variable size): Specifies the length of the data in this frame.
+# (version 1 packets carry them as fixed 8-byte integers)
 # Data (variable size): The actual data being transmitted.
 
 
@@ -30,7 +39,8 @@
 # Each frame is serialized by concatenating the stream ID, offset, data length, and data.
 # The stream ID is serialized as a 2-byte integer
 # the offset and data length are serialized as variable-length integers.
-# The data is serialized as-is.
+# The data is serialized as-is, payloads are bytes-like (bytes, bytearray or memoryview),
+# str payloads are only accepted as a compatibility shim and encoded to UTF-8 once.
 
 # 3. Deserialization
 # The deserialize_packet function takes a byte string and returns a QUICPacket object.
@@ -40,17 +50,144 @@
 # Each frame is parsed by reading the stream ID, offset, data length, and data.
 # The stream ID is read as a 2-byte integer, and the offset and data length are read as variable-length integers.
 # The data is read as-is.
+# Decoding walks a single memoryview over the received datagram with precompiled struct.Struct
+# objects (unpack_from at increasing offsets), so a packet with n frames costs O(n) and no payload
+# is copied: every frame's data is a memoryview slice of the receive buffer. With lazy=True the
+# frames are only parsed while the packet's frames are iterated.
 
 # 4. Variable-Length Integers
-# Variable-length integers are used to encode the offset and data length in the frame structure.
-# The serialize_varint and deserialize_varint functions are used to encode and decode these integers.
-# The integer is split into 7-bit chunks, with the 8th bit indicating whether more bytes are present.
-# The chunks are serialized in little-endian order, with the 8th bit set for all but the last chunk.
-# The chunks are deserialized by reading the 7 bits and checking the 8th bit to determine if more bytes are present.
-# The integer is reconstructed by shifting the 7-bit chunks into place and adding them together.
+# Variable-length integers are used to encode the offset and data length in the frame structure,
+# and the packet number in the header. The serialize_varint and deserialize_varint functions are
+# used to encode and decode these integers, as in QUIC (RFC 9000, section 16):
+# the two most significant bits of the first byte give the length of the integer (00 = 1 byte,
+# 01 = 2, 10 = 4, 11 = 8 bytes), the remaining 6, 14, 30 or 62 bits hold the value in network
+# byte order. Offsets below 16 KiB and chunk lengths cost 2 bytes instead of 8.
+# Besides serialize(), every wire object has serialize_into(buffer, offset) that packs it with
+# pack_into straight into a preallocated buffer (the client reuses one, through a memoryview: a
+# bytearray slice assignment would copy a memoryview's data once more), the
+# classes use __slots__ so the objects of the hot loop are small and quick to create.
 
 import struct
 
+# precompiled layouts, the format strings are parsed once instead of on every packet
+HEADER_STRUCT = struct.Struct("!IIB")       # connection_id, packet_number, flags
+FRAME_STRUCT = struct.Struct("!HQQ")        # stream_id, offset, data_length
+ACK_STRUCT = struct.Struct("!IIH")          # largest acknowledged, ack delay (microseconds), range count
+ACK_RANGE_STRUCT = struct.Struct("!II")     # first and last packet number of a range
+HEADER_SIZE = HEADER_STRUCT.size            # 9 bytes
+FRAME_HEADER_SIZE = FRAME_STRUCT.size       # 18 bytes
+SHORT_HEADER_STRUCT = struct.Struct("!IB")  # connection_id, flags (version 2, the packet number follows)
+STREAM_ID_STRUCT = struct.Struct("!H")
+VARINT_16 = struct.Struct("!H")
+VARINT_32 = struct.Struct("!I")
+VARINT_64 = struct.Struct("!Q")
+MAX_VARINT = 2 ** 62 - 1
+
+WIRE_VERSION = 2        # version of the packets written by default, both versions are read
+VARINT_CODES = "BHIQ"   # struct code of a varint by its 2-bit length prefix
+VARINT_MASKS = (0x3F, 0x3FFF, 0x3FFFFFFF, 0x3FFFFFFFFFFFFFFF)
+VARINT_PREFIXES = (0, 0x4000, 0x80000000, 0xC000000000000000)   # the length prefix in place, by prefix
+# version 2 frame headers by the length prefixes of offset and data length, so a frame header is
+# decoded by a single unpack_from once the two prefix bytes are known
+VARINT_FRAME_STRUCTS = [[struct.Struct("!H" + VARINT_CODES[offset_prefix] + VARINT_CODES[length_prefix])
+                         for length_prefix in range(4)] for offset_prefix in range(4)]
+
+# flags of the header
+SYN_FLAG = 0b00000001
+DATA_FLAG = 0b00000010
+FIN_FLAG = 0b00000100
+ACK_FLAG = 0b00001000       # the payload is one AckFrame instead of stream frames
+MAX_DATA_FLAG = 0b00010000  # the payload starts with a MaxDataFrame (flow control credits)
+PARITY_FLAG = 0b00100000    # on a DATA packet: covered by a parity packet, alone: the parity packet (see fec.py)
+PROBE_FLAG = 0b01000000     # a path MTU probe, padding that is only acknowledged (see pmtu.py)
+VARINT_FLAG = 0b10000000    # wire version 2: varint packet number, offset and data length
+
+
+def serialize_varint(value):
+    # the shortest QUIC variable-length encoding of value
+    if value < 0x40:
+        return bytes((value,))
+    if value < 0x4000:
+        return VARINT_16.pack(value | 0x4000)
+    if value < 0x40000000:
+        return VARINT_32.pack(value | 0x80000000)
+    if value <= MAX_VARINT:
+        return VARINT_64.pack(value | 0xC000000000000000)
+    raise ValueError(f"{value} does not fit in a variable-length integer")
+
+
+def deserialize_varint(view, offset):
+    """
+    Decode the variable-length integer that starts at offset.
+
+    :return: (value, offset after the integer).
+    """
+    first = view[offset]
+    prefix = first >> 6
+    if prefix == 0:
+        return first, offset + 1
+    if prefix == 1:
+        return VARINT_16.unpack_from(view, offset)[0] & 0x3FFF, offset + 2
+    if prefix == 2:
+        return VARINT_32.unpack_from(view, offset)[0] & 0x3FFFFFFF, offset + 4
+    return VARINT_64.unpack_from(view, offset)[0] & 0x3FFFFFFFFFFFFFFF, offset + 8
+
+
+def varint_prefix(value):
+    # the 2-bit length prefix of the shortest encoding of value
+    if value < 0x40:
+        return 0
+    if value < 0x4000:
+        return 1
+    if value < 0x40000000:
+        return 2
+    if value <= MAX_VARINT:
+        return 3
+    raise ValueError(f"{value} does not fit in a variable-length integer")
+
+
+def serialize_varint_into(buffer, offset, value):
+    """
+    Write serialize_varint(value) into buffer at offset.
+
+    :return: offset after the integer.
+    """
+    prefix = varint_prefix(value)
+    if prefix == 0:
+        buffer[offset] = value
+        return offset + 1
+    size = 1 << prefix
+    (VARINT_16, VARINT_32, VARINT_64)[prefix - 1].pack_into(buffer, offset, value | VARINT_PREFIXES[prefix])
+    return offset + size
+
+
+def varint_size(value):
+    # bytes taken by serialize_varint(value)
+    return 1 if value < 0x40 else 2 if value < 0x4000 else 4 if value < 0x40000000 else 8
+
+
+def max_frame_data(offset, space, version=WIRE_VERSION):
+    """
+    The most data bytes a frame at offset can carry if the whole frame (header and data) must fit
+    in space bytes.
+
+    :return: the data length, -1 if not even an empty frame fits.
+    """
+    if version == 1:
+        return max(space - FRAME_HEADER_SIZE, -1)
+    fixed = STREAM_ID_STRUCT.size + varint_size(offset)
+    best = -1
+    for length_size, mask in zip((1, 2, 4, 8), VARINT_MASKS):
+        best = max(best, min(space - fixed - length_size, mask))
+    return max(best, -1)
+
+
+def peek_flags(data):
+    # the flags of a serialized packet of either wire version, without decoding it
+    if data[4] & VARINT_FLAG:
+        return data[4] & ~VARINT_FLAG
+    return data[8]
+
 
 class Quic_packet:
     # +------------------------+
@@ -71,37 +208,292 @@ class Quic_packet:
     # |        frame n         |
     # |------------------------+
 
-    def __init__(self, flags, packet_number, connection_id, frames):
-        self.header = Header(connection_id, packet_number, flags)
+    __slots__ = ("header", "frames")
+
+    def __init__(self, flags, packet_number, connection_id, frames, version=WIRE_VERSION):
+        self.header = Header(connection_id, packet_number, flags, version)
         self.frames = frames
 
     def serialize(self):
         # Serialize header
-        serialized_packet = self.header.serialize()
-        # Serialize frames
-        for frame in self.frames:
-            serialized_packet += frame.serialize()
+        parts = [self.header.serialize()]
+        # Serialize frames in the wire version of the header, with MAX_DATA_FLAG the credits go first
+        # (as serialize_into and the decoder do), else the frames keep their order
+        version = self.header.version
+        frames = self.frames
+        if self.header.flags & MAX_DATA_FLAG:
+            frames = ([frame for frame in frames if isinstance(frame, MaxDataFrame)]
+                      + [frame for frame in frames if not isinstance(frame, MaxDataFrame)])
+        for frame in frames:
+            parts.append(frame.serialize(version))
+
+        return b"".join(parts)
+
+    def serialize_into(self, buffer, offset=0):
+        """
+        Write the packet into a preallocated bytearray (or writable memoryview), as serialize() would.
 
-        return serialized_packet
+        :return: offset after the packet, the datagram is buffer[offset:end].
+        """
+        header = self.header
+        version = header.version
+        offset = header.serialize_into(buffer, offset)
+        if header.flags & MAX_DATA_FLAG:
+            for frame in self.frames:
+                if isinstance(frame, MaxDataFrame):     # the credits go first
+                    offset = frame.serialize_into(buffer, offset, version)
+            frames = [frame for frame in self.frames if not isinstance(frame, MaxDataFrame)]
+        else:
+            frames = self.frames
+        for frame in frames:
+            offset = frame.serialize_into(buffer, offset, version)
+        return offset
 
     @staticmethod
-    def deserialize(data):
-        # Deserialize header - length of header is 9 bytes
-        deserialized_header = Header.deserialize(data[:9])
-        data = data[9:]
+    def deserialize(data, lazy=False):
+        """
+        Decode a datagram into a Quic_packet without copying the frame payloads.
+
+        :param data: bytes, bytearray or memoryview holding one serialized packet.
+        :param lazy: if True the frames are parsed only when packet.frames is iterated.
+        :return: Quic_packet whose frame data are memoryview slices of data.
+        """
+        view = memoryview(data)
+        # Deserialize header - 9 bytes in version 1, 5 bytes and the packet number varint in version 2
+        header, offset = Header.deserialize_from(view)
 
         # Deserialize frames each frame (contains stream_id, offset, data_length, data)
-        # check what is the length of each frame
-        # frame_length = 18 + data_length
-        frames = []
-        while data:
-            # 18 bytes for stream_id, offset, data_length + data_length
-            frame_size = 18 + struct.unpack("!Q", data[10:18])[0]
-            frame = Frame.deserialize(data[:frame_size])
-            frames.append(frame)
-            data = data[frame_size:]
+        # by walking the same view, frame_length = frame header + data_length
+        credits = None
+        if header.flags & MAX_DATA_FLAG:
+            credits, offset = MaxDataFrame.deserialize_from(view, offset)
+        if header.flags & ACK_FLAG:
+            frames = [AckFrame.deserialize_from(view, offset)[0]]
+        elif lazy and credits is None:
+            frames = LazyFrames(view, offset, header.version)
+        else:
+            frames = decode_frames(view, offset, header.version)
+        if credits is not None:
+            frames.append(credits)      # last, so frames[0] stays the ACK or first stream frame
+
+        packet = Quic_packet(header.flags, header.packet_number, header.connection_id, frames, header.version)
+        return packet
+
+
+def decode_frames(view, offset, version=WIRE_VERSION):
+    """
+    Decode all frames of a serialized payload starting at offset of the given memoryview.
+    """
+    frames = []
+    end = len(view)
+    if version == 1:
+        unpack_from = FRAME_STRUCT.unpack_from
+        try:
+            while offset < end:
+                stream_id, frame_offset, data_length = unpack_from(view, offset)
+                offset += FRAME_HEADER_SIZE
+                if offset + data_length > end:
+                    raise ValueError(f"Truncated frame: {data_length} bytes announced, {end - offset} available")
+                frames.append(Frame(stream_id, frame_offset, data_length, view[offset:offset + data_length]))
+                offset += data_length
+        except struct.error:
+            raise ValueError("Truncated frame header") from None
+        return frames
+    structs = VARINT_FRAME_STRUCTS
+    masks = VARINT_MASKS
+    try:
+        while offset < end:
+            # the prefixes of the two varints select the layout of the whole frame header
+            offset_prefix = view[offset + 2] >> 6
+            length_prefix = view[offset + 3 + (1 << offset_prefix) - 1] >> 6
+            frame_struct = structs[offset_prefix][length_prefix]
+            stream_id, frame_offset, data_length = frame_struct.unpack_from(view, offset)
+            frame_offset &= masks[offset_prefix]
+            data_length &= masks[length_prefix]
+            offset += frame_struct.size
+            if offset + data_length > end:
+                raise ValueError(f"Truncated frame: {data_length} bytes announced, {end - offset} available")
+            frames.append(Frame(stream_id, frame_offset, data_length, view[offset:offset + data_length]))
+            offset += data_length
+    except (IndexError, struct.error):
+        raise ValueError("Truncated frame header") from None
+    return frames
+
+
+def iter_frames(view, offset, version=WIRE_VERSION):
+    """
+    Yield the frames of a serialized payload starting at offset of the given memoryview.
+    """
+    end = len(view)
+    while offset < end:
+        frame, offset = Frame.deserialize_from(view, offset, version)
+        yield frame
+
+
+class LazyFrames:
+    # frames of a received packet that are decoded only while iterating,
+    # the view must stay valid (the receive buffer not reused) until the frames are consumed
+    def __init__(self, view, offset, version=WIRE_VERSION):
+        self.view = view
+        self.offset = offset
+        self.version = version
+
+    def __iter__(self):
+        return iter_frames(self.view, self.offset, self.version)
+
+    def __bool__(self):
+        return self.offset < len(self.view)
 
-        return Quic_packet(deserialized_header.flags, deserialized_header.packet_number, deserialized_header.connection_id, frames)
+
+def as_view(data):
+    """
+    Return a zero-copy byte view of a payload, str payloads are encoded to UTF-8 once.
+
+    :param data: str, bytes, bytearray or memoryview.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    view = memoryview(data)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+class FramePool:
+    # Frame objects for the sender to reuse: the frames of a packet are released once it was
+    # written into the send buffer, the next packets take them again instead of new objects
+    __slots__ = ("free", "limit")
+
+    def __init__(self, limit=256):
+        self.free = []
+        self.limit = limit      # frames kept at most
+
+    def acquire(self, stream_id, offset, data_length, data):
+        if not self.free:
+            return Frame(stream_id, offset, data_length, data)
+        frame = self.free.pop()
+        frame.stream_id = stream_id
+        frame.offset = offset
+        frame.data_length = data_length
+        frame.data = data
+        return frame
+
+    def release(self, frames):
+        free = self.free
+        for frame in frames:
+            if type(frame) is Frame and len(free) < self.limit:
+                frame.data = None       # do not keep the view of the source alive
+                free.append(frame)
+
+
+class AckFrame:
+    # +-------------------------+
+    # |  largest acknowledged   |
+    # |-------------------------|
+    # | ack delay (microsecond) |
+    # |-------------------------|
+    # |       range count       |
+    # |-------------------------|
+    # |  first | last  (range 1)|
+    # |-------------------------|
+    # |          ...            |
+    # +-------------------------+
+    # acknowledges the received packet numbers of a connection, the ranges are inclusive and
+    # ordered from the highest packet numbers down, so a whole window of packets costs 18 bytes
+    __slots__ = ("largest_acknowledged", "ack_delay", "ranges")
+
+    def __init__(self, largest_acknowledged, ack_delay, ranges):
+        self.largest_acknowledged = largest_acknowledged
+        self.ack_delay = ack_delay      # seconds between receiving the largest packet and sending this ACK
+        self.ranges = ranges            # [(first, last), ...] highest first
+
+    def serialize(self, version=WIRE_VERSION):
+        # the same layout in both wire versions
+        parts = [ACK_STRUCT.pack(self.largest_acknowledged, min(int(self.ack_delay * 1e6), 0xFFFFFFFF), len(self.ranges))]
+        parts += [ACK_RANGE_STRUCT.pack(first, last) for first, last in self.ranges]
+        return b"".join(parts)
+
+    def serialize_into(self, buffer, offset, version=WIRE_VERSION):
+        ACK_STRUCT.pack_into(buffer, offset, self.largest_acknowledged, min(int(self.ack_delay * 1e6), 0xFFFFFFFF),
+                             len(self.ranges))
+        offset += ACK_STRUCT.size
+        for first, last in self.ranges:
+            ACK_RANGE_STRUCT.pack_into(buffer, offset, first, last)
+            offset += ACK_RANGE_STRUCT.size
+        return offset
+
+    @staticmethod
+    def deserialize_from(view, offset):
+        """
+        :return: (frame, offset after the frame).
+        """
+        largest_acknowledged, ack_delay, count = ACK_STRUCT.unpack_from(view, offset)
+        offset += ACK_STRUCT.size
+        ranges = []
+        for _ in range(count):
+            ranges.append(ACK_RANGE_STRUCT.unpack_from(view, offset))
+            offset += ACK_RANGE_STRUCT.size
+        return AckFrame(largest_acknowledged, ack_delay / 1e6, ranges), offset
+
+    def packet_numbers(self):
+        # every acknowledged packet number
+        for first, last in self.ranges:
+            yield from range(first, last + 1)
+
+
+class MaxDataFrame:
+    # +-------------------------+
+    # |        max data         |
+    # |-------------------------|
+    # | initial max stream data |
+    # |-------------------------|
+    # |       stream count      |
+    # |-------------------------|
+    # | stream id | max stream  |
+    # |-------------------------|
+    # |          ...            |
+    # +-------------------------+
+    # flow control credits of the receiver (MAX_DATA and MAX_STREAM_DATA of QUIC, in one frame):
+    # the sender may send stream bytes up to max data on the connection and up to the max stream
+    # data of each stream. Every number is a varint, initial max stream data (0 = unchanged) is the
+    # limit of the streams that are not listed, it is set in the SYN-ACK.
+    __slots__ = ("max_data", "max_stream_data", "initial_max_stream_data")
+
+    def __init__(self, max_data, max_stream_data, initial_max_stream_data=0):
+        self.max_data = max_data
+        self.max_stream_data = max_stream_data      # {stream_id: highest offset allowed}
+        self.initial_max_stream_data = initial_max_stream_data
+
+    def serialize(self, version=WIRE_VERSION):
+        # the same layout in both wire versions
+        parts = [serialize_varint(self.max_data), serialize_varint(self.initial_max_stream_data),
+                 serialize_varint(len(self.max_stream_data))]
+        for stream_id, limit in self.max_stream_data.items():
+            parts.append(STREAM_ID_STRUCT.pack(stream_id) + serialize_varint(limit))
+        return b"".join(parts)
+
+    def serialize_into(self, buffer, offset, version=WIRE_VERSION):
+        offset = serialize_varint_into(buffer, offset, self.max_data)
+        offset = serialize_varint_into(buffer, offset, self.initial_max_stream_data)
+        offset = serialize_varint_into(buffer, offset, len(self.max_stream_data))
+        for stream_id, limit in self.max_stream_data.items():
+            STREAM_ID_STRUCT.pack_into(buffer, offset, stream_id)
+            offset = serialize_varint_into(buffer, offset + STREAM_ID_STRUCT.size, limit)
+        return offset
+
+    @staticmethod
+    def deserialize_from(view, offset):
+        """
+        :return: (frame, offset after the frame).
+        """
+        max_data, offset = deserialize_varint(view, offset)
+        initial_max_stream_data, offset = deserialize_varint(view, offset)
+        count, offset = deserialize_varint(view, offset)
+        max_stream_data = {}
+        for _ in range(count):
+            stream_id, = STREAM_ID_STRUCT.unpack_from(view, offset)
+            max_stream_data[stream_id], offset = deserialize_varint(view, offset + STREAM_ID_STRUCT.size)
+        return MaxDataFrame(max_data, max_stream_data, initial_max_stream_data), offset
 
 
 class Header:
@@ -112,20 +504,55 @@ class Header:
     # |------------------------|
     # | syn | ack | data | fin |
     # +------------------------+
-    def __init__(self, connection_id, packet_number, flags):
+    # (version 2: connection ID, flags | VARINT_FLAG, packet number varint)
+    __slots__ = ("connection_id", "packet_number", "flags", "version")
+
+    def __init__(self, connection_id, packet_number, flags, version=WIRE_VERSION):
         self.connection_id = connection_id
         self.packet_number = packet_number
         self.flags = flags
+        self.version = version
 
     def serialize(self):
-        # Pack connection_id, packet_number, and flags into 9 bytes with network byte order
-        return struct.pack("!IIB", self.connection_id, self.packet_number, self.flags)
+        if self.version == 1:
+            # Pack connection_id, packet_number, and flags into 9 bytes with network byte order
+            return HEADER_STRUCT.pack(self.connection_id, self.packet_number, self.flags)
+        return SHORT_HEADER_STRUCT.pack(self.connection_id, self.flags | VARINT_FLAG) + serialize_varint(self.packet_number)
+
+    def serialize_into(self, buffer, offset=0):
+        if self.version == 1:
+            HEADER_STRUCT.pack_into(buffer, offset, self.connection_id, self.packet_number, self.flags)
+            return offset + HEADER_SIZE
+        packet_number = self.packet_number
+        if packet_number < 0x4000:      # the first 16383 packets, without a function call
+            SHORT_HEADER_STRUCT.pack_into(buffer, offset, self.connection_id, self.flags | VARINT_FLAG)
+            if packet_number < 0x40:
+                buffer[offset + 5] = packet_number
+                return offset + 6
+            VARINT_16.pack_into(buffer, offset + 5, packet_number | 0x4000)
+            return offset + 7
+        SHORT_HEADER_STRUCT.pack_into(buffer, offset, self.connection_id, self.flags | VARINT_FLAG)
+        return serialize_varint_into(buffer, offset + SHORT_HEADER_STRUCT.size, packet_number)
 
     @staticmethod
     def deserialize(data):
+        header, _ = Header.deserialize_from(memoryview(data))
+        return header
+
+    @staticmethod
+    def deserialize_from(view):
+        """
+        Decode the header of either wire version at the start of a memoryview.
+
+        :return: (header, offset of the payload).
+        """
+        if view[4] & VARINT_FLAG:
+            connection_id, flags = SHORT_HEADER_STRUCT.unpack_from(view, 0)
+            packet_number, offset = deserialize_varint(view, SHORT_HEADER_STRUCT.size)
+            return Header(connection_id, packet_number, flags & ~VARINT_FLAG, 2), offset
         # Unpack 9 bytes into connection_id, packet_number, and flags with network byte order
-        connection_id, packet_number, flags = struct.unpack("!IIB", data)
-        return Header(connection_id, packet_number, flags)
+        connection_id, packet_number, flags = HEADER_STRUCT.unpack_from(view, 0)
+        return Header(connection_id, packet_number, flags, 1), HEADER_SIZE
 
 
 class Frame:
@@ -138,22 +565,81 @@ class Frame:
     # |-------------|
     # |    data     |
     # +-------------+
+    __slots__ = ("stream_id", "offset", "data_length", "data")
+
     def __init__(self, stream_id, offset, data_length, data):
+        # data is bytes, bytearray or memoryview, str is still accepted for the old callers
+        # and encoded once here, data_length is always the number of bytes on the wire
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+            data_length = len(data)
         self.stream_id = stream_id
         self.offset = offset
         self.data_length = data_length
         self.data = data
 
-    def serialize(self):
-        # Serialize stream_id as a 2-byte integer, offset as an 8-byte integer,
-        # data_length as an 8-byte integer, and data as-is
-        serialized_frame = struct.pack("!HQQ", self.stream_id, self.offset, self.data_length) + self.data.encode('utf-8')
+    def serialize(self, version=WIRE_VERSION):
+        if version == 1:
+            # Serialize stream_id as a 2-byte integer, offset as an 8-byte integer,
+            # data_length as an 8-byte integer, and data as-is
+            return FRAME_STRUCT.pack(self.stream_id, self.offset, self.data_length) + self.data
+        # Serialize stream_id as a 2-byte integer, offset and data_length as variable-length integers
+        return b"".join((STREAM_ID_STRUCT.pack(self.stream_id), serialize_varint(self.offset),
+                         serialize_varint(self.data_length), self.data))
+
+    def serialize_into(self, buffer, offset, version=WIRE_VERSION):
+        """
+        Write the frame header with one pack_into and copy the data after it.
+
+        :return: offset after the frame.
+        """
+        length = self.data_length
+        if version == 1:
+            FRAME_STRUCT.pack_into(buffer, offset, self.stream_id, self.offset, length)
+            offset += FRAME_HEADER_SIZE
+        else:
+            # varint_prefix inlined, this runs for every frame sent
+            frame_offset = self.offset
+            offset_prefix = (0 if frame_offset < 0x40 else 1 if frame_offset < 0x4000 else
+                             2 if frame_offset < 0x40000000 else varint_prefix(frame_offset))
+            length_prefix = 0 if length < 0x40 else 1 if length < 0x4000 else varint_prefix(length)
+            frame_struct = VARINT_FRAME_STRUCTS[offset_prefix][length_prefix]
+            # a 1-byte varint has no prefix bits to set, its code "B" takes the value as is
+            frame_struct.pack_into(buffer, offset, self.stream_id, frame_offset | VARINT_PREFIXES[offset_prefix],
+                                   length | VARINT_PREFIXES[length_prefix])
+            offset += frame_struct.size
+        buffer[offset:offset + length] = self.data
+        return offset + length
 
-        return serialized_frame
+    def header_size(self, version=WIRE_VERSION):
+        # bytes of the frame on the wire besides its data
+        if version == 1:
+            return FRAME_HEADER_SIZE
+        return STREAM_ID_STRUCT.size + varint_size(self.offset) + varint_size(self.data_length)
 
     @staticmethod
-    def deserialize(data):
-        # Deserialize 18 bytes into stream_id, offset, data_length, and data
-        stream_id, offset, data_length = struct.unpack("!HQQ", data[:18])
-        data = data[18:]
-        return Frame(stream_id, offset, data_length, data.decode('utf-8'))
+    def deserialize(data, version=WIRE_VERSION):
+        frame, _ = Frame.deserialize_from(memoryview(data), 0, version)
+        return frame
+
+    @staticmethod
+    def deserialize_from(view, offset, version=WIRE_VERSION):
+        """
+        Decode one frame that starts at offset of a memoryview.
+
+        :return: (frame, offset of the next frame), frame.data is a view into the same buffer.
+        """
+        if version == 1:
+            stream_id, frame_offset, data_length = FRAME_STRUCT.unpack_from(view, offset)
+            start = offset + FRAME_HEADER_SIZE
+        else:
+            try:
+                stream_id, = STREAM_ID_STRUCT.unpack_from(view, offset)
+                frame_offset, start = deserialize_varint(view, offset + STREAM_ID_STRUCT.size)
+                data_length, start = deserialize_varint(view, start)
+            except (IndexError, struct.error):
+                raise ValueError("Truncated frame header") from None
+        end = start + data_length
+        if end > len(view):
+            raise ValueError(f"Truncated frame: {data_length} bytes announced, {len(view) - start} available")
+        return Frame(stream_id, frame_offset, data_length, view[start:end]), end
@@ -0,0 +1,126 @@
+# per-stream reassembly of the received frames
+# every frame carries the offset of its data in the stream, so frames that arrive
+# reordered or duplicated are placed by offset instead of being appended in arrival order.
+# RangeSet keeps the received byte ranges as a sorted list of disjoint intervals,
+# StreamBuffer combines it with a growable bytearray holding the stream data.
+
+from bisect import bisect_left, bisect_right
+
+
+class RangeSet:
+    # sorted, disjoint, non-touching half open intervals [start, end)
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def add(self, start, end):
+        """
+        Mark [start, end) as received.
+
+        :return: list of (start, end) parts of the range that were not received before.
+        """
+        if start >= end:
+            return []
+        starts, ends = self.starts, self.ends
+        i = bisect_left(ends, start)    # first interval that ends at or after start
+        j = bisect_right(starts, end)   # intervals i..j-1 overlap or touch [start, end)
+        new_ranges = []
+        cursor = start
+        for k in range(i, j):
+            if starts[k] > cursor:
+                new_ranges.append((cursor, min(starts[k], end)))
+            cursor = max(cursor, ends[k])
+        if cursor < end:
+            new_ranges.append((cursor, end))
+        if i < j:
+            start = min(start, starts[i])
+            end = max(end, ends[j - 1])
+        starts[i:j] = [start]
+        ends[i:j] = [end]
+        return new_ranges
+
+    def contains(self, start, end):
+        # True if all of [start, end) was already received
+        i = bisect_right(self.starts, start) - 1
+        return i >= 0 and self.ends[i] >= end
+
+    def contiguous(self):
+        # the high-water mark: every byte before it was received
+        if self.starts and self.starts[0] == 0:
+            return self.ends[0]
+        return 0
+
+    def gaps(self, size=None):
+        """
+        Missing ranges between the received ones.
+
+        :param size: final size of the stream if known, to also report a missing tail.
+        :return: list of (start, end) ranges that were not received.
+        """
+        missing = []
+        cursor = 0
+        for start, end in zip(self.starts, self.ends):
+            if start > cursor:
+                missing.append((cursor, start))
+            cursor = end
+        if size is not None and cursor < size:
+            missing.append((cursor, size))
+        return missing
+
+    def total(self):
+        # number of received bytes
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class StreamBuffer:
+    # reassembly buffer of one stream, each frame is copied once into place by its offset
+    def __init__(self):
+        self.data = bytearray()
+        self.ranges = RangeSet()
+        self.duplicate_bytes = 0
+
+    def write(self, offset, data):
+        """
+        Place data at offset of the stream, bytes that were already received are dropped.
+
+        :param offset: offset of data in the stream.
+        :param data: bytes-like payload of a frame.
+        :return: number of new bytes stored.
+        """
+        length = len(data)
+        new_ranges = self.ranges.add(offset, offset + length)
+        stored = 0
+        buffer = self.data
+        for start, end in new_ranges:
+            chunk = data[start - offset:end - offset]
+            if start == len(buffer):
+                buffer += chunk                             # in order, plain append
+            else:
+                if end > len(buffer):
+                    buffer.extend(bytes(end - len(buffer)))  # grow to fit a frame past a gap
+                buffer[start:end] = chunk
+            stored += end - start
+        self.duplicate_bytes += length - stored
+        return stored
+
+    def contiguous(self):
+        # number of bytes that can be delivered in order
+        return self.ranges.contiguous()
+
+    def gaps(self, size=None):
+        return self.ranges.gaps(size)
+
+    def read(self, start, end):
+        # a copy of received bytes, the buffer can still grow
+        return self.data[start:end]
+
+    def complete(self, size=None):
+        # True if there are no holes (and all size bytes arrived when size is known)
+        size = len(self.data) if size is None else size
+        return self.contiguous() >= size
+
+    def __len__(self):
+        return len(self.data)
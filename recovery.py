@@ -0,0 +1,144 @@
+# loss recovery of the sender (after RFC 9002)
+# every data packet that is sent is kept in a map by packet number together with the stream
+# ranges it carries, until an ACK frame acknowledges it. A packet is declared lost when a packet
+# sent kPacketThreshold packets later was acknowledged, or when it is older than 9/8 of the
+# round trip time and a later packet was acknowledged. Its ranges are then sent again in new
+# packets (packet numbers are never reused). If no ACK arrives for a probe timeout (PTO), the
+# oldest packet in flight is sent again as a probe and the timeout doubles.
+
+from collections import OrderedDict
+
+from reassembly import RangeSet
+
+PACKET_THRESHOLD = 3        # reordering tolerated before a packet is declared lost
+TIME_THRESHOLD = 9 / 8      # of the RTT
+GRANULARITY = 0.001         # timer granularity (seconds)
+INITIAL_RTT = 0.1           # RTT assumed before the first sample (seconds)
+
+
+class SentPacket:
+    def __init__(self, packet_number, time_sent, size, ranges):
+        self.packet_number = packet_number
+        self.time_sent = time_sent
+        self.size = size
+        self.ranges = ranges        # [(stream_id, offset, length), ...] of its frames
+
+
+class RttEstimator:
+    # smoothed RTT and RTT variance from the ACK samples
+    def __init__(self, initial_rtt=INITIAL_RTT, max_ack_delay=0.025):
+        """
+        :param max_ack_delay: longest the receiver delays an ACK (the server's ack_delay).
+        """
+        self.max_ack_delay = max_ack_delay
+        self.latest_rtt = 0
+        self.min_rtt = None
+        self.smoothed_rtt = initial_rtt
+        self.rttvar = initial_rtt / 2
+        self.samples = 0
+
+    def update(self, latest_rtt, ack_delay):
+        """
+        Add an RTT sample.
+
+        :param ack_delay: time the receiver held the ACK, it is not part of the path delay.
+        """
+        self.latest_rtt = latest_rtt
+        if self.min_rtt is None or latest_rtt < self.min_rtt:
+            self.min_rtt = latest_rtt
+        if self.samples == 0:
+            self.smoothed_rtt = latest_rtt
+            self.rttvar = latest_rtt / 2
+        else:
+            adjusted_rtt = latest_rtt
+            if latest_rtt >= self.min_rtt + ack_delay:
+                adjusted_rtt = latest_rtt - min(ack_delay, self.max_ack_delay)
+            self.rttvar = 3 / 4 * self.rttvar + 1 / 4 * abs(self.smoothed_rtt - adjusted_rtt)
+            self.smoothed_rtt = 7 / 8 * self.smoothed_rtt + 1 / 8 * adjusted_rtt
+        self.samples += 1
+
+    def pto(self):
+        # probe timeout before any backoff
+        return self.smoothed_rtt + max(4 * self.rttvar, GRANULARITY) + self.max_ack_delay
+
+
+class LossRecovery:
+    def __init__(self, max_ack_delay=0.025):
+        self.sent = OrderedDict()       # packet number -> SentPacket, in sending order
+        self.acked = RangeSet()         # acknowledged packet numbers
+        self.rtt = RttEstimator(max_ack_delay=max_ack_delay)
+        self.largest_acked = None
+        self.loss_time = None           # when the next packet crosses the time threshold
+        self.last_sent_time = None
+        self.pto_count = 0
+        self.lost_packets = 0
+        self.probes = 0
+
+    def on_packet_sent(self, packet_number, ranges, size, now):
+        self.sent[packet_number] = SentPacket(packet_number, now, size, ranges)
+        self.last_sent_time = now
+
+    def on_ack_received(self, frame, now):
+        """
+        Process an ACK frame.
+
+        :return: (newly acknowledged SentPackets, SentPackets declared lost).
+        """
+        acked = []
+        for first, last in frame.ranges:
+            for start, end in self.acked.add(first, last + 1):     # only the new packet numbers
+                for packet_number in range(start, end):
+                    packet = self.sent.pop(packet_number, None)
+                    if packet is not None:
+                        acked.append(packet)
+        if not acked:
+            return [], []
+        largest = max(acked, key=lambda packet: packet.packet_number)
+        if self.largest_acked is None or frame.largest_acknowledged > self.largest_acked:
+            self.largest_acked = frame.largest_acknowledged
+            if largest.packet_number == frame.largest_acknowledged:
+                self.rtt.update(now - largest.time_sent, frame.ack_delay)
+        self.pto_count = 0
+        return acked, self.detect_lost(now)
+
+    def detect_lost(self, now):
+        # remove and return the packets that can no longer be in flight
+        self.loss_time = None
+        if self.largest_acked is None:
+            return []
+        loss_delay = max(TIME_THRESHOLD * max(self.rtt.latest_rtt, self.rtt.smoothed_rtt), GRANULARITY)
+        lost = []
+        for packet in list(self.sent.values()):
+            if packet.packet_number > self.largest_acked:
+                break
+            if packet.packet_number <= self.largest_acked - PACKET_THRESHOLD or packet.time_sent <= now - loss_delay:
+                lost.append(self.sent.pop(packet.packet_number))
+            else:
+                deadline = packet.time_sent + loss_delay
+                self.loss_time = deadline if self.loss_time is None else min(self.loss_time, deadline)
+        self.lost_packets += len(lost)
+        return lost
+
+    def deadline(self):
+        # time of the next loss or probe timeout, None when nothing is in flight
+        if self.loss_time is not None:
+            return self.loss_time
+        if not self.sent:
+            return None
+        return self.last_sent_time + self.rtt.pto() * 2 ** self.pto_count
+
+    def on_timeout(self, now):
+        """
+        The deadline() passed.
+
+        :return: the SentPackets whose ranges must be sent again (lost ones, or a probe).
+        """
+        if self.loss_time is not None:
+            return self.detect_lost(now)
+        if not self.sent:
+            return []
+        # probe timeout: send the oldest packet again, it stays in flight until acknowledged or lost
+        self.pto_count += 1
+        self.probes += 1
+        self.last_sent_time = now
+        return [next(iter(self.sent.values()))]
@@ -0,0 +1,218 @@
+# UDP relay that impairs the traffic, for testing and benchmarking on loopback
+# the client sends to the relay instead of the server, the relay forwards every datagram to the
+# server from its own socket and the answers back to the client. On the way, in both directions,
+# it can (like Linux netem):
+# - drop a random share of the packets (loss), only those whose flags intersect lossy_flags, so
+#   the handshake can be kept reliable while data, ACK, FIN and parity packets are lost,
+# - delay them by a fixed time plus a random jitter, a datagram never overtakes the previous one of
+#   its direction (the jitter of a queue, unlike netem's),
+# - hold back a share of them a little longer so the next ones arrive first (reorder),
+# - send a share of them twice (duplicate),
+# - cap the bandwidth of each direction, packets wait in a queue of queue_limit bytes while the
+#   link is busy and are dropped when it is full,
+# - drop the datagrams larger than an MTU.
+# Every decision comes from one seeded random generator in the order the datagrams arrive, so a
+# run can be repeated. Run it standalone with: python relay.py --server HOST:PORT [options]
+
+import argparse
+import heapq
+import random
+import select
+import socket
+import threading
+import time
+
+from quic import HEADER_STRUCT, SYN_FLAG, DATA_FLAG, ACK_FLAG, FIN_FLAG, PARITY_FLAG, peek_flags
+
+# named impairments for the tests, the benchmarks and the command line
+PROFILES = {
+    "loopback": {},
+    "lan": {"delay": 0.0005, "jitter": 0.0002},
+    "wan": {"delay": 0.02, "jitter": 0.002, "loss": 0.005},
+    "lossy": {"delay": 0.005, "jitter": 0.001, "loss": 0.03},
+    "wifi": {"delay": 0.005, "jitter": 0.004, "loss": 0.01, "reorder": 0.02, "duplicate": 0.01},
+    "capped": {"delay": 0.005, "bandwidth": 10 * 1000 * 1000, "queue_limit": 256 * 1024},
+}
+
+
+class LossyRelay:
+    def __init__(self, server_address, loss=0.0, seed=None,
+                 lossy_flags=DATA_FLAG | ACK_FLAG | FIN_FLAG | PARITY_FLAG, ip="127.0.0.1", port=0, delay=0.0,
+                 jitter=0.0, reorder=0.0, reorder_gap=0.002, duplicate=0.0, bandwidth=None, queue_limit=1024 * 1024,
+                 mtu=None):
+        """
+        :param server_address: where the datagrams of the client are forwarded.
+        :param loss: probability of dropping a datagram, in both directions.
+        :param seed: seed of the random decisions, for repeatable runs.
+        :param lossy_flags: only packets with one of these header flags are dropped.
+        :param port: port the client sends to, 0 picks a free one (see self.address).
+        :param delay: one-way delay added to every datagram (seconds).
+        :param jitter: the delay varies uniformly by up to this much either way (seconds).
+        :param reorder: probability of holding a datagram back by reorder_gap more seconds.
+        :param duplicate: probability of sending a datagram twice.
+        :param bandwidth: bytes per second of each direction, None for no limit.
+        :param queue_limit: bytes waiting for the link beyond which datagrams are dropped (with bandwidth).
+        :param mtu: datagrams larger than this are dropped, None for no limit.
+        """
+        self.server_address = server_address
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.lossy_flags = lossy_flags
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorder_gap = reorder_gap
+        self.duplicate = duplicate
+        self.bandwidth = bandwidth
+        self.queue_limit = queue_limit
+        self.mtu = mtu
+        self.client_side = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client_side.bind((ip, port))
+        self.server_side = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server_side.bind((ip, 0))
+        self.address = self.client_side.getsockname()
+        self.client_address = None      # learned from the first datagram of the client
+        self.scheduled = []             # heap of (delivery time, sequence, datagram, socket, address)
+        self.sequence = 0
+        self.link_free = {}             # time each direction's link is busy until (with bandwidth)
+        self.last_delivery = {}         # delivery time of the last datagram in order of each direction
+        self.forwarded = 0
+        self.dropped = 0                # lost, including the overflows and the datagrams too large
+        self.duplicated = 0
+        self.reordered = 0
+        self.overflowed = 0
+        self.too_large = 0
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def from_profile(cls, server_address, profile, **options):
+        # a relay with the impairments of a named profile, options override them
+        return cls(server_address, **dict(PROFILES[profile], **options))
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.client_side.close()
+        self.server_side.close()
+
+    def run(self):
+        while self.running:
+            self.deliver(time.monotonic())
+            timeout = 0.05
+            if self.scheduled:
+                timeout = min(timeout, max(self.scheduled[0][0] - time.monotonic(), 0))
+            readable, _, _ = select.select([self.client_side, self.server_side], [], [], timeout)
+            for sock in readable:
+                data, address = sock.recvfrom(65536)
+                if sock is self.client_side:
+                    self.client_address = address
+                    destination, out = self.server_address, self.server_side
+                else:
+                    if self.client_address is None:
+                        continue
+                    destination, out = self.client_address, self.client_side
+                self.forward(data, out, destination, time.monotonic())
+
+    def forward(self, data, out, destination, now):
+        # decide the fate of a datagram: dropped, or scheduled once or twice for delivery
+        if self.mtu is not None and len(data) > self.mtu:
+            self.too_large += 1
+            self.dropped += 1
+            return
+        if self.drop(data):
+            self.dropped += 1
+            return
+        copies = 1
+        if self.duplicate and self.random.random() < self.duplicate:
+            copies = 2
+            self.duplicated += 1
+        for _ in range(copies):
+            departure = self.transmit(len(data), out, now)
+            if departure is None:
+                self.overflowed += 1
+                self.dropped += 1
+                continue
+            delivery_time = departure + self.delay
+            if self.jitter:
+                delivery_time = max(delivery_time + self.random.uniform(-self.jitter, self.jitter),
+                                    self.last_delivery.get(out, 0), departure)
+            if self.reorder and self.random.random() < self.reorder:
+                self.reordered += 1
+                delivery_time += self.reorder_gap   # the next datagrams overtake this one
+            else:
+                self.last_delivery[out] = delivery_time
+            self.schedule(delivery_time, data, out, destination)
+        self.deliver(now)
+
+    def transmit(self, size, out, now):
+        # time the datagram has left the bandwidth limited link, None if its queue is full
+        if not self.bandwidth:
+            return now
+        start = max(now, self.link_free.get(out, now))
+        if (start - now) * self.bandwidth > self.queue_limit:
+            return None
+        self.link_free[out] = start + size / self.bandwidth
+        return self.link_free[out]
+
+    def schedule(self, delivery_time, data, out, destination):
+        self.sequence += 1
+        heapq.heappush(self.scheduled, (delivery_time, self.sequence, data, out, destination))
+
+    def deliver(self, now):
+        # send the datagrams whose time has come
+        while self.scheduled and self.scheduled[0][0] <= now:
+            _, _, data, out, destination = heapq.heappop(self.scheduled)
+            try:
+                out.sendto(data, destination)
+            except OSError:
+                continue    # the receiver is gone
+            self.forwarded += 1
+
+    def drop(self, data):
+        # decide whether to lose this datagram
+        if len(data) < HEADER_STRUCT.size:
+            return False
+        flags = peek_flags(data)
+        if flags & SYN_FLAG and not self.lossy_flags & SYN_FLAG:
+            return False    # the SYN-ACK also has the DATA bit set
+        return bool(flags & self.lossy_flags) and self.random.random() < self.loss
+
+    def statistics(self):
+        return {"forwarded": self.forwarded, "dropped": self.dropped, "duplicated": self.duplicated,
+                "reordered": self.reordered, "overflowed": self.overflowed, "too_large": self.too_large}
+
+
+def parse_address(text):
+    host, port = text.rsplit(":", 1)
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UDP relay between a client and a server that impairs the traffic.")
+    parser.add_argument("--server", type=parse_address, required=True, help="HOST:PORT of the server")
+    parser.add_argument("--listen", type=parse_address, default=("127.0.0.1", 0), help="HOST:PORT for the client")
+    parser.add_argument("--profile", choices=list(PROFILES), default="loopback")
+    parser.add_argument("--seed", type=int)
+    for name in ("loss", "delay", "jitter", "reorder", "reorder-gap", "duplicate", "bandwidth"):
+        parser.add_argument(f"--{name}", type=float)
+    parser.add_argument("--queue-limit", type=int)
+    parser.add_argument("--mtu", type=int)
+    args = parser.parse_args()
+    options = {name: value for name, value in vars(args).items()
+               if value is not None and name not in ("server", "listen", "profile")}
+    relay = LossyRelay.from_profile(args.server, args.profile, ip=args.listen[0], port=args.listen[1], **options)
+    print(f"- Relay on {relay.address} for {args.server}, {dict(PROFILES[args.profile], **options)}")
+    relay.start()
+    try:
+        while True:
+            time.sleep(5)
+            print(f"- {relay.statistics()}")
+    except KeyboardInterrupt:
+        relay.stop()
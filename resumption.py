@@ -0,0 +1,79 @@
+# resumption tokens for a handshake without waiting (0-RTT)
+# the server gives every client a token in its SYN-ACK: an expiry time and an HMAC of it and of
+# the client's IP address under a secret of the server, so the server keeps no state per token
+# and a token is only valid from the address it was issued to. A client that holds a token of
+# the server sends its first data frames in the SYN and goes on sending right away; without one
+# it also puts data in the SYN but waits for the SYN-ACK (and its token) before sending more.
+# The server acts on the token: the data of a SYN with a valid one is handled right away, the
+# data of a SYN without one (or with a forged or expired one) is held until the next packet of
+# the client, which without a token only sends more once it has the SYN-ACK.
+# The token travels in a frame of the reserved control stream, which carries no stream data.
+
+import hashlib
+import hmac
+import os
+import struct
+import time
+
+from quic import Frame
+
+CONTROL_STREAM_ID = 0xFFFF      # the data streams have the IDs below it
+TOKEN_LIFETIME = 24 * 3600
+EXPIRY_STRUCT = struct.Struct("!I")
+MAC_SIZE = 16
+TOKEN_SIZE = EXPIRY_STRUCT.size + MAC_SIZE
+
+# tokens of the servers this process talked to, by server address, shared by all the clients
+TOKENS = {}
+
+
+class TokenIssuer:
+    def __init__(self, secret=None, lifetime=TOKEN_LIFETIME):
+        """
+        :param secret: key of the HMAC, random by default. Servers sharing a port (workers.py) need the same one.
+        :param lifetime: seconds a token stays valid.
+        """
+        self.secret = secret or os.urandom(32)
+        self.lifetime = lifetime
+        self.issued = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    def mac(self, client_address, expiry):
+        message = client_address[0].encode() + EXPIRY_STRUCT.pack(expiry)
+        return hmac.new(self.secret, message, hashlib.sha256).digest()[:MAC_SIZE]
+
+    def issue(self, client_address, now=None):
+        expiry = int((time.time() if now is None else now) + self.lifetime)
+        self.issued += 1
+        return EXPIRY_STRUCT.pack(expiry) + self.mac(client_address, expiry)
+
+    def validate(self, token, client_address, now=None):
+        # a token of this server, for this address and not expired
+        valid = False
+        if len(token) == TOKEN_SIZE:
+            expiry, = EXPIRY_STRUCT.unpack_from(token)
+            valid = ((time.time() if now is None else now) <= expiry
+                     and hmac.compare_digest(bytes(token[EXPIRY_STRUCT.size:]), self.mac(client_address, expiry)))
+        if valid:
+            self.accepted += 1
+        else:
+            self.rejected += 1
+        return valid
+
+
+def token_frame(token):
+    return Frame(CONTROL_STREAM_ID, 0, len(token), token)
+
+
+def find_token(packet):
+    # the token of a SYN or SYN-ACK, None without one
+    for frame in packet.frames:
+        if getattr(frame, "stream_id", None) == CONTROL_STREAM_ID:
+            return bytes(frame.data)
+    return None
+
+
+def data_frames(packet):
+    # the stream frames of a SYN with data, without the token
+    return [frame for frame in packet.frames if frame.stream_id != CONTROL_STREAM_ID]
@@ -0,0 +1,65 @@
+# preallocated receive ring for the server socket
+# recvfrom(n) allocates a new n byte buffer for every datagram, instead the datagrams are read
+# with recvfrom_into into a fixed ring of bytearray slots that is allocated once. The socket is
+# non-blocking: one wait for readability (select) is followed by draining every datagram that is
+# already queued, up to a batch size, so a burst costs one wakeup instead of one per packet.
+# The returned memoryviews point into the slots, a slot is overwritten again after `slots`
+# more datagrams, so every batch must be consumed before receiving the next one.
+
+import select
+import socket
+
+MAX_DATAGRAM = 65536    # larger than the largest UDP payload (65507 bytes)
+
+
+class RecvRing:
+    def __init__(self, sock, slots=32, slot_size=MAX_DATAGRAM, batch=None):
+        """
+        :param sock: the UDP socket to receive from, it is switched to non-blocking mode.
+        :param slots: number of preallocated datagram buffers.
+        :param slot_size: size of each buffer.
+        :param batch: most datagrams returned by one receive_batch, at most slots.
+        """
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.buffers = [bytearray(slot_size) for _ in range(slots)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.batch = min(batch or slots, slots)
+        self.index = 0
+        self.wakeups = 0
+        self.datagrams = 0
+
+    def receive_batch(self, timeout=None):
+        """
+        Wait up to timeout seconds (None waits forever) for datagrams and drain the queued ones.
+
+        :return: list of (memoryview of the datagram, sender address), empty on timeout.
+        """
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return []
+        self.wakeups += 1
+        received = []
+        recvfrom_into = self.sock.recvfrom_into
+        while len(received) < self.batch:
+            view = self.views[self.index]
+            try:
+                size, address = recvfrom_into(view)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionResetError:
+                continue    # ICMP port unreachable of an earlier send on Windows
+            received.append((view[:size], address))
+            self.index = (self.index + 1) % len(self.views)
+        self.datagrams += len(received)
+        return received
+
+
+def set_receive_buffer(sock, size):
+    """
+    Ask the kernel for a size byte receive queue, so bursts are not dropped while the server is busy.
+
+    :return: the size actually granted (Linux doubles the request and caps it at net.core.rmem_max).
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    return sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
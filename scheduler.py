@@ -0,0 +1,167 @@
+# frame schedulers of the client
+# every stream keeps its index in the client's list as stream ID for the whole transfer. For each
+# packet a scheduler decides how many bytes of which streams go into it, and fills the packet up
+# to the target payload size (frame headers included) as long as any stream has data left:
+# - RoundRobinScheduler: the streams take turns of quantum bytes.
+# - WeightedFairScheduler: deficit round robin, a turn adds quantum * weight bytes to the stream's
+#   deficit (whole bytes), so every stream gets a share of the bytes proportional to its weight.
+# - PriorityScheduler: strict priority, a stream is only served when no stream of a higher
+#   priority (lower number) has data left, streams of the same priority take turns.
+# A turn can go on in the next packet, a stream has at most one frame per packet. Streams that
+# used up their flow control credits (see flow_control.py) are passed over until new ones arrive.
+
+from quic import Frame, max_frame_data, WIRE_VERSION
+
+
+class StreamState:
+    # the sending side of one stream
+    def __init__(self, stream_id, source, weight=1, priority=0):
+        self.stream_id = stream_id
+        self.source = source
+        self.size = source.size
+        self.weight = weight
+        self.priority = priority
+        self.sent = 0           # bytes handed to packets so far
+        self.opened = False     # an empty stream still needs one empty frame
+        self.deficit = 0        # bytes left in the current turn
+        self.finish_time = None
+        self.limit = None       # highest offset the receiver allows, None for no limit
+
+    @property
+    def remaining(self):
+        return self.size - self.sent
+
+    @property
+    def finished(self):
+        return self.opened and self.sent >= self.size
+
+    def window(self, credit=None):
+        # bytes the stream may send now, within its limit and the connection credit
+        window = self.remaining
+        if self.limit is not None:
+            window = min(window, self.limit - self.sent)
+        if credit is not None:
+            window = min(window, credit)
+        return window
+
+    def blocked(self, credit=None):
+        # data is left but flow control allows none of it
+        return self.remaining > 0 and self.window(credit) <= 0
+
+
+class RoundRobinScheduler:
+    def __init__(self, quantum=1200):
+        """
+        :param quantum: bytes of a turn (times the stream's weight for the weighted scheduler).
+        """
+        self.quantum = quantum
+        self.streams = []       # every stream, by stream ID
+        self.active = []        # streams with data left, in turn order
+        self.cursor = 0
+        self.turn = None        # the stream whose turn it is
+
+    def add(self, stream):
+        self.streams.append(stream)
+        self.active.append(stream)
+
+    def has_data(self):
+        return bool(self.active)
+
+    def ready(self, credit=None):
+        # True if a stream with data left may send some of it
+        return any(not stream.blocked(credit) for stream in self.active)
+
+    def pick(self, blocked=()):
+        # the stream whose turn comes next, the blocked ones are passed over (None if all are)
+        for _ in range(len(self.active)):
+            self.cursor %= len(self.active)
+            stream = self.active[self.cursor]
+            if stream not in blocked:
+                return stream
+            self.cursor += 1
+        return None
+
+    def begin_turn(self, stream):
+        stream.deficit = self.quantum
+
+    def end_turn(self, stream):
+        stream.deficit = 0
+
+    def fill(self, space, version=WIRE_VERSION, credit=None):
+        """
+        Choose the frames of the next packet.
+
+        :param space: target payload size, frame headers included.
+        :param credit: new bytes the connection may send, None for no limit.
+        :return: list of (stream, offset, length), one per stream in the packet.
+        """
+        chunks = {}
+        blocked = set()
+        while self.active:
+            stream = self.pick(blocked)
+            if stream is None:
+                break   # every stream waits for credits
+            if stream.blocked(credit):
+                blocked.add(stream)
+                if stream is self.turn:
+                    self.end_turn(stream)
+                    self.turn = None
+                continue
+            if stream is not self.turn:
+                self.turn = stream
+                self.begin_turn(stream)
+            offset, length = chunks.get(stream.stream_id, (stream.sent, 0))
+            # the frame of this stream may grow by what is left of the packet
+            frame_space = space + (frame_cost(offset, length, version) if stream.stream_id in chunks else 0)
+            fit = max_frame_data(offset, frame_space, version) - length
+            if fit < 0 or (fit == 0 and stream.opened):
+                break   # the packet is full
+            extra = min(fit, stream.window(credit), stream.deficit)
+            if credit is not None:
+                credit -= extra
+            chunks[stream.stream_id] = (offset, length + extra)
+            space = frame_space - frame_cost(offset, length + extra, version)
+            stream.sent += extra
+            stream.deficit -= extra
+            stream.opened = True
+            if stream.finished:
+                self.end_turn(stream)
+                self.active.remove(stream)     # the next stream moves to the cursor
+                self.turn = None
+            elif stream.deficit <= 0:
+                self.end_turn(stream)
+                self.turn = None
+                self.cursor += 1
+        return [(self.streams[stream_id], offset, length) for stream_id, (offset, length) in chunks.items()]
+
+
+class WeightedFairScheduler(RoundRobinScheduler):
+    # deficit round robin: what a stream could not send in its turn is kept for the next one
+    def begin_turn(self, stream):
+        # whole bytes, fractional weights must not make the frame lengths and offsets floats
+        stream.deficit += max(int(self.quantum * stream.weight), 1)
+
+    def end_turn(self, stream):
+        if stream.finished:
+            stream.deficit = 0
+
+
+class PriorityScheduler(RoundRobinScheduler):
+    # strict priority, round robin between the streams of the highest priority with data
+    def pick(self, blocked=()):
+        ready = [stream for stream in self.active if stream not in blocked]
+        if not ready:
+            return None
+        top = min(stream.priority for stream in ready)
+        streams = [stream for stream in ready if stream.priority == top]
+        self.cursor %= len(streams)
+        return streams[self.cursor]
+
+
+def frame_cost(offset, length, version=WIRE_VERSION):
+    # bytes of a frame on the wire, header and data
+    return Frame(0, offset, length, b"").header_size(version) + length
+
+
+SCHEDULERS = {"round_robin": RoundRobinScheduler, "weighted_fair": WeightedFairScheduler,
+              "priority": PriorityScheduler}
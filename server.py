@@ -1,142 +1,513 @@
 import filecmp
+import os
 import socket
 import time
+from collections import deque
 
-import client
+import transport
 from quic import *
+from connection import Connection, ConnectionTable
+from flow_control import STREAM_WINDOW, CONNECTION_WINDOW, MAX_WINDOW
+import fec
+import integrity
+import resumption
+import stats
+import tracing
+from ring import RecvRing, set_receive_buffer
 
 
 class Server:
 
-    def __init__(self, ip, port):
+    def __init__(self, ip, port, sink_dir=None, write_buffer=1024 * 1024, preallocate=0,
+                 idle_timeout=30.0, max_connections=1024, reuse_port=False, rcvbuf=None, ring_slots=32,
+                 ack_every=2, ack_delay=0.025, flow_control=True, stream_window=STREAM_WINDOW,
+                 connection_window=CONNECTION_WINDOW, max_window=MAX_WINDOW, autotune=True, trace_path=None,
+                 token_secret=None, token_lifetime=resumption.TOKEN_LIFETIME):
+        """
+        :param sink_dir: if given, every frame is written straight to output_{i}.txt in a directory
+                         of its connection under sink_dir, so the files are never held in memory.
+        :param write_buffer: bytes of write-behind buffer shared by the streams of a connection in sink mode.
+        :param preallocate: bytes reserved on disk for every output file in sink mode.
+        :param idle_timeout: seconds without packets after which a connection is evicted.
+        :param max_connections: connections kept at once, the least recently active is evicted beyond it.
+        :param reuse_port: bind with SO_REUSEPORT so several worker processes share the port (see workers.py).
+        :param rcvbuf: size of the kernel receive queue (SO_RCVBUF) so bursts of packets are not dropped.
+        :param ring_slots: preallocated datagram buffers, also the most packets handled per wakeup.
+        :param ack_every: send an ACK frame after this many data packets of a connection.
+        :param ack_delay: or at most this many seconds after the first unacknowledged one.
+        :param flow_control: limit how far each client may send beyond what was delivered in order.
+        :param stream_window: bytes a stream may be buffered beyond its in-order data.
+        :param connection_window: bytes all the streams of a connection may be buffered together.
+        :param max_window: auto-tuning grows the windows of a fast connection up to this.
+        :param autotune: double a window that is used up within two round trips.
+        :param trace_path: record the packet events to this file (see tracing.py).
+        :param token_secret: key of the resumption tokens, random by default (see resumption.py).
+        :param token_lifetime: seconds a resumption token stays valid.
+        """
         self.server_address = (ip, port)                                        # Initialize the server with the IP and port
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server_socket.bind(self.server_address)
-        self.bytes_per_stream = []
-        self.packets_per_stream = []
-        self.total_times = []
+        self.rcvbuf = set_receive_buffer(self.server_socket, rcvbuf) if rcvbuf else None
+        self.ring = RecvRing(self.server_socket, ring_slots)    # datagrams are received into preallocated slots
+        self.pending = deque()  # received packets that start() did not return yet
+        # state of every client connection by (client address, connection id)
+        self.connections = ConnectionTable(idle_timeout, max_connections, sink_dir=sink_dir,
+                                           write_buffer=write_buffer, preallocate=preallocate,
+                                           ack_every=ack_every, ack_delay=ack_delay, flow_control=flow_control,
+                                           stream_window=stream_window, connection_window=connection_window,
+                                           max_window=max_window, autotune=autotune)
+        self.ack_pending = set()    # connections with a delayed ACK to send
+        self.bytes_sent = 0         # everything the server sent back to the clients
+        self.connection = None  # connection of the last packet, the single transfer statistics are about it
+        self.finished_connections = 0
+        self.finished_bytes_per_stream = []     # per-stream totals of the connections that ended
+        self.finished_packets_per_stream = []
+        self.on_connection_closed = None    # optional callback(connection) when a connection ends
+        self.running = False
         self.total_bytes = 0
         self.total_packets = 0
-        self.files = []
-        self.total_time = 0
-        self.avg_bytes_per_sec = []
-        self.avg_packets_per_sec = []
+        self.transport = None   # asyncio datagram transport, set by transport.ServerProtocol
+        self.total_time = 0     # Python processing time of the data packets, not a basis for rates
+        self.stats = stats.FlowStats()  # wall-clock arrivals of the data packets over all the connections
+        self.tracer = tracing.Tracer(trace_path) if trace_path else None
+        self.tokens = resumption.TokenIssuer(token_secret, token_lifetime)     # of the SYN-ACKs
         print(f"- Server listening on {self.server_address}...")
 
     def start(self):
-        packet, client_address = self.server_socket.recvfrom(1024 * 1024 * 10)  # Receive data from the client (up to 10MB)
-        deserialized_packet = Quic_packet.deserialize(packet)
-        return deserialized_packet, client_address
+        # Receive one packet from a client
+        while not self.pending:
+            self.pending.extend(self.receive_batch())
+        return self.pending.popleft()
+
+    def receive_batch(self, timeout=None):
+        """
+        Wait for packets and return all the queued ones (up to ring_slots) as (packet, client_address).
+        The frame data are views into the receive ring, they are valid until the next receive_batch.
+        """
+        return [(Quic_packet.deserialize(datagram), client_address)
+                for datagram, client_address in self.ring.receive_batch(timeout)]
 
     def handle_packet(self):
-        start_time = time.time()
-        while True:
-            packet, client_address = self.start()
-
-            # Check if the packet has the SYN flag set
-            if packet.header.flags & 0b00000001:
-                print("- - Received SYN packet")
-                # Send a SYN-ACK response to acknowledge the SYN packet and establish a connection.
-                self.send_syn_ack(client_address, packet.header.packet_number, packet.header.connection_id)
-
-            # Check if the packet has the FIN flag set (indicating a connection termination request).
-            elif packet.header.flags & 0b00000100:
-                print("- - - - Received FIN packet")
-                # Send a FIN-ACK response to acknowledge the FIN packet and close the connection.
-                self.send_fin_ack(client_address, packet.header.packet_number, packet.header.connection_id)
-                # close the connection
-                break
-
-            # if it is a DATA packet
-            elif packet.header.flags & 0b00000010:
-                # Process the received data packet.
-                self.process_data_packet(packet, client_address)
+        # receive loop for a single transfer until a client sends FIN
+        closed = False
+        while not closed:
+            for packet, client_address in self.receive_batch(self.next_ack_timeout()):
+                if self.dispatch(packet, client_address):
+                    closed = True
+                    break
+            self.flush_acks()
 
         self.server_socket.close()
+        self.close_trace()
         self.print_statistics()
 
+    async def handle_packet_async(self):
+        """
+        Same as handle_packet but driven by an asyncio event loop (see transport.py).
+        """
+        await transport.serve(self)
+        self.server_socket.close()
+        self.close_trace()
+        self.print_statistics()
+
+    def serve_forever(self, poll_interval=0.5):
+        """
+        Receive any number of concurrent connections until stop() is called.
+
+        :param poll_interval: seconds between two checks for idle connections and for stop().
+        """
+        self.running = True
+        last_check = time.monotonic()
+        while self.running:
+            ack_timeout = self.next_ack_timeout()
+            timeout = poll_interval if ack_timeout is None else min(poll_interval, ack_timeout)
+            for packet, client_address in self.receive_batch(timeout):
+                self.dispatch(packet, client_address)
+            self.flush_acks()
+            now = time.monotonic()
+            if now - last_check >= poll_interval:
+                self.evict_idle(now)
+                last_check = now
+        self.server_socket.close()
+        self.close_trace()
+
+    async def serve_forever_async(self, poll_interval=0.5):
+        # same as serve_forever on the running event loop
+        self.running = True
+        await transport.serve(self, forever=True, poll_interval=poll_interval)
+        self.server_socket.close()
+        self.close_trace()
+
+    def close_trace(self):
+        if self.tracer is not None:
+            self.tracer.close()
+
+    def stop(self):
+        # ends serve_forever after the current poll interval
+        self.running = False
+
+    def dispatch(self, packet, client_address):
+        """
+        Handle one received packet, independent of how it was received.
+
+        :return: True when the client closed the connection (FIN).
+        """
+        connection_id = packet.header.connection_id
+        # Check if the packet has the SYN flag set
+        if packet.header.flags & 0b00000001:
+            print("- - Received SYN packet")
+            self.connection = self.get_connection(client_address, connection_id)
+            # Send a SYN-ACK response to acknowledge the SYN packet and establish a connection.
+            self.connection.version = packet.header.version
+            token = resumption.find_token(packet)
+            if token is not None:
+                self.connection.resumed = self.tokens.validate(token, client_address)
+            credits = None
+            if self.connection.flow is not None:    # the first limits of the client
+                credits = self.connection.flow.initial_frame()
+            self.send_syn_ack(client_address, packet.header.packet_number, connection_id, packet.header.version,
+                              credits, self.tokens.issue(client_address))
+            if packet.header.flags & DATA_FLAG:
+                # 0-RTT: the first data frames came with the SYN
+                packet.frames = resumption.data_frames(packet)
+                if self.connection.resumed:
+                    self.process_data_packet(packet, client_address)
+                else:
+                    # without a valid token the client's address is not proven: the data waits for the
+                    # handshake to complete, the next packet of the client comes after the SYN-ACK.
+                    # The frames are copied out of the receive ring
+                    packet.frames = [Frame(frame.stream_id, frame.offset, frame.data_length, bytes(frame.data))
+                                     for frame in packet.frames]
+                    self.connection.early_packet = packet
+            if self.connection.flow is not None:
+                # the round trip is measured to the next data packet, the data of the SYN did not wait for the SYN-ACK
+                self.connection.flow.on_handshake(time.perf_counter())
+
+        # Check if the packet has the FIN flag set (indicating a connection termination request).
+        elif packet.header.flags & 0b00000100:
+            print("- - - - Received FIN packet")
+            # Send a FIN-ACK response to acknowledge the FIN packet and close the connection.
+            self.send_fin_ack(client_address, packet.header.packet_number, connection_id, packet.header.version)
+            # close the connection, a repeated FIN of a closed connection is only acknowledged
+            connection = self.get_connection(client_address, connection_id, create=False)
+            if connection is not None:
+                connection.expected_digests = integrity.read_fin(packet)   # checked by print_statistics
+                if connection.acks.unacknowledged:
+                    self.send_ack(connection)
+                self.close_connection(connection)
+            return True
+
+        # if it is a DATA packet
+        elif packet.header.flags & 0b00000010:
+            # Process the received data packet.
+            self.process_data_packet(packet, client_address)
+
+        # a parity packet (fec.py), it may rebuild a lost data packet
+        elif packet.header.flags & PARITY_FLAG:
+            self.process_parity_packet(packet, client_address)
+
+        # a path MTU probe (pmtu.py): only its arrival matters, it is acknowledged right away on its
+        # own, probes are numbered apart from the data packets
+        elif packet.header.flags & PROBE_FLAG:
+            connection = self.get_connection(client_address, connection_id, create=False)
+            if connection is not None:
+                packet_number = packet.header.packet_number
+                ack = Quic_packet(ACK_FLAG | PROBE_FLAG, connection.next_packet_number(), connection_id,
+                                  [AckFrame(packet_number, 0, [(packet_number, packet_number)])], connection.version)
+                self.sendto(ack.serialize(), client_address)
+        return False
+
+    def get_connection(self, client_address, connection_id, create=True):
+        connection, evicted = self.connections.get(client_address, connection_id, create)
+        for old_connection in evicted:
+            print(f"- Connection {old_connection.key} evicted, too many connections")
+            old_connection.close()
+            self.ack_pending.discard(old_connection)
+        return connection
+
+    def close_connection(self, connection):
+        connection.close()
+        self.ack_pending.discard(connection)
+        self.connections.remove(connection)
+        self.finished_connections += 1
+        add_per_stream(self.finished_bytes_per_stream, connection.bytes_per_stream)
+        add_per_stream(self.finished_packets_per_stream, connection.packets_per_stream)
+        if self.on_connection_closed is not None:
+            self.on_connection_closed(connection)
+
+    def evict_idle(self, now=None):
+        for connection in self.connections.evict_idle(now):
+            print(f"- Connection {connection.key} evicted after {self.connections.idle_timeout} idle seconds")
+            connection.close()
+            self.ack_pending.discard(connection)
+
+    def sendto(self, datagram, client_address):
+        # send through the asyncio transport when the event loop drives the server, else the socket
+        self.bytes_sent += len(datagram)
+        if self.transport is not None:
+            self.transport.sendto(datagram, client_address)
+        else:
+            self.server_socket.sendto(datagram, client_address)
+
     def process_data_packet(self, packet, client_address):
-        start_time = time.perf_counter()
-        for frame in packet.frames:
-            if frame.stream_id >= len(self.files):  # Check if the stream ID is within the expected range
-                self.files += ["" for _ in range(frame.stream_id - len(self.files) + 1)]    # Add empty strings for new streams
-                self.bytes_per_stream += [0 for _ in range(frame.stream_id - len(self.bytes_per_stream) + 1)]   # Add 0 bytes for new streams
-                self.packets_per_stream += [0 for _ in range(frame.stream_id - len(self.packets_per_stream) + 1)]   # Add 0 packets for new streams
-                self.total_times += [start_time for _ in range(frame.stream_id - len(self.total_times) + 1)]    # Add 0 time for new streams
-            self.files[frame.stream_id] += frame.data   # Append the data to the corresponding stream
-        finish_time = time.perf_counter()
-        for frame in packet.frames: # Update the statistics for the received packet
-            self.bytes_per_stream[frame.stream_id] += len(frame.data)   # Update the total bytes received for the stream
-            self.packets_per_stream[frame.stream_id] += 1   # Update the total packets received for the stream
-            self.total_bytes += len(frame.data) # Update the total bytes received
-            self.total_times[frame.stream_id] += finish_time - start_time   # Update the total time for the stream
-            self.avg_bytes_per_sec.append(self.bytes_per_stream[frame.stream_id] / (finish_time - start_time))  # Calculate the average data rate for the stream
-            self.avg_packets_per_sec.append(self.packets_per_stream[frame.stream_id] / (finish_time - start_time))  # Calculate the average packet rate for the stream
+        # the frames go to the streams of the packet's connection, the totals are over all connections.
+        # Only a SYN opens a connection: a late duplicate of a closed connection's packet must not
+        # bring it back (in sink mode a new connection truncates its finished files)
+        connection = self.get_connection(client_address, packet.header.connection_id, create=False)
+        if connection is None:
+            return
+        if connection.early_packet is not None:
+            # the handshake is complete, the data of the SYN is handled first
+            early_packet, connection.early_packet = connection.early_packet, None
+            self.process_data_packet(early_packet, client_address)
+        self.connection = connection
+        connection.version = packet.header.version
+        if packet.header.flags & PARITY_FLAG:
+            # a protected packet, kept until the parity packet of its group
+            if connection.parity is None:
+                connection.parity = fec.ParityDecoder()
+            connection.parity.on_packet(packet.header.packet_number, packet.frames, packet.header.version)
+        received, elapsed = connection.process_data_packet(packet)
+        self.total_bytes += received    # Update the total bytes received
         self.total_packets += 1  # Update the total packets received
-        self.total_time += finish_time - start_time # Update the total time
-        self.server_socket.sendto(packet.serialize(), client_address)   # Send an ACK packet to acknowledge the received data
+        self.total_time += elapsed  # Update the total time
+        self.stats.on_packet(received, time.perf_counter())
+        if self.tracer is not None:
+            self.trace_packet(connection, packet, received)
+        if received == 0 and connection.flow is not None:
+            connection.flow.resend()    # no new data, the client is blocked by flow control
+        # acknowledge with a small ACK frame, right away or delayed (every ack_every packets or ack_delay
+        # seconds), new flow control limits go out right away with it
+        if connection.acks.on_packet(packet.header.packet_number, time.monotonic()) or connection.credits_due():
+            self.send_ack(connection)
+        else:
+            self.ack_pending.add(connection)
+
+    def process_parity_packet(self, packet, client_address):
+        # rebuild the data packet the group lost, if it lost one, and acknowledge right away: the
+        # client holds back the other losses of the group until the parity is acknowledged
+        connection = self.get_connection(client_address, packet.header.connection_id, create=False)
+        if connection is None:
+            return
+        if connection.parity is not None:
+            rebuilt = connection.parity.recover(packet, connection.acks.received)
+            if rebuilt is not None:
+                self.process_data_packet(rebuilt, client_address)
+        connection.acks.on_packet(packet.header.packet_number, time.monotonic())
+        self.send_ack(connection)
+
+    def trace_packet(self, connection, packet, received):
+        # the packet, where its frames were placed and how much is buffered behind holes
+        connection_id, packet_number = connection.connection_id, packet.header.packet_number
+        buffered = connection.flow.buffered if connection.flow is not None else 0
+        self.tracer.record(tracing.PACKET_RECEIVED, connection_id, 0, packet_number, received, buffered)
+        for frame in packet.frames:
+            self.tracer.record(tracing.FRAME_PLACED, connection_id, frame.stream_id, packet_number, frame.offset,
+                               frame.data_length)
+
+    def send_ack(self, connection, now=None):
+        # send the ACK frame of everything received on the connection, with the new flow control limits
+        now = time.monotonic() if now is None else now
+        frames = [connection.acks.build(now)]
+        flags = ACK_FLAG
+        if connection.credits_due():
+            frames.append(connection.flow.build())
+            flags |= MAX_DATA_FLAG
+        packet = Quic_packet(flags, connection.next_packet_number(), connection.connection_id, frames,
+                             connection.version)
+        self.sendto(packet.serialize(), connection.client_address)
+        self.ack_pending.discard(connection)
+        if self.tracer is not None:
+            self.tracer.record(tracing.ACK_SENT, connection.connection_id, 0, packet.header.packet_number,
+                               frames[0].largest_acknowledged, len(frames) - 1)
 
-    def print_statistics(self):
+    def flush_acks(self, now=None):
+        # send the delayed ACKs whose timer expired
+        now = time.monotonic() if now is None else now
+        for connection in list(self.ack_pending):
+            if connection.acks.due(now):
+                self.send_ack(connection, now)
+
+    def next_ack_timeout(self, now=None):
+        # seconds until the first delayed ACK is due, None when no ACK is pending
+        if not self.ack_pending:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0, min(connection.acks.deadline for connection in self.ack_pending) - now)
+
+    def print_statistics(self, connection=None):
         """
-        Print the statistics for each stream and overall data rates.
+        Print the statistics for each stream and overall data rates of a connection.
+
+        :param connection: the connection to report, the last active one by default.
+        :return: the snapshot of the connection's statistics (see stats.py).
         """
+        connection = connection or self.connection or Connection(self.server_address, 0)
+        snapshot = connection.stats.snapshot()
         print("\n--------------------------------- Statistics ---------------------------------")
         print(f"\na.     Total Bytes Received For Each Stream:\n")  # a. Total Bytes Received For Each Stream
-        for i in range(len(self.bytes_per_stream)):
-            print(f"Stream {i}: {self.bytes_per_stream[i]} bytes")
+        for i in range(len(connection.bytes_per_stream)):
+            print(f"Stream {i}: {connection.bytes_per_stream[i]} bytes")
         print("--------------------------------------------------------------------------------")
         print(f"\nb.     Total Packets Received For Each Stream:\n")    # b. Total Packets Received For Each Stream
-        for i in range(len(self.packets_per_stream)):
-            print(f"Stream {i}: {self.packets_per_stream[i]} packets")
+        for i in range(len(connection.packets_per_stream)):
+            print(f"Stream {i}: {connection.packets_per_stream[i]} packets")
         print("--------------------------------------------------------------------------------")
         print(f"\nc.     Data Rate By Bytes/Sec and Packet/Sec Per Stream:\n")  # c. Data Rate By Bytes/Sec and Packet/Sec Per Stream
-        for i in range(len(self.bytes_per_stream)): # Calculate the average data rate for each stream
-            stream_time = time.perf_counter() - self.total_times[i]
-            avg_bytes_per_sec = self.bytes_per_stream[i] / stream_time if stream_time > 0 else 0
-            avg_packets_per_sec = self.packets_per_stream[i] / stream_time if stream_time > 0 else 0
-            print(f"Stream {i}: {avg_bytes_per_sec} bytes/sec, {avg_packets_per_sec} packets/sec")
-        avg_total_bytes_per_sec = self.total_bytes / self.total_time if self.total_time > 0 else 0
+        for i, stream in enumerate(snapshot["streams"]):  # from the first to the last frame of each stream
+            print(f"Stream {i}: {stream['bytes_per_sec']} bytes/sec, {stream['packets_per_sec']} packets/sec "
+                  f"(last second: {stream['ewma_bytes_per_sec']:.0f} bytes/sec)")
+        total = snapshot["connection"]
+        print("--------------------------------------------------------------------------------")
+        print(f"\nd.     Overall Average Data Rate: {total['bytes_per_sec']} bytes/sec\n")     # d. Overall Average Data Rate
         print("--------------------------------------------------------------------------------")
-        print(f"\nd.     Overall Average Data Rate: {avg_total_bytes_per_sec} bytes/sec\n")     # d. Overall Average Data Rate
-        avg_total_packets_per_sec = self.total_packets / self.total_time if self.total_time > 0 else 0
+        print(f"\ne.     Overall Average Packet Rate: {total['packets_per_sec']} packets/sec\n")   # e. Overall Average Packet Rate
         print("--------------------------------------------------------------------------------")
-        print(f"\ne.     Overall Average Packet Rate: {avg_total_packets_per_sec} packets/sec\n")   # e. Overall Average Packet Rate
+        print(f"\nf.     Stream Completion Times:\n")    # f. Completion time of each stream and how fair they were
+        for i in range(len(connection.completion_times)):
+            print(f"Stream {i}: {connection.completion_times[i]} sec")
+        print(f"Jain's fairness index of the stream rates: {connection.fairness()}")
+        print("--------------------------------------------------------------------------------")
+        print(f"\ng.     Packet Inter-Arrival Times And Sizes:\n")    # g. Distribution of the packets of the connection
+        interarrival, size = total["interarrival"], total["size"]
+        print(f"Inter-arrival time: mean {interarrival['mean'] * 1e6:.1f} us, p50 <= {interarrival['p50'] * 1e6:.1f} us, "
+              f"p99 <= {interarrival['p99'] * 1e6:.1f} us, max {interarrival['max'] * 1e6:.1f} us")
+        print(f"Packet size: mean {size['mean']:.0f} bytes, p50 <= {size['p50']:.0f} bytes, max {size['max']} bytes")
+        if connection.parity is not None:
+            print(f"Packets rebuilt from parity: {connection.parity.recovered}, "
+                  f"groups that lost more than one: {connection.parity.unrecoverable}")
         print("--------------------------------------------------------------------------------")
         print(f"\n-Received Files Comparison:\n")
 
-        for i in range(len(self.files)):    # Save the received files to the output files
-            output_file = f"output_{i}.txt"
-            with open(output_file, "w") as f:
-                f.write(self.files[i])
+        connection.close()  # in sink mode the files are already on disk, write what is still buffered
+        for i in range(len(connection.streams)):    # Save the received files to the output files
+            if connection.sink is not None:
+                output_file = connection.streams[i].path
+            else:
+                output_file = f"output_{i}.txt"
+                with open(output_file, "wb") as f:
+                    f.write(connection.streams[i].data)
+
+            gaps = connection.streams[i].gaps()
+            if gaps:
+                print(f"Stream {i}: missing byte ranges {gaps}")
 
-            # Compare with the original file
+            # Compare with the digest the client sent, or with the original file if it sent none
+            verified = connection.verify(i)
             original_file = f"random_file_{i}.txt"
-            if self.compare_files(output_file, original_file):
+            if verified is not None:
+                result = "matches" if verified else "does not match"
+                print(f"File {output_file} {result} the digest of the sent stream.")
+            elif not os.path.exists(original_file):
+                print(f"File {output_file} has no original file {original_file} to compare with.")
+            elif self.compare_files(output_file, original_file):
                 print(f"File {output_file} is identical to {original_file}.")
             else:
                 print(f"File {output_file} is different from {original_file}.")
-        return self.avg_bytes_per_sec, self.avg_packets_per_sec
+        return snapshot
+
+    def export_statistics(self, path, connection=None):
+        """
+        Write the statistics of a connection (the last active one by default) and of every open
+        connection to path: JSON for a .json path, the Prometheus text format otherwise.
+        """
+        connections = [connection or self.connection] + list(self.connections)
+        snapshots = {}
+        for connection in connections:
+            if connection is not None:
+                address, connection_id = connection.key
+                snapshots[f"{address[0]}:{address[1]}/{connection_id}"] = connection.stats.snapshot()
+        if path.endswith(".json"):
+            stats.write_file(path, stats.to_json(snapshots))
+        else:
+            stats.write_file(path, stats.to_prometheus([({"connection": label}, snapshot)
+                                                        for label, snapshot in snapshots.items()]))
+        return snapshots
+
+    def statistics(self):
+        """
+        Totals of this server over all its connections, as a dict that can be sent between processes.
+        The rates are over the wall-clock time from the first to the last data packet, whose times
+        are given on the time.time() clock so that the servers of a pool can be compared.
+        """
+        snapshot = self.stats.snapshot()
+        offset = time.time() - time.perf_counter()
+        return {
+            "total_bytes": self.total_bytes,
+            "total_packets": self.total_packets,
+            "first_packet_time": self.stats.first_time + offset if self.stats.packets else None,
+            "last_packet_time": self.stats.last_time + offset if self.stats.packets else None,
+            "duration": snapshot["duration"],
+            "bytes_per_sec": snapshot["bytes_per_sec"],
+            "packets_per_sec": snapshot["packets_per_sec"],
+            "finished_connections": self.finished_connections,
+            "active_connections": len(self.connections),
+            "bytes_per_stream": list(self.finished_bytes_per_stream),
+            "packets_per_stream": list(self.finished_packets_per_stream),
+        }
+
+    # the streams of the last connection, for the single transfer callers
+    @property
+    def streams(self):
+        return self.connection.streams if self.connection is not None else []
+
+    @property
+    def files(self):
+        # the received data of each stream (in memory mode)
+        return self.connection.files if self.connection is not None else []
+
+    @property
+    def paths(self):
+        # the output file of each stream (in sink mode)
+        return self.connection.paths if self.connection is not None else []
+
+    @property
+    def bytes_per_stream(self):
+        return self.connection.bytes_per_stream if self.connection is not None else []
+
+    @property
+    def packets_per_stream(self):
+        return self.connection.packets_per_stream if self.connection is not None else []
+
+    @property
+    def sink(self):
+        return self.connection.sink if self.connection is not None else None
 
     def compare_files(self, file1, file2):  # Compare two files to see if they are identical.
         return filecmp.cmp(file1, file2, shallow=False)
 
-    def send_syn_ack(self, client_address, packet_number, connection_id):
+    def send_syn_ack(self, client_address, packet_number, connection_id, version=WIRE_VERSION, credits=None,
+                     token=None):
         flags = 0b00000011  # SYN_ACK flag indicating the connection establishment
-        frame = Frame(1, 0, 7, "SYN_ACK")
-        packet = Quic_packet(flags, packet_number, connection_id, [frame])
+        frames = [Frame(1, 0, 7, "SYN_ACK")]
+        if token is not None:   # lets the client send data without waiting the next time
+            frames.append(resumption.token_frame(token))
+        if credits is not None:     # MaxDataFrame of the initial flow control limits
+            frames.append(credits)
+            flags |= MAX_DATA_FLAG
+        packet = Quic_packet(flags, packet_number, connection_id, frames, version)
         serialized_packet = packet.serialize()
-        self.server_socket.sendto(serialized_packet, client_address)
+        self.sendto(serialized_packet, client_address)
         print(f"- - - Sent SYN-ACK packet to {client_address}")
 
-    def send_fin_ack(self, client_address, packet_number, connection_id):
+    def send_fin_ack(self, client_address, packet_number, connection_id, version=WIRE_VERSION):
         flags = 0b00000100
         frame = Frame(1, 0, 7, "FIN_ACK")
-        packet = Quic_packet(flags, packet_number, connection_id, [frame])
+        packet = Quic_packet(flags, packet_number, connection_id, [frame], version)
         serialized_packet = packet.serialize()
-        self.server_socket.sendto(serialized_packet, client_address)
+        self.sendto(serialized_packet, client_address)
         print(f"- - - - - Sent FIN-ACK packet to {client_address}")
 
 
+def add_per_stream(totals, values):
+    # element-wise totals += values, growing totals to the longer list
+    totals += [0 for _ in range(len(values) - len(totals))]
+    for i, value in enumerate(values):
+        totals[i] += value
+
+
 if __name__ == "__main__":
     server = Server("localhost", 12346)
     server.handle_packet()
\ No newline at end of file
@@ -0,0 +1,131 @@
+# streaming disk sink for the server
+# instead of keeping every received file in memory until FIN, each frame is written
+# straight to the output file of its stream at frame.offset (os.pwrite).
+# small frames are gathered in a bounded write-behind buffer shared by all the streams,
+# adjacent frames are coalesced so most of the writes are large and sequential.
+
+import os
+
+from reassembly import RangeSet
+
+
+def pwrite(fd, data, offset):
+    # os.pwrite is not available on Windows, fall back to seek + write there
+    if hasattr(os, "pwrite"):
+        return os.pwrite(fd, data, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+def pread(fd, size, offset):
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+class SinkFile:
+    # output file of one stream, same write/gaps/contiguous interface as reassembly.StreamBuffer
+    def __init__(self, sink, path, preallocate=0):
+        self.sink = sink
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        self.ranges = RangeSet()
+        self.pending = []           # [offset, bytearray] runs waiting to be written
+        self.pending_bytes = 0
+        self.size = 0               # end of the highest byte received
+        self.duplicate_bytes = 0
+        self.preallocated = 0
+        if preallocate and hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(self.fd, 0, preallocate)
+            self.preallocated = preallocate
+
+    def write(self, offset, data):
+        """
+        Queue data for offset of the file, bytes that were already received are dropped.
+
+        :return: number of new bytes.
+        """
+        stored = 0
+        for start, end in self.ranges.add(offset, offset + len(data)):
+            chunk = data[start - offset:end - offset]
+            if self.pending and self.pending[-1][0] + len(self.pending[-1][1]) == start:
+                self.pending[-1][1] += chunk           # extends the previous run
+            else:
+                self.pending.append([start, bytearray(chunk)])
+            stored += end - start
+            self.size = max(self.size, end)
+        self.pending_bytes += stored
+        self.duplicate_bytes += len(data) - stored
+        self.sink.on_pending(stored)
+        return stored
+
+    def flush(self):
+        # write the buffered runs at their offsets
+        for offset, run in self.pending:
+            pwrite(self.fd, run, offset)
+        flushed = self.pending_bytes
+        self.pending = []
+        self.pending_bytes = 0
+        return flushed
+
+    def close(self):
+        self.flush()
+        if self.preallocated > self.size:
+            os.ftruncate(self.fd, self.size)    # drop the unused preallocated tail
+        os.close(self.fd)
+        self.fd = None
+
+    def contiguous(self):
+        return self.ranges.contiguous()
+
+    def read(self, start, end):
+        # received bytes, written out first if they are still buffered
+        if self.pending:
+            self.sink.pending_bytes -= self.flush()
+        return pread(self.fd, end - start, start)
+
+    def gaps(self, size=None):
+        return self.ranges.gaps(size)
+
+    def __len__(self):
+        return self.size
+
+
+class DiskSink:
+    # creates the per-stream output files and bounds the memory of their write-behind buffers
+    def __init__(self, directory, buffer_limit=1024 * 1024, preallocate=0):
+        """
+        :param directory: directory of the output files, created if missing.
+        :param buffer_limit: bytes buffered in memory over all streams before flushing to disk.
+        :param preallocate: bytes to reserve on disk for every new file (0 to disable).
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.buffer_limit = buffer_limit
+        self.preallocate = preallocate
+        self.files = {}
+        self.pending_bytes = 0
+        self.peak_pending_bytes = 0
+
+    def open(self, stream_id):
+        path = os.path.join(self.directory, f"output_{stream_id}.txt")
+        self.files[stream_id] = SinkFile(self, path, self.preallocate)
+        return self.files[stream_id]
+
+    def on_pending(self, new_bytes):
+        self.pending_bytes += new_bytes
+        self.peak_pending_bytes = max(self.peak_pending_bytes, self.pending_bytes)
+        if self.pending_bytes >= self.buffer_limit:
+            self.flush()
+
+    def flush(self):
+        for sink_file in self.files.values():
+            sink_file.flush()
+        self.pending_bytes = 0
+
+    def close(self):
+        for sink_file in self.files.values():
+            if sink_file.fd is not None:
+                sink_file.close()
+        self.pending_bytes = 0
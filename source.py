@@ -0,0 +1,87 @@
+# data sources the client sends its streams from
+# a source hands out zero-copy memoryview chunks of a stream on demand, so the sender
+# never needs the whole file in memory: MappedFileSource maps the file with mmap and lets
+# the kernel page it in as the chunks are read, pages that were already sent are dropped
+# again, so the resident memory of a stream stays around one read window.
+
+import mmap
+import os
+
+from quic import as_view
+
+
+class StreamSource:
+    # interface of a stream source
+    size = 0
+
+    def read(self, offset, length):
+        """
+        Return up to length bytes of the stream starting at offset, as a memoryview.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __len__(self):
+        return self.size
+
+
+class BufferSource(StreamSource):
+    # a stream that is already in memory (str, bytes, bytearray or memoryview)
+    def __init__(self, data):
+        self.view = as_view(data)
+        self.size = len(self.view)
+
+    def read(self, offset, length):
+        return self.view[offset:offset + length]
+
+
+class MappedFileSource(StreamSource):
+    # a file mapped read-only, the pages are loaded lazily on first access
+    def __init__(self, path, window=1024 * 1024):
+        """
+        :param path: file to send.
+        :param window: pages more than window bytes behind the last read are released.
+        """
+        self.path = path
+        self.window = window
+        self.size = os.path.getsize(path)
+        self.map = None
+        self.view = None
+        self.released = 0       # pages before this offset were handed back to the kernel
+
+    def open(self):
+        with open(self.path, 'rb') as f:
+            if self.size == 0:
+                self.view = memoryview(b"")     # mmap cannot map an empty file
+                return
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self.map, "madvise"):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+        self.view = memoryview(self.map)
+
+    def read(self, offset, length):
+        if self.view is None:
+            self.open()
+        if offset - self.released > 2 * self.window:
+            self.release(offset - self.window)
+        return self.view[offset:offset + length]
+
+    def release(self, upto):
+        # drop the resident pages before upto, they are re-read from the file if needed again
+        upto -= upto % mmap.PAGESIZE
+        if self.map is not None and hasattr(self.map, "madvise") and upto > self.released:
+            self.map.madvise(mmap.MADV_DONTNEED, self.released, upto - self.released)
+        self.released = max(self.released, upto)
+
+    def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass    # chunks still referenced by unsent frames, unmapped once they are freed
+            self.map = None
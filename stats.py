@@ -0,0 +1,226 @@
+# streaming statistics of the received traffic, in constant memory
+# nothing is kept per packet: every stream and every connection has running counters, rates
+# averaged exponentially over wall-clock time (EWMA, recent seconds count more than old ones)
+# and histograms of the inter-arrival times and packet sizes with one bucket per power of two.
+# A snapshot turns them into a plain dict, written as JSON or in the Prometheus text format
+# (for the textfile collector of node_exporter).
+
+import json
+import math
+import os
+
+
+class EwmaRate:
+    # events per second, an event's weight halves every half_life seconds
+    def __init__(self, half_life=1.0):
+        self.tau = half_life / math.log(2)
+        self.rate = 0.0
+        self.start = None
+        self.last = None
+
+    def update(self, amount, now):
+        if self.start is None:
+            self.start = self.last = now
+        self.rate = self.rate * math.exp((self.last - now) / self.tau) + amount / self.tau
+        self.last = now
+
+    def value(self, now=None):
+        """
+        :param now: time to decay the rate to, the last update by default.
+        :return: the rate, corrected for the time before the first update (which counts as no traffic).
+        """
+        if self.start is None:
+            return 0.0
+        now = self.last if now is None else max(now, self.last)
+        elapsed = now - self.start
+        rate = self.rate * math.exp((self.last - now) / self.tau)
+        # over the first seconds only part of the weights are in, scale up to all of them
+        # (a single event has no rate yet)
+        warmup = 1 - math.exp(-elapsed / self.tau)
+        return rate / warmup if warmup > 0 else 0.0
+
+
+class LogHistogram:
+    # counts by power of two: bucket e holds the values in (2^(e-1), 2^e], the first bucket also
+    # everything below, the last everything above
+    def __init__(self, min_exponent, max_exponent):
+        self.min_exponent = min_exponent
+        self.max_exponent = max_exponent
+        self.counts = [0] * (max_exponent - min_exponent + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            if mantissa == 0.5:
+                exponent -= 1   # an exact power of two is the upper bound of the bucket below
+            exponent = min(max(exponent, self.min_exponent), self.max_exponent)
+        else:
+            exponent = self.min_exponent
+        self.counts[exponent - self.min_exponent] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def bounds(self):
+        # upper bound of every bucket, the last is infinite
+        return [2.0 ** exponent for exponent in range(self.min_exponent, self.max_exponent)] + [math.inf]
+
+    def buckets(self):
+        # (upper bound, count) of every bucket, "+Inf" for the last one as in Prometheus
+        bounds = self.bounds()[:-1] + ["+Inf"]
+        return [[bound, count] for bound, count in zip(bounds, self.counts)]
+
+    def quantile(self, q):
+        # upper bound of the bucket of the q quantile, within the observed min and max
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds(), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min or 0,
+            "max": self.max or 0,
+            "mean": self.sum / self.count if self.count else 0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": self.buckets(),
+        }
+
+
+class FlowStats:
+    # the traffic of one stream, or of a whole connection
+    def __init__(self, half_life=1.0):
+        self.bytes = 0
+        self.packets = 0
+        self.first_time = None
+        self.last_time = None
+        self.byte_rate = EwmaRate(half_life)
+        self.packet_rate = EwmaRate(half_life)
+        self.interarrival = LogHistogram(-30, 6)    # about 1 ns to 64 s
+        self.sizes = LogHistogram(0, 16)            # 1 byte to 64 KiB
+
+    def on_packet(self, size, now):
+        """
+        :param size: bytes of stream data of the packet (or frame).
+        :param now: arrival time on a monotonic clock.
+        """
+        if self.last_time is None:
+            self.first_time = now
+        else:
+            self.interarrival.add(now - self.last_time)
+        self.last_time = now
+        self.bytes += size
+        self.packets += 1
+        self.byte_rate.update(size, now)
+        self.packet_rate.update(1, now)
+        self.sizes.add(size)
+
+    def snapshot(self, now=None):
+        # averages over the wall-clock time from the first to the last packet, EWMA rates at now
+        duration = self.last_time - self.first_time if self.packets else 0
+        return {
+            "bytes": self.bytes,
+            "packets": self.packets,
+            "duration": duration,
+            "bytes_per_sec": self.bytes / duration if duration > 0 else 0,
+            "packets_per_sec": self.packets / duration if duration > 0 else 0,
+            "ewma_bytes_per_sec": self.byte_rate.value(now),
+            "ewma_packets_per_sec": self.packet_rate.value(now),
+            "interarrival": self.interarrival.summary(),
+            "size": self.sizes.summary(),
+        }
+
+
+class ConnectionStats:
+    # FlowStats of a connection and of each of its streams
+    def __init__(self, half_life=1.0):
+        self.half_life = half_life
+        self.connection = FlowStats(half_life)
+        self.streams = []
+
+    def on_frame(self, stream_id, size, now):
+        while stream_id >= len(self.streams):
+            self.streams.append(FlowStats(self.half_life))
+        self.streams[stream_id].on_packet(size, now)
+
+    def on_packet(self, size, now):
+        self.connection.on_packet(size, now)
+
+    def snapshot(self, now=None):
+        return {"connection": self.connection.snapshot(now),
+                "streams": [stream.snapshot(now) for stream in self.streams]}
+
+
+def to_json(snapshot):
+    return json.dumps(snapshot, indent=2)
+
+
+PROMETHEUS_METRICS = [
+    # (name, type, help, key of the snapshot)
+    ("quic_received_bytes_total", "counter", "Stream bytes received.", "bytes"),
+    ("quic_received_packets_total", "counter", "Packets (frames for a stream) received.", "packets"),
+    ("quic_receive_rate_bytes", "gauge", "EWMA of the received bytes per second.", "ewma_bytes_per_sec"),
+    ("quic_receive_rate_packets", "gauge", "EWMA of the received packets per second.", "ewma_packets_per_sec"),
+]
+PROMETHEUS_HISTOGRAMS = [
+    ("quic_interarrival_seconds", "Time between two packets.", "interarrival"),
+    ("quic_packet_size_bytes", "Stream bytes of a packet.", "size"),
+]
+
+
+def to_prometheus(snapshots):
+    """
+    Prometheus text exposition of ConnectionStats snapshots.
+
+    :param snapshots: list of (labels dict, snapshot), e.g. labels {"connection": "127.0.0.1:5000/7"}.
+    """
+    series = []     # (labels, flow snapshot) of every connection and every stream
+    for labels, snapshot in snapshots:
+        series.append((labels, snapshot["connection"]))
+        for stream_id, stream in enumerate(snapshot["streams"]):
+            series.append((dict(labels, stream=str(stream_id)), stream))
+    lines = []
+    for name, kind, help_text, key in PROMETHEUS_METRICS:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for labels, flow in series:
+            lines.append(f"{name}{format_labels(labels)} {flow[key]}")
+    for name, help_text, key in PROMETHEUS_HISTOGRAMS:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, flow in series:
+            histogram = flow[key]
+            cumulative = 0
+            for bound, count in histogram["buckets"]:
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(dict(labels, le=str(bound)))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+def write_file(path, text):
+    # replace the file at once, a collector never reads it half written
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        f.write(text)
+    os.replace(temporary, path)
@@ -1,18 +1,50 @@
 import unittest
 from client import Client
 from server import Server
+from quic import Quic_packet, Frame, FramePool, AckFrame, MaxDataFrame, ACK_FLAG, MAX_DATA_FLAG, DATA_FLAG, PARITY_FLAG, SYN_FLAG, serialize_varint, deserialize_varint, decode_frames
+from ack import AckTracker
+from recovery import LossRecovery
+from relay import LossyRelay
+from congestion import NewReno, Cubic, Pacer
+from scheduler import RoundRobinScheduler, WeightedFairScheduler, PriorityScheduler, StreamState
+from source import BufferSource
+from connection import jain_index
+from flow_control import FlowController, SendCredit
+from integrity import StreamDigest, new_hash, fin_frames, read_fin
+import tracing
+import resumption
+import pmtu
+import fec
+from stats import EwmaRate, LogHistogram, ConnectionStats, to_prometheus
+import json
+import bench
+import corpus
+from recovery import SentPacket, RttEstimator
+from reassembly import RangeSet, StreamBuffer
+import random
+import tempfile
+import os
+from sink import DiskSink
+from connection import Connection, ConnectionTable
+from workers import WorkerPool
+from ring import RecvRing
+from source import MappedFileSource
 import threading
 import time
+import asyncio
+import socket
 
 host = '127.0.0.1'
 port = 12346
 
 
 class TestClientServer(unittest.TestCase):
-    def run_server(self, host, port):
-        """Start the server to listen for incoming packets."""
-        self.server = Server(host, port)
-        self.server.handle_packet()
+    def start_server(self, host, port, **options):
+        """Start the server to listen for incoming packets, its socket is bound when this returns."""
+        self.server = Server(host, port, **options)
+        server_thread = threading.Thread(target=self.server.handle_packet)
+        server_thread.start()
+        return server_thread
 
     def run_client(self, host, port, data):
         """Run the client to send the data over UDP."""
@@ -24,13 +56,11 @@ class TestClientServer(unittest.TestCase):
         self.client.send_fin_massage(packet_number=1, connection_id=1, server_address=(host, port))
         self.client.close()
 
-    def run_both_for_testing(self, data):
-        input = data.copy()
+    def run_both_for_testing(self, data, **server_options):
+        # the server receives bytes, str files go through the client's UTF-8 shim
+        input = [item.encode('utf-8') if isinstance(item, str) else bytes(item) for item in data]
         # Start the server in a separate thread
-        server_thread = threading.Thread(target=self.run_server, args=(host, port))
-        server_thread.start()
-
-        time.sleep(1)  # Allow server to start before client sends data
+        server_thread = self.start_server(host, port, **server_options)
 
         # Start the client in a separate thread to send data
         client_thread = threading.Thread(target=self.run_client, args=(host, port, data))
@@ -41,10 +71,18 @@ class TestClientServer(unittest.TestCase):
         client_thread.join()
 
         # Compare received data with sent data
-        received_data = self.server.files
+        if "sink_dir" in server_options:
+            received_data = []
+            for path in self.server.paths:
+                with open(path, "rb") as f:
+                    received_data.append(f.read())
+        else:
+            received_data = self.server.files
         print ("Received data: ", received_data)
         print("Sent data: ", input)
         self.assertEqual(input, received_data)
+        # the digests of the FIN agree with what was received
+        self.assertEqual([True] * len(input), [self.server.connection.verify(i) for i in range(len(input))])
 
     # Test different data conditions
     def test_short_data(self):
@@ -88,6 +126,983 @@ class TestClientServer(unittest.TestCase):
         data = []
         self.run_both_for_testing(data)
 
+    def test_binary_data(self):
+        data = [bytes(range(256)) * 64, bytearray(b"\x00\xff" * 3000)]  # Non UTF-8 binary files
+        self.run_both_for_testing(data)
+
+    def test_disk_sink(self):
+        data = [random.Random(i).randbytes(300 * 1024) for i in range(3)]
+        with tempfile.TemporaryDirectory() as directory:
+            self.run_both_for_testing(data, sink_dir=directory, write_buffer=64 * 1024, preallocate=1024 * 1024)
+            self.assertLessEqual(self.server.sink.peak_pending_bytes, 64 * 1024 + 2000)
+            with self.assertRaises(ValueError):     # nothing is kept in memory
+                self.server.files
+            self.assertEqual([os.path.join(self.server.sink.directory, f"output_{i}.txt") for i in range(3)],
+                             self.server.paths)
+
+    def test_mapped_file_sources(self):
+        with tempfile.TemporaryDirectory() as directory:
+            contents = [random.Random(i).randbytes(size) for i, size in enumerate((0, 5000, 200 * 1024))]
+            paths = []
+            for i, content in enumerate(contents):
+                paths.append(os.path.join(directory, f"file_{i}"))
+                with open(paths[-1], "wb") as f:
+                    f.write(content)
+            data = [MappedFileSource(path) for path in paths]
+            server_thread = self.start_server(host, port)
+            self.run_client(host, port, data)
+            server_thread.join()
+            self.assertEqual(len(contents), len(self.server.files))
+            for content, received in zip(contents, self.server.files):
+                self.assertTrue(content == received)
+
+    def test_asyncio_engine(self):
+        data = [random.Random(i).randbytes(100 * 1024) for i in range(4)]
+        self.server = Server(host, port)
+        server_thread = threading.Thread(target=asyncio.run, args=(self.server.handle_packet_async(),))
+        server_thread.start()
+        self.client = Client(host, port)
+        asyncio.run(self.client.run_async(data))
+        server_thread.join()
+        self.assertTrue(data == self.server.files)
+        self.assertGreater(self.client.acked_packets, 0)    # ACKs were handled on the same loop
+
+    def test_asyncio_sender_without_timer(self):
+        # with no timer to arm the sender waits for the next ACK
+        data = [random.Random(0).randbytes(100 * 1024)]
+        self.server = Server(host, port)
+        server_thread = threading.Thread(target=asyncio.run, args=(self.server.handle_packet_async(),))
+        server_thread.start()
+        client = Client(host, port)
+        wake_time = client.wake_time
+        calls = []
+
+        def first_without_timer():
+            calls.append(None)
+            return None if len(calls) == 1 else wake_time()
+
+        client.wake_time = first_without_timer
+        asyncio.run(client.run_async(data))
+        server_thread.join()
+        self.assertTrue(data == self.server.files)
+        self.assertGreater(len(calls), 1)
+
+    def test_early_data_and_resumption(self):
+        data = [random.Random(i).randbytes(size) for i, size in enumerate((50 * 1024, 300, 0))]
+        for resumed in (False, True):     # the first connection brings the token of the second one
+            if not resumed:
+                resumption.TOKENS.pop((host, port), None)
+            server_thread = self.start_server(host, port, token_secret=b"test secret")
+            client = Client(host, port)
+            client.send_all_packets_early(data)
+            client.close()
+            server_thread.join()
+            self.assertTrue(data == self.server.files)
+            self.assertEqual(resumed, self.server.connection.resumed)
+            self.assertEqual(1, self.server.tokens.issued)
+            self.assertIn((host, port), resumption.TOKENS)
+
+    def test_forged_and_expired_tokens_hold_early_data(self):
+        # the data of a SYN without a valid token waits for the next packet of the client
+        server = Server(host, port, token_secret=b"test secret")
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer.bind((host, 0))
+        address = peer.getsockname()
+        try:
+            tokens = [resumption.TokenIssuer(b"other secret").issue(address),
+                      server.tokens.issue(address, now=time.time() - 2 * resumption.TOKEN_LIFETIME),
+                      None, server.tokens.issue(address)]
+            for connection_id, token in enumerate(tokens, 1):
+                frames = [Frame(0, 0, 5, b"hello")] + ([resumption.token_frame(token)] if token else [])
+                syn = Quic_packet(SYN_FLAG | DATA_FLAG, 1, connection_id, frames)
+                server.dispatch(Quic_packet.deserialize(syn.serialize()), address)
+                connection = server.connection
+                valid = connection_id == len(tokens)
+                self.assertEqual(valid, connection.resumed)
+                self.assertEqual(5 if valid else 0, connection.total_bytes)
+                data = Quic_packet(DATA_FLAG, 2, connection_id, [Frame(0, 5, 5, b"world")])
+                server.dispatch(Quic_packet.deserialize(data.serialize()), address)
+                self.assertEqual(b"helloworld", bytes(connection.files[0]))
+            self.assertEqual(2, server.tokens.rejected)
+            self.assertEqual(1, server.tokens.accepted)
+        finally:
+            peer.close()
+            server.server_socket.close()
+
+    def test_ack_frames(self):
+        data = [random.Random(i).randbytes(100 * 1024) for i in range(4)]
+        server_thread = self.start_server(host, port)
+        client = Client(host, port)
+        client.send_syn()
+        client.receive_ack()
+        client.send_all_packets(data)
+        client.receive_packets(time.monotonic() + 0.5)    # the last ACK goes out with the FIN-ACK
+        client.close()
+        server_thread.join()
+        self.assertTrue(data == self.server.files)
+        sent = client.packet_number - 1
+        self.assertEqual(sent, client.acked_packets + client.recovery.lost_packets)
+        self.assertEqual({}, client.unacked_packets)
+        self.assertEqual(sent, client.largest_acked)
+        # ACK frames instead of echoes: the reverse path is a small fraction of the forward one
+        self.assertLess(self.server.bytes_sent, self.server.total_bytes / 20)
+
+    def run_through_relay(self, data, engine, loss=0.05, seed=1, relay_options=None, **server_options):
+        # transfer data through a relay that drops a share of the data, ACK and FIN packets
+        self.server = Server(host, port, **server_options)
+        if engine == "asyncio":
+            server_thread = threading.Thread(target=asyncio.run, args=(self.server.handle_packet_async(),))
+        else:
+            server_thread = threading.Thread(target=self.server.handle_packet)
+        server_thread.start()
+        relay = LossyRelay((host, port), loss=loss, seed=seed, **(relay_options or {}))
+        relay.start()
+        self.relay = relay
+        client = Client(*relay.address)
+        if engine == "asyncio":
+            asyncio.run(client.run_async(data))
+        else:
+            client.send_syn()
+            client.receive_ack()
+            client.send_all_packets(data)
+            client.close()
+        server_thread.join()
+        relay.stop()
+        self.assertGreater(relay.dropped, 0)
+        self.assertTrue(data == self.server.files)
+        self.assertGreater(client.retransmitted_packets, 0)
+        self.assertEqual(0, len(client.unacked_packets))
+        return client
+
+    def test_lossy_relay(self):
+        data = [random.Random(i).randbytes(200 * 1024) for i in range(4)]
+        client = self.run_through_relay(data, "thread")
+        self.assertGreater(client.recovery.lost_packets, 0)
+
+    def test_lossy_relay_asyncio(self):
+        data = [random.Random(i).randbytes(100 * 1024) for i in range(3)]
+        self.run_through_relay(data, "asyncio", seed=2)
+
+    def test_delay_jitter_reordering_and_duplicates(self):
+        data = [random.Random(i).randbytes(100 * 1024) for i in range(3)]
+        self.run_through_relay(data, "thread", loss=0.02, seed=4, relay_options={
+            "delay": 0.002, "jitter": 0.001, "reorder": 0.05, "duplicate": 0.05})
+        self.assertGreater(self.relay.duplicated, 0)
+        self.assertGreater(self.relay.reordered, 0)
+        self.assertGreater(sum(stream.duplicate_bytes for stream in self.server.streams), 0)
+
+    def test_silent_peer(self):
+        # a server that never answers: the transfer gives up after the probe timeouts or the idle timeout
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        peer.bind((host, 0))
+        try:
+            for max_probe_timeouts, idle_timeout in ((1, 30.0), (100, 0.3)):
+                client = Client(*peer.getsockname())
+                client.max_probe_timeouts = max_probe_timeouts
+                client.idle_timeout = idle_timeout
+                start = time.monotonic()
+                with self.assertRaisesRegex(Exception, "No response received from the server"):
+                    client.send_all_packets([bytes(20000)])
+                self.assertLess(time.monotonic() - start, 5)
+                self.assertLessEqual(client.recovery.probes, max_probe_timeouts)
+        finally:
+            peer.close()
+
+    def test_late_duplicates_do_not_reopen_closed_connection(self):
+        # duplicated and reordered packets may arrive after the FIN, they must not truncate the output files
+        data = [random.Random(i).randbytes(100 * 1024) for i in range(3)]
+        with tempfile.TemporaryDirectory() as directory:
+            server = Server(host, port, sink_dir=directory)
+            paths = []
+            server.on_connection_closed = lambda connection: paths.extend(stream.path for stream in connection.streams)
+            server_thread = threading.Thread(target=server.serve_forever, args=(0.1,))
+            server_thread.start()
+            relay = LossyRelay((host, port), loss=0.02, seed=4, delay=0.002, jitter=0.001, reorder=0.05,
+                               duplicate=0.05)
+            relay.start()
+            client = Client(*relay.address)
+            client.send_syn()
+            client.receive_ack()
+            client.send_all_packets(data)
+            deadline = time.time() + 5
+            while server.finished_connections < 1 and time.time() < deadline:
+                time.sleep(0.05)
+            # a data packet of the closed connection, from the same address
+            late = Quic_packet(DATA_FLAG, 2, client.connection_id, [Frame(0, 0, 5, data[0][:5])]).serialize()
+            for _ in range(3):
+                client.sendto(late, relay.address)
+            time.sleep(0.3)
+            client.close()
+            server.stop()
+            server_thread.join()
+            relay.stop()
+            self.assertGreater(relay.duplicated, 0)
+            self.assertGreater(relay.reordered, 0)
+            self.assertEqual(1, server.finished_connections)
+            self.assertEqual(0, len(server.connections))
+            received = []
+            for path in paths:
+                with open(path, "rb") as f:
+                    received.append(f.read())
+            self.assertEqual(data, received)
+
+    def test_flow_control_bounds_buffered_data(self):
+        # the holes of lost packets keep data buffered, never more than the windows
+        data = [random.Random(i).randbytes(150 * 1024) for i in range(4)]
+        client = self.run_through_relay(data, "thread", seed=3, stream_window=8192, connection_window=16384,
+                                        autotune=False)
+        flow = self.server.connection.flow
+        self.assertEqual(0, flow.violations)
+        self.assertGreater(flow.peak_buffered, 0)
+        self.assertLessEqual(flow.peak_buffered, 16384)
+        self.assertEqual(sum(map(len, data)), client.credit.sent)
+
+    def test_statistics_export(self):
+        data = [bytes(30000), bytes(5000)]
+        self.run_both_for_testing(data)
+        with tempfile.TemporaryDirectory() as directory:
+            snapshots = self.server.export_statistics(os.path.join(directory, "stats.json"))
+            with open(os.path.join(directory, "stats.json")) as f:
+                self.assertEqual(snapshots, json.load(f))
+            self.server.export_statistics(os.path.join(directory, "stats.prom"))
+            with open(os.path.join(directory, "stats.prom")) as f:
+                self.assertIn('quic_received_bytes_total{connection="127.0.0.1:', f.read())
+        snapshot, = snapshots.values()
+        self.assertEqual(35000, snapshot["connection"]["bytes"])
+        self.assertEqual([30000, 5000], [stream["bytes"] for stream in snapshot["streams"]])
+
+    def test_many_concurrent_clients(self):
+        # make room in the kernel queue for the bursts of 24 clients, drops would only cost retransmissions
+        server = Server(host, port, rcvbuf=4 * 1024 * 1024)
+        received = {}
+        server.on_connection_closed = lambda connection: received.update({connection.key: bytes(connection.files[0])})
+        server_thread = threading.Thread(target=server.serve_forever, args=(0.1,))
+        server_thread.start()
+
+        def send(i):
+            client = Client(host, port)
+            client.send_syn()
+            client.receive_ack()
+            client.send_all_packets([f"client {i} ".encode() * 2000])
+            client.close()
+
+        client_threads = [threading.Thread(target=send, args=(i,)) for i in range(24)]
+        for thread in client_threads:
+            thread.start()
+        for thread in client_threads:
+            thread.join()
+        deadline = time.time() + 5
+        while server.finished_connections < 24 and time.time() < deadline:
+            time.sleep(0.05)
+        server.stop()
+        server_thread.join()
+        self.assertEqual(server.finished_connections, 24)
+        self.assertEqual(len(server.connections), 0)
+        self.assertEqual(sorted(received.values()), sorted(f"client {i} ".encode() * 2000 for i in range(24)))
+
+    def test_worker_pool(self):
+        pool = WorkerPool(host, 0, workers=2)
+        pool.start()
+
+        def send(i):
+            client = Client(host, pool.port)
+            client.send_syn()
+            client.receive_ack()
+            client.send_all_packets([b"x" * 10000, b"y" * 5000])
+            client.close()
+
+        client_threads = [threading.Thread(target=send, args=(i,)) for i in range(6)]
+        for thread in client_threads:
+            thread.start()
+        for thread in client_threads:
+            thread.join()
+        time.sleep(0.5)
+        total = pool.stop()
+        self.assertEqual(len(pool.worker_statistics), 2)
+        self.assertEqual(total["finished_connections"], 6)
+        self.assertEqual(total["total_bytes"], 6 * 15000)
+        self.assertEqual(total["bytes_per_stream"], [6 * 10000, 6 * 5000])
+        # wall-clock rates, the pool's from the first packet of any worker to the last one of any worker
+        self.assertNotIn("total_time", total)
+        self.assertGreater(total["bytes_per_sec"], 0)
+        busy = [s for s in pool.worker_statistics if s["first_packet_time"] is not None]
+        duration = max(s["last_packet_time"] for s in busy) - min(s["first_packet_time"] for s in busy)
+        self.assertAlmostEqual(total["total_bytes"] / duration, total["bytes_per_sec"])
+        # the packet times are on the time.time() clock, to the microsecond
+        self.assertLessEqual(total["bytes_per_sec"], sum(s["bytes_per_sec"] for s in pool.worker_statistics) * 1.001)
+        for statistics in pool.worker_statistics:
+            if statistics["duration"] > 0:
+                self.assertAlmostEqual(statistics["total_bytes"] / statistics["duration"], statistics["bytes_per_sec"])
+
+    def test_streams_finish_out_of_order(self):
+        # stable stream IDs: a short stream finishing first does not shift the others
+        data = [random.Random(i).randbytes(size) for i, size in enumerate((30000, 10, 0, 12000, 500))]
+        self.run_both_for_testing(data)
+
+    def test_multibyte_str_data(self):
+        data = ["\u05e9\u05dc\u05d5\u05dd" * 500]  # data_length counts bytes, not characters
+        self.run_both_for_testing(data)
+
+
+class TestPacketDecoder(unittest.TestCase):
+    def make_datagram(self, frames_num):
+        frames = [Frame(i, i * 10, 10, str(i % 10) * 10) for i in range(frames_num)]
+        return bytearray(Quic_packet(0b00000010, 7, 3, frames).serialize())
+
+    def test_frames_are_views_into_buffer(self):
+        datagram = self.make_datagram(100)
+        packet = Quic_packet.deserialize(datagram)
+        self.assertEqual((packet.header.connection_id, packet.header.packet_number), (3, 7))
+        self.assertEqual(len(packet.frames), 100)
+        self.assertEqual(bytes(packet.frames[42].data), b"2" * 10)
+        datagram[-1:] = b"x"  # the payload is not copied, so it sees the change in the receive buffer
+        self.assertEqual(bytes(packet.frames[-1].data), b"9" * 9 + b"x")
+
+    def test_lazy_matches_eager(self):
+        datagram = self.make_datagram(10)
+        eager = Quic_packet.deserialize(datagram).frames
+        lazy = list(Quic_packet.deserialize(datagram, lazy=True).frames)
+        self.assertEqual([(f.stream_id, f.offset, bytes(f.data)) for f in eager],
+                         [(f.stream_id, f.offset, bytes(f.data)) for f in lazy])
+
+    def test_truncated_frame(self):
+        datagram = self.make_datagram(2)[:-1]
+        with self.assertRaises(ValueError):
+            Quic_packet.deserialize(datagram)
+
+    def test_truncated_frame_header(self):
+        # a payload that ends inside a frame header, in both wire versions
+        for version in (1, 2):
+            payload = Quic_packet(0b00000010, 7, 3, [Frame(1, 0, 5, b"hello")] * 2, version).serialize()[9:]
+            with self.assertRaises(ValueError):
+                decode_frames(memoryview(payload[:-5 - 2]), 0, version)
+
+    def test_varint_boundaries(self):
+        for value, size in ((0, 1), (63, 1), (64, 2), (16383, 2), (16384, 4), (2 ** 30 - 1, 4), (2 ** 30, 8), (2 ** 62 - 1, 8)):
+            encoded = serialize_varint(value)
+            self.assertEqual(size, len(encoded))
+            self.assertEqual((value, size), deserialize_varint(memoryview(encoded), 0))
+        with self.assertRaises(ValueError):
+            serialize_varint(2 ** 62)
+
+    def test_both_wire_versions(self):
+        frames = [Frame(1, 0, 5, b"hello"), Frame(2, 70000, 3, b"abc"), Frame(3, 2 ** 40, 2, b"xy")]
+        # version 2 header: 5 bytes and a 4 byte packet number varint
+        for version, size in ((1, 9 + 3 * 18 + 10), (2, 9 + (2 + 1 + 1) + (2 + 4 + 1) + (2 + 8 + 1) + 10)):
+            datagram = Quic_packet(0b00000010, 2 ** 20 + 1, 3, frames, version).serialize()
+            self.assertEqual(size, len(datagram))
+            packet = Quic_packet.deserialize(datagram)
+            self.assertEqual((version, 2 ** 20 + 1, 0b00000010), (packet.header.version, packet.header.packet_number, packet.header.flags))
+            self.assertEqual([(1, 0, b"hello"), (2, 70000, b"abc"), (3, 2 ** 40, b"xy")],
+                             [(f.stream_id, f.offset, bytes(f.data)) for f in packet.frames])
+            self.assertEqual([(f.stream_id, f.offset, bytes(f.data)) for f in packet.frames],
+                             [(f.stream_id, f.offset, bytes(f.data)) for f in Quic_packet.deserialize(datagram, lazy=True).frames])
+
+
+    def test_serialize_into_matches_serialize(self):
+        buffer = bytearray(4096)
+        packets = [Quic_packet(0b00000010, number, 3, [Frame(1, offset, 5, b"hello"), Frame(2, 63, 70, bytes(70))], version)
+                   for version in (1, 2) for number, offset in ((1, 0), (100, 64), (20000, 2 ** 30), (2 ** 31, 2 ** 40))]
+        packets.append(Quic_packet(ACK_FLAG | MAX_DATA_FLAG, 9, 3, [AckFrame(9, 0.002, [(5, 9), (1, 2)]),
+                                                                 MaxDataFrame(2 ** 20, {0: 300, 4: 70000}, 64)]))
+        # with and without the flag, the credits after the other frames in the list
+        for flags in (ACK_FLAG | MAX_DATA_FLAG, ACK_FLAG):
+            packets.append(Quic_packet(flags, 10, 3, [AckFrame(10, 0.001, [(1, 10)]), MaxDataFrame(2 ** 16, {}, 8),
+                                                      MaxDataFrame(2 ** 17, {1: 5}, 8)]))
+        for packet in packets:
+            end = packet.serialize_into(buffer, 100)
+            self.assertEqual(packet.serialize(), bytes(buffer[100:end]))
+
+    def test_frame_pool_reuses_frames(self):
+        pool = FramePool(limit=1)
+        first = pool.acquire(1, 0, 3, b"abc")
+        pool.release([first, Frame(2, 0, 0, b"")])
+        self.assertIsNone(first.data)
+        self.assertEqual(1, len(pool.free))
+        self.assertIs(first, pool.acquire(4, 10, 2, b"xy"))
+        self.assertEqual((4, 10, 2, b"xy"), (first.stream_id, first.offset, first.data_length, first.data))
+
+
+class TestAckTracker(unittest.TestCase):
+    def test_delayed_and_out_of_order_acks(self):
+        tracker = AckTracker(ack_every=2, ack_delay=0.025)
+        self.assertFalse(tracker.on_packet(1, 0.0))
+        self.assertFalse(tracker.due(0.01))
+        self.assertTrue(tracker.due(0.025))
+        self.assertTrue(tracker.on_packet(2, 0.01))     # every second packet
+        tracker.build(0.01)
+        self.assertTrue(tracker.on_packet(5, 0.02))     # a gap is reported at once
+        self.assertTrue(tracker.on_packet(5, 0.03))     # and so is a duplicate
+        frame = tracker.build(0.03)
+        self.assertEqual([(5, 5), (1, 2)], frame.ranges)
+        self.assertEqual(1, tracker.duplicates)
+
+    def test_ack_frame_round_trip(self):
+        packet = Quic_packet(ACK_FLAG, 7, 42, [AckFrame(900, 0.0125, [(850, 900), (1, 848)])])
+        datagram = packet.serialize()
+        self.assertEqual(6 + 10 + 2 * 8, len(datagram))     # version 2 header with a one byte packet number
+        frame = Quic_packet.deserialize(datagram).frames[0]
+        self.assertEqual(900, frame.largest_acknowledged)
+        self.assertAlmostEqual(0.0125, frame.ack_delay)
+        self.assertEqual([(850, 900), (1, 848)], frame.ranges)
+        self.assertEqual(899, len(list(frame.packet_numbers())))
+
+
+class TestLossRecovery(unittest.TestCase):
+    def test_packet_threshold_and_rtt(self):
+        recovery = LossRecovery()
+        for packet_number in range(1, 6):
+            recovery.on_packet_sent(packet_number, [(0, packet_number * 100, 100)], 127, packet_number * 0.001)
+        # 2 is missing, 3 packets after it were acknowledged
+        acked, lost = recovery.on_ack_received(AckFrame(5, 0.0, [(3, 5), (1, 1)]), 0.02)
+        self.assertEqual([1, 3, 4, 5], sorted(packet.packet_number for packet in acked))
+        self.assertEqual([2], [packet.packet_number for packet in lost])
+        self.assertEqual([(0, 200, 100)], lost[0].ranges)
+        self.assertAlmostEqual(0.015, recovery.rtt.smoothed_rtt)
+        self.assertIsNone(recovery.deadline())
+
+    def test_probe_timeout_backs_off(self):
+        recovery = LossRecovery()
+        recovery.on_packet_sent(1, [(0, 0, 100)], 127, 0.0)
+        first = recovery.deadline()
+        self.assertEqual([1], [packet.packet_number for packet in recovery.on_timeout(first)])
+        self.assertAlmostEqual(first + 2 * recovery.rtt.pto(), recovery.deadline())
+        self.assertEqual(1, len(recovery.sent))     # the probed packet is still in flight
+
+
+class TestCongestionControl(unittest.TestCase):
+    def test_newreno_slow_start_and_loss(self):
+        reno = NewReno(1000)
+        self.assertEqual(10000, reno.cwnd)
+        packets = [SentPacket(i, 0.0, 1000, []) for i in range(10)]
+        for packet in packets:
+            reno.on_packet_sent(packet.size)
+        self.assertFalse(reno.can_send())
+        reno.on_packets_acked(packets[:5], 0.01, RttEstimator())
+        self.assertEqual(15000, reno.cwnd)      # one datagram more per datagram acknowledged
+        reno.on_packets_lost(packets[5:7], 0.02)
+        self.assertEqual(7500, reno.cwnd)
+        reno.on_packets_lost(packets[7:8], 0.03)   # same recovery period, no second reduction
+        self.assertEqual(7500, reno.cwnd)
+        self.assertEqual(1, reno.congestion_events)
+        self.assertEqual(2000, reno.bytes_in_flight)
+
+    def test_cubic_keeps_more_of_the_window(self):
+        cubic = Cubic(1000)
+        packet = SentPacket(1, 0.0, 1000, [])
+        cubic.on_packet_sent(1000)
+        cubic.on_packets_lost([packet], 0.01)
+        self.assertEqual(7000, cubic.cwnd)
+        cwnd = cubic.cwnd
+        for i in range(50):
+            cubic.on_packet_sent(1000)
+            cubic.on_packets_acked([SentPacket(i + 2, 0.02 + i * 0.01, 1000, [])], 0.03 + i * 0.01, RttEstimator())
+        self.assertGreater(cubic.cwnd, cwnd)    # growing back towards w_max in congestion avoidance
+        self.assertLess(cubic.cwnd, 2 * cwnd)
+
+    def test_pacer_spreads_packets(self):
+        pacer = Pacer(burst=2000, rate=100000)
+        self.assertEqual(0.0, pacer.next_send_time(0.0))
+        pacer.on_packet_sent(1500, 0.0)
+        pacer.on_packet_sent(1500, 0.0)         # the burst is used up
+        self.assertAlmostEqual(0.01, pacer.next_send_time(0.0))
+        self.assertEqual(0.02, pacer.next_send_time(0.02))
+
+
+class TestScheduler(unittest.TestCase):
+    def make_scheduler(self, scheduler, sizes, weights=None, priorities=None):
+        for i, size in enumerate(sizes):
+            scheduler.add(StreamState(i, BufferSource(bytes(size)), weights[i] if weights else 1,
+                                      priorities[i] if priorities else 0))
+        return scheduler
+
+    def sent_per_packet(self, scheduler, packets, space=1400):
+        # bytes of every stream in each packet, and the payload sizes
+        sent = []
+        for _ in range(packets):
+            chunks = scheduler.fill(space)
+            payload = sum(len(Frame(s.stream_id, offset, length, bytes(length)).serialize()) for s, offset, length in chunks)
+            sent.append(({s.stream_id: length for s, offset, length in chunks}, payload))
+        return sent
+
+    def test_round_robin_fills_packets_exactly(self):
+        scheduler = self.make_scheduler(RoundRobinScheduler(quantum=1000), [20000, 20000, 300, 20000])
+        sent = self.sent_per_packet(scheduler, 30)
+        self.assertTrue(all(payload == 1400 for _, payload in sent))
+        totals = [sum(packet.get(i, 0) for packet, _ in sent) for i in range(4)]
+        self.assertEqual(300, totals[2])
+        self.assertLessEqual(max(totals[0], totals[1], totals[3]) - min(totals[0], totals[1], totals[3]), 1000)
+
+    def test_weighted_fair_shares(self):
+        scheduler = self.make_scheduler(WeightedFairScheduler(quantum=500), [100000, 100000], weights=[1, 3])
+        sent = self.sent_per_packet(scheduler, 40)
+        totals = [sum(packet.get(i, 0) for packet, _ in sent) for i in range(2)]
+        self.assertAlmostEqual(3, totals[1] / totals[0], delta=0.2)
+
+    def test_fractional_weights(self):
+        scheduler = self.make_scheduler(WeightedFairScheduler(quantum=500), [100000, 100000], weights=[0.7, 1.75])
+        chunks = [chunk for _ in range(40) for chunk in scheduler.fill(1400)]
+        self.assertTrue(all(type(offset) is int and type(length) is int for _, offset, length in chunks))
+        totals = [sum(length for s, _, length in chunks if s.stream_id == i) for i in range(2)]
+        self.assertAlmostEqual(2.5, totals[1] / totals[0], delta=0.2)
+
+    def test_strict_priority(self):
+        scheduler = self.make_scheduler(PriorityScheduler(), [5000, 3000, 5000], priorities=[1, 0, 1])
+        sent = self.sent_per_packet(scheduler, 8)
+        # stream 1 is sent alone until it is complete, then 0 and 2 share the packets
+        first_other = next(i for i, (packet, _) in enumerate(sent) if set(packet) - {1})
+        self.assertEqual(3000, sum(packet.get(1, 0) for packet, _ in sent[:first_other + 1]))
+        self.assertEqual({0, 2}, set().union(*(packet for packet, _ in sent[first_other + 1:])))
+
+    def test_flow_control_limits(self):
+        scheduler = self.make_scheduler(RoundRobinScheduler(quantum=1000), [20000, 20000])
+        scheduler.streams[0].limit = 1500
+        chunks = scheduler.fill(5000, credit=2500)
+        self.assertEqual({0: 1500, 1: 1000}, {s.stream_id: length for s, offset, length in chunks})
+        self.assertFalse(scheduler.ready(0))
+        self.assertEqual([], scheduler.fill(5000, credit=0))
+        self.assertTrue(scheduler.ready(1))
+
+    def test_jain_index(self):
+        self.assertEqual(1.0, jain_index([5, 5, 5]))
+        self.assertAlmostEqual(1 / 3, jain_index([9, 0, 0]))
+
+
+class TestFlowControl(unittest.TestCase):
+    def test_limits_move_after_half_a_window(self):
+        flow = FlowController(stream_window=1000, connection_window=4000, autotune=False)
+        flow.on_data(0, 400, 400, 0.0)
+        self.assertFalse(flow.update_due())
+        flow.on_data(0, 900, 600, 0.0)     # a hole at 600, 300 bytes buffered
+        self.assertEqual(300, flow.buffered)
+        self.assertEqual({0: 1600}, flow.build().max_stream_data)
+        self.assertFalse(flow.update_due())
+        flow.on_data(1, 2000, 0, 0.0)
+        self.assertEqual(1, flow.violations)
+
+    def test_autotune_doubles_a_busy_window(self):
+        flow = FlowController(stream_window=1000, connection_window=100000, max_window=3000)
+        flow.on_handshake(0.0)
+        flow.on_data(0, 600, 600, 0.1)     # rtt 0.1
+        flow.on_data(0, 1200, 1200, 0.15)
+        flow.on_data(0, 2300, 2300, 0.2)
+        self.assertEqual(3000, flow.windows[0])
+        flow.on_data(0, 3900, 3900, 1.0)   # not faster than two round trips, the window stays
+        self.assertEqual(3000, flow.windows[0])
+
+    def test_credit_frame_round_trip(self):
+        frames = [AckFrame(9, 0.001, [(1, 9)]), MaxDataFrame(1 << 20, {0: 70000, 3: 300})]
+        packet = Quic_packet.deserialize(Quic_packet(ACK_FLAG | MAX_DATA_FLAG, 2, 7, frames).serialize())
+        self.assertEqual(9, packet.frames[0].largest_acknowledged)
+        credit = SendCredit()
+        credit.on_frame(MaxDataFrame(5000, {}, 1000))
+        credit.on_frame(packet.frames[-1])
+        self.assertEqual((1 << 20, 70000, 1000), (credit.available(), credit.stream_limit(0), credit.stream_limit(1)))
+
+
+class TestStats(unittest.TestCase):
+    def test_ewma_rate_follows_the_traffic(self):
+        rate = EwmaRate(half_life=0.5)
+        for i in range(1000):
+            rate.update(100, i * 0.01)     # 10 kB/s for 10 seconds
+        self.assertAlmostEqual(10000, rate.value(), delta=500)
+        self.assertAlmostEqual(5000, rate.value(9.99 + 0.5), delta=250)   # half a half-life later, no traffic
+
+    def test_log_histogram(self):
+        histogram = LogHistogram(0, 16)
+        for value in [1, 2, 3, 4, 1000, 1000, 1000, 100000]:
+            histogram.add(value)
+        buckets = dict((bound, count) for bound, count in histogram.buckets())
+        self.assertEqual((1, 1, 2, 3, 1), (buckets[1.0], buckets[2.0], buckets[4.0], buckets[1024.0], buckets["+Inf"]))
+        self.assertEqual(4, histogram.quantile(0.5))
+        self.assertEqual(1024, histogram.quantile(0.75))
+        self.assertEqual(100000, histogram.quantile(1))
+
+    def test_constant_memory_and_prometheus_text(self):
+        stats = ConnectionStats()
+        for i in range(5000):
+            stats.on_frame(i % 2, 1000, i * 0.001)
+            stats.on_packet(1000, i * 0.001)
+        snapshot = stats.snapshot()
+        self.assertEqual(2, len(snapshot["streams"]))
+        self.assertEqual(5000, snapshot["connection"]["interarrival"]["count"] + 1)
+        self.assertAlmostEqual(1e6, snapshot["connection"]["bytes_per_sec"], delta=1e3)
+        text = to_prometheus([({"connection": "a"}, snapshot)])
+        self.assertIn('quic_packet_size_bytes_bucket{connection="a",stream="1",le="1024.0"} 2500', text)
+        self.assertIn('quic_received_packets_total{connection="a"} 5000', text)
+
+
+class TestCorpus(unittest.TestCase):
+    def test_seeded_letters_and_digits(self):
+        data = corpus.generate_bytes(300000, seed=5)
+        self.assertEqual(300000, len(data))
+        self.assertEqual(set(corpus.ALPHABET), set(data))
+        self.assertEqual(data, corpus.generate_bytes(300000, seed=5))
+        self.assertEqual(data[:1000], corpus.generate_bytes(1000, seed=5))
+        self.assertNotEqual(data, corpus.generate_bytes(300000, seed=6))
+
+    def test_cached_files_are_generated_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = corpus.cached_corpus(2, 50000, 1, directory)
+            modified = [os.path.getmtime(path) for path in paths]
+            self.assertEqual(paths, corpus.cached_corpus(2, 50000, 1, directory))
+            self.assertEqual(modified, [os.path.getmtime(path) for path in paths])
+            with open(paths[0], "rb") as f:
+                self.assertEqual(corpus.generate_bytes(50000, corpus.file_seed(1, 0)), f.read())
+
+
+class TestBenchSuite(unittest.TestCase):
+    def test_percentiles_and_baseline_diff(self):
+        self.assertEqual(2.5, bench.percentile([4, 1, 3, 2], 0.5))
+        self.assertEqual(4, bench.percentile([4, 1, 3, 2], 1))
+        baseline = {"cases": {"a": {"summary": {"bytes_per_sec": bench.summarize([100.0]),
+                                                "cpu_seconds": bench.summarize([1.0])}}}}
+        results = {"cases": {"a": {"summary": {"bytes_per_sec": bench.summarize([95.0, 80.0, 85.0]),
+                                               "cpu_seconds": bench.summarize([0.5]), "complete": True}}}}
+        regressions = bench.compare(results, baseline, tolerance=0.1)
+        self.assertEqual([("a", "bytes_per_sec")], [(name, metric) for name, metric, *_ in regressions])
+
+    def test_trial_metrics(self):
+        metrics, server = bench.run_trial(bench.make_files(2, 20000), chunk_size=1200)
+        self.assertTrue(metrics["complete"])
+        self.assertLessEqual(metrics["first_byte_latency"], metrics["completion_max"])
+        self.assertGreater(metrics["cpu_seconds"], 0)
+
+    def test_failed_trial_restores_working_directory(self):
+        cwd = os.getcwd()
+        with self.assertRaises(RuntimeError):
+            with bench.scratch_directory() as directory:
+                self.assertEqual(os.path.realpath(directory), os.path.realpath(os.getcwd()))
+                raise RuntimeError("trial failed")
+        self.assertEqual(cwd, os.getcwd())
+
+
+class TestPathMtu(unittest.TestCase):
+    def search(self, path_mtu, limit, now=0.0):
+        # probes up to limit bytes are acknowledged, larger ones time out
+        while True:
+            size = path_mtu.due(now, 1.0)
+            if size is None:
+                if path_mtu.probe is None:
+                    return now
+                now += 1.0
+                continue
+            path_mtu.on_probe_sent(path_mtu.probes_sent + 1, size, now)
+            if size <= limit:
+                path_mtu.on_ack(AckFrame(path_mtu.probes_sent, 0, [(path_mtu.probes_sent, path_mtu.probes_sent)]))
+
+    def test_search_black_hole_and_raise(self):
+        path_mtu = pmtu.PathMtu(9000, raise_interval=100)
+        now = self.search(path_mtu, 1400)
+        self.assertTrue(1400 - path_mtu.granularity < path_mtu.size <= 1400)
+        self.assertEqual(path_mtu.probes_lost, path_mtu.probes_sent - path_mtu.probes_acked)
+        self.assertIsNone(path_mtu.due(now + 50, 1.0))
+        # the large packets stop arriving: back to the base size, searched again later
+        size = path_mtu.size
+        lost = [SentPacket(i, now, size, []) for i in range(3)]
+        path_mtu.on_packets([SentPacket(9, now, size, [])], lost)     # with an ACK it is congestion
+        self.assertEqual(size, path_mtu.size)
+        path_mtu.on_packets([], lost)
+        self.assertEqual(pmtu.BASE_DATAGRAM_SIZE, path_mtu.size)
+        self.search(path_mtu, 8000, now + 100)
+        self.assertTrue(8000 - path_mtu.granularity < path_mtu.size <= 8000)
+
+    def test_late_ack_and_interface_limit(self):
+        path_mtu = pmtu.PathMtu(65507)
+        self.assertEqual(1472, path_mtu.due(0.0, 1.0))     # the plateaus first
+        path_mtu.on_probe_sent(1, 1472, 0.0)
+        self.assertIsNone(path_mtu.due(0.5, 1.0))
+        self.assertEqual(1472, path_mtu.due(1.5, 1.0))     # timed out, tried again
+        self.assertEqual(1, path_mtu.probes_lost)
+        self.assertTrue(path_mtu.on_ack(AckFrame(1, 0, [(1, 1)])))     # the first one was only late
+        self.assertEqual((1472, 1472), (path_mtu.size, path_mtu.low))
+        path_mtu.on_too_large(path_mtu.probe_size())       # EMSGSIZE of 8972
+        self.assertEqual(8971, path_mtu.high)
+
+    def test_discovery_through_relay(self):
+        server = Server(host, 0)
+        server_thread = threading.Thread(target=server.handle_packet)
+        server_thread.start()
+        relay = LossyRelay(server.server_socket.getsockname(), mtu=1400)
+        relay.start()
+        client = Client(*relay.address)
+        client.pmtu_discovery = True
+        data = [random.Random(i).randbytes(1024 * 1024) for i in range(3)]
+        client.send_syn()
+        client.receive_ack()
+        client.send_all_packets(data)
+        client.close()
+        server_thread.join()
+        relay.stop()
+        self.assertTrue(data == server.files)
+        self.assertGreater(client.pmtu.size, pmtu.BASE_DATAGRAM_SIZE)
+        self.assertLessEqual(client.pmtu.size, 1400)
+        self.assertGreater(relay.too_large, 0)      # only probes, every data packet got through
+        self.assertLessEqual(relay.too_large, client.pmtu.probes_sent - client.pmtu.probes_acked)
+
+
+class TestFec(unittest.TestCase):
+    def test_parity_rebuilds_one_lost_packet(self):
+        data = random.Random(8).randbytes(6000)
+        chunks = [data[i * 1000:(i + 1) * 1000 - i * 7] for i in range(6)]     # of different lengths
+        packets = [Quic_packet(DATA_FLAG | PARITY_FLAG, 10 + i, 5, [Frame(i % 2, i * 1000, len(chunk), chunk)])
+                   for i, chunk in enumerate(chunks)]
+        encoder = fec.ParityEncoder()
+        buffer = bytearray(2000)
+        for packet in packets:
+            size = packet.serialize_into(buffer)
+            payload = fec.payload_size(packet.frames)
+            complete = encoder.add(packet.header.packet_number, buffer[size - payload:size])
+        self.assertFalse(complete)      # 32 packets per group without losses
+        parity = Quic_packet.deserialize(encoder.build(16, 5).serialize())
+        self.assertEqual([(10, 6, 16)], list(encoder.groups))
+
+        decoder = fec.ParityDecoder()
+        received = RangeSet()
+        for packet in packets[:3] + packets[4:]:
+            received.add(packet.header.packet_number, packet.header.packet_number + 1)
+            decoder.on_packet(packet.header.packet_number, Quic_packet.deserialize(packet.serialize()).frames)
+        rebuilt = decoder.recover(parity, received)
+        self.assertEqual((13, DATA_FLAG), (rebuilt.header.packet_number, rebuilt.header.flags))
+        frame = rebuilt.frames[0]
+        self.assertEqual((1, 3000, data[3000:3979]), (frame.stream_id, frame.offset, bytes(frame.data)))
+        self.assertIsNone(decoder.recover(parity, received))    # the group is done
+        self.assertEqual((1, 0), (decoder.recovered, decoder.unrecoverable))
+
+    def test_group_size_and_held_packets(self):
+        self.assertEqual(fec.MAX_GROUP, fec.group_size(0.0))
+        sizes = [fec.group_size(loss) for loss in (0.01, 0.03, 0.05, 0.2)]
+        self.assertEqual(sorted(sizes, reverse=True), sizes)
+        self.assertEqual(fec.MIN_GROUP, sizes[-1])
+        self.assertEqual(8, fec.ParityEncoder(ratio=1 / 8).group_size)
+
+        encoder = fec.ParityEncoder()
+        for packet_number in range(1, 5):
+            encoder.add(packet_number, bytes(100))
+        encoder.build(5, 1)
+        lost = [SentPacket(2, 0.0, 100, [(0, 100, 100)]), SentPacket(9, 0.0, 100, [(0, 900, 100)])]
+        in_flight = {5: SentPacket(5, 0.0, 120, [])}
+        self.assertEqual([lost[1]], encoder.hold(lost, in_flight))     # 9 is not in a group
+        self.assertEqual([], encoder.release(RangeSet(), in_flight))   # waits for the parity
+        acked = RangeSet()
+        acked.add(5, 6)
+        self.assertEqual([lost[0]], encoder.release(acked, {}))        # the parity came without it
+        self.assertEqual(({}, 0), (encoder.held, len(encoder.groups)))
+
+    def test_transfer_with_parity(self):
+        server = Server(host, 0)
+        server_thread = threading.Thread(target=server.handle_packet)
+        server_thread.start()
+        relay = LossyRelay(server.server_socket.getsockname(), loss=0.05, seed=3)
+        relay.start()
+        client = Client(*relay.address)
+        client.fec = True
+        data = [random.Random(i).randbytes(200 * 1024) for i in range(3)]
+        client.send_syn()
+        client.receive_ack()
+        client.send_all_packets(data)
+        client.close()
+        server_thread.join()
+        relay.stop()
+        self.assertTrue(data == server.files)
+        self.assertGreater(client.parity.parity_packets, 0)
+        self.assertGreater(server.connection.parity.recovered, 0)
+        self.assertLess(client.parity.group_size, fec.MAX_GROUP)   # sized by the loss
+
+
+class TestRelay(unittest.TestCase):
+    def test_bandwidth_cap_and_mtu(self):
+        relay = LossyRelay(("127.0.0.1", 9), bandwidth=1000, queue_limit=1500, mtu=1200)
+        out = relay.server_side
+        self.assertEqual(1.0, relay.transmit(1000, out, 0.0))
+        self.assertEqual(2.0, relay.transmit(1000, out, 0.0))     # waits for the first one
+        self.assertIsNone(relay.transmit(1000, out, 0.0))       # 2 s of queue is more than 1500 bytes
+        relay.forward(bytes(1300), out, ("127.0.0.1", 9), 0.0)
+        self.assertEqual(1, relay.too_large)
+        relay.stop()
+
+
+class TestStreamBuffer(unittest.TestCase):
+    def frames_of(self, data, size):
+        return [(offset, data[offset:offset + size]) for offset in range(0, len(data), size)]
+
+    def test_shuffled_and_duplicated_frames(self):
+        data = random.Random(1).randbytes(100000)
+        frames = self.frames_of(data, 1000)
+        frames += random.Random(2).sample(frames, 30)  # duplicates
+        random.Random(3).shuffle(frames)
+        stream = StreamBuffer()
+        stored = sum(stream.write(offset, chunk) for offset, chunk in frames)
+        self.assertEqual(stored, len(data))
+        self.assertEqual(stream.duplicate_bytes, 30 * 1000)
+        self.assertEqual(bytes(stream.data), data)
+        self.assertEqual(stream.contiguous(), len(data))
+        self.assertEqual(stream.gaps(len(data)), [])
+
+    def test_gaps_and_high_water_mark(self):
+        stream = StreamBuffer()
+        stream.write(10, b"b" * 10)
+        self.assertEqual(stream.contiguous(), 0)
+        stream.write(0, b"a" * 5)
+        stream.write(30, b"c" * 5)
+        self.assertEqual(stream.contiguous(), 5)
+        self.assertEqual(stream.gaps(40), [(5, 10), (20, 30), (35, 40)])
+        stream.write(3, b"a" * 2 + b"x" * 5 + b"b" * 3)  # overlaps both sides, only the hole is new
+        self.assertEqual(bytes(stream.data[:20]), b"a" * 5 + b"x" * 5 + b"b" * 10)
+        self.assertEqual(stream.contiguous(), 20)
+
+    def test_range_set_merges_touching_ranges(self):
+        ranges = RangeSet()
+        self.assertEqual(ranges.add(0, 10), [(0, 10)])
+        self.assertEqual(ranges.add(20, 30), [(20, 30)])
+        self.assertEqual(ranges.add(5, 25), [(10, 20)])
+        self.assertEqual((ranges.starts, ranges.ends), ([0], [30]))
+        self.assertEqual(ranges.add(30, 40), [(30, 40)])
+        self.assertEqual(len(ranges), 1)
+
+
+class TestIntegrity(unittest.TestCase):
+    def test_digest_of_reordered_frames(self):
+        data = random.Random(6).randbytes(60000)
+        frames = [(offset, memoryview(data)[offset:offset + 900]) for offset in range(0, len(data), 900)]
+        frames += frames[:3]
+        random.Random(7).shuffle(frames)
+        expected = new_hash()
+        expected.update(data)
+        with tempfile.TemporaryDirectory() as directory:
+            sink = DiskSink(directory, buffer_limit=8192)
+            for stream in (StreamBuffer(), sink.open(0)):
+                digest = StreamDigest()
+                for offset, chunk in frames:
+                    stream.write(offset, chunk)
+                    digest.update(stream, offset, chunk)
+                self.assertEqual((len(data), expected.digest()), (digest.hashed, digest.digest()))
+            sink.close()
+
+    def test_fin_digests_are_checked(self):
+        client = Client(host, port)
+        client.begin_transfer([b"abc" * 1000, b""])
+        while client.has_data():
+            client.next_packet()
+        fin = Quic_packet.deserialize(Quic_packet(4, 9, 1, fin_frames(client.stream_hashes, [3000, 0]), 2).serialize())
+        connection = Connection((host, port), 1)
+        connection.process_data_packet(Quic_packet(2, 1, 1, [Frame(0, 0, 3000, b"abc" * 1000)]))
+        connection.expected_digests = read_fin(fin)
+        self.assertEqual([True, True], [connection.verify(0), connection.verify(1)])
+        connection.expected_digests[0] = (3000, bytes(16))
+        self.assertFalse(connection.verify(0))
+        client.close()
+
+
+class TestResumption(unittest.TestCase):
+    def test_tokens_are_bound_to_address_secret_and_time(self):
+        issuer = resumption.TokenIssuer(b"secret", lifetime=60)
+        token = issuer.issue(("10.0.0.1", 5000), now=1000)
+        self.assertTrue(issuer.validate(token, ("10.0.0.1", 6000), now=1050))    # the port may change
+        self.assertFalse(issuer.validate(token, ("10.0.0.2", 5000), now=1050))
+        self.assertFalse(issuer.validate(token, ("10.0.0.1", 5000), now=1061))
+        self.assertFalse(resumption.TokenIssuer(b"other").validate(token, ("10.0.0.1", 5000), now=1050))
+        self.assertEqual((1, 2), (issuer.accepted, issuer.rejected))
+
+
+class TestTracing(unittest.TestCase):
+    def test_ring_segments_are_written_in_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace")
+            tracer = tracing.Tracer(path, segment_events=4, segments=3)
+            for packet_number in range(100):
+                tracer.record(tracing.PACKET_SENT, 7, 0, packet_number, 1400, 10000)
+            tracer.close()
+            events = list(tracing.read_events(path))
+            self.assertEqual(100, tracer.events + tracer.dropped)
+            self.assertEqual(tracer.events, len(events))
+            numbers = [event.packet_number for event in events]
+            self.assertEqual(sorted(numbers), numbers)
+            self.assertEqual((7, 1400), (events[-1].connection_id, events[-1].a))
+
+    def test_analyzer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace")
+            tracer = tracing.Tracer(path)
+            for packet_number in range(1, 11):
+                tracer.record(tracing.PACKET_RECEIVED, 1, 0, packet_number, 1000)
+                tracer.record(tracing.FRAME_PLACED, 1, packet_number % 2, packet_number, packet_number * 500, 500)
+            tracer.close()
+            timelines = tracing.stream_timelines(tracing.read_events(path))
+            self.assertEqual({0: 2500, 1: 2500}, {stream_id: timeline["bytes"] for stream_id, timeline in timelines.items()})
+            self.assertEqual(10000, sum(point[1] for point in tracing.throughput(tracing.read_events(path), 10)) * 10)
+            self.assertEqual(2, tracing.run_rates(tracing.read_events(path))["streams"])
+
+
+class TestMappedFileSource(unittest.TestCase):
+    def test_read_is_zero_copy_and_lazy(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "file")
+            content = random.Random(6).randbytes(3 * 1024 * 1024)
+            with open(path, "wb") as f:
+                f.write(content)
+            source = MappedFileSource(path, window=256 * 1024)
+            self.assertIsNone(source.map)   # nothing is mapped before the first read
+            chunks = [source.read(offset, 1500) for offset in range(0, source.size, 1500)]
+            self.assertIsInstance(chunks[0], memoryview)
+            self.assertGreater(source.released, 0)   # pages behind the window were handed back
+            self.assertEqual(b"".join(chunks), content)
+            del chunks
+            source.close()
+
+
+class TestConnectionTable(unittest.TestCase):
+    def test_idle_timeout_and_eviction(self):
+        table = ConnectionTable(idle_timeout=10, max_connections=2)
+        first, _ = table.get(("127.0.0.1", 1000), 1)
+        second, _ = table.get(("127.0.0.1", 1000), 2)
+        self.assertIsNot(first, second)     # same address, different connection id
+        self.assertIs(table.get(("127.0.0.1", 1000), 1)[0], first)
+        third, evicted = table.get(("127.0.0.1", 1001), 1)
+        self.assertEqual(evicted, [second])     # the least recently active connection
+        self.assertIsNone(table.get(("127.0.0.1", 1000), 2, create=False)[0])
+        self.assertEqual(table.evict_idle(third.last_activity + 5), [])
+        self.assertEqual(table.evict_idle(third.last_activity + 11), [first, third])
+        self.assertEqual(len(table), 0)
+
+
+class TestRecvRing(unittest.TestCase):
+    def test_batched_receive_into_slots(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind((host, 0))
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        ring = RecvRing(receiver, slots=4)
+        for i in range(6):
+            sender.sendto(bytes([i]) * (100 + i), receiver.getsockname())
+        time.sleep(0.05)
+        first = ring.receive_batch(timeout=1)
+        self.assertEqual([bytes(view) for view, _ in first], [bytes([i]) * (100 + i) for i in range(4)])
+        self.assertIs(first[0][0].obj, ring.buffers[0])     # a view into the preallocated slot
+        second = ring.receive_batch(timeout=1)
+        self.assertEqual([bytes(view) for view, _ in second], [bytes([i]) * (100 + i) for i in range(4, 6)])
+        self.assertEqual(ring.receive_batch(timeout=0.01), [])
+        self.assertEqual((ring.wakeups, ring.datagrams), (2, 6))
+        sender.close()
+        receiver.close()
+
+
+class TestDiskSink(unittest.TestCase):
+    def test_frames_written_at_offsets(self):
+        data = random.Random(4).randbytes(50000)
+        frames = [(offset, memoryview(data)[offset:offset + 700]) for offset in range(0, len(data), 700)]
+        frames += frames[:5]
+        random.Random(5).shuffle(frames)
+        with tempfile.TemporaryDirectory() as directory:
+            sink = DiskSink(directory, buffer_limit=4096)
+            stream = sink.open(0)
+            for offset, chunk in frames:
+                stream.write(offset, chunk)
+                self.assertLess(sink.pending_bytes, 4096)   # memory stays bounded by the write-behind buffer
+            self.assertEqual(stream.duplicate_bytes, 5 * 700)
+            sink.close()
+            with open(os.path.join(directory, "output_0.txt"), "rb") as f:
+                self.assertEqual(f.read(), data)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,228 @@
+# event tracing of the client and the server, in the spirit of qlog
+# every event is a fixed-size binary record (time, event, stream id, connection id, packet number
+# and two values whose meaning depends on the event) packed with pack_into into a preallocated
+# ring of segments, no object is created per event. A full segment is handed to a writer thread
+# that appends it to the trace file while the next segment fills, so the hot path never waits for
+# the disk. When the writer falls behind the new events are counted as dropped, never queued.
+# With tracing off the tracer is None and an event costs one comparison.
+# Offline, python tracing.py TRACE... prints per-stream timelines and throughput curves of the
+# traces, --plot draws them and, for one trace per run, the byte and packet rate graphs of main.py.
+
+import argparse
+import queue
+import struct
+import threading
+import time
+from collections import namedtuple
+
+MAGIC = b"QTRC"
+TRACE_VERSION = 1
+FILE_HEADER_STRUCT = struct.Struct("<4sBH")     # magic, version, record size
+EVENT_STRUCT = struct.Struct("<dBxHIIqq")       # time, event, stream id, connection id, packet number, a, b
+
+# events and the meaning of their values
+PACKET_SENT = 1         # client, a: datagram bytes, b: congestion window
+PACKET_RECEIVED = 2     # server, a: stream bytes, b: bytes buffered behind holes (flow control)
+FRAME_PLACED = 3        # server, stream id, a: offset, b: length
+ACK_SENT = 4            # server, packet number of the ACK, a: largest acknowledged, b: credits sent (0/1)
+ACK_RECEIVED = 5        # client, a: packets acknowledged, b: packets declared lost
+LOSS_TIMEOUT = 6        # client, a: packets lost or probed, b: 1 for a probe
+EVENT_NAMES = {PACKET_SENT: "packet_sent", PACKET_RECEIVED: "packet_received", FRAME_PLACED: "frame_placed",
+               ACK_SENT: "ack_sent", ACK_RECEIVED: "ack_received", LOSS_TIMEOUT: "loss_timeout"}
+
+Event = namedtuple("Event", "time event stream_id connection_id packet_number a b")
+
+
+class Tracer:
+    def __init__(self, path, segment_events=4096, segments=8):
+        """
+        :param path: the trace file, replaced.
+        :param segment_events: events of a segment, written to the file at once.
+        :param segments: segments of the ring, the writer may be that many minus one behind.
+        """
+        self.path = path
+        self.segment_size = segment_events * EVENT_STRUCT.size
+        self.segments = segments
+        self.buffer = bytearray(self.segment_size * segments)
+        self.view = memoryview(self.buffer)
+        self.segment = 0
+        self.position = 0           # where the next event goes
+        self.end = self.segment_size
+        self.queued = False         # the current segment is full and waits for the writer
+        self.written = [threading.Event() for _ in range(segments)]    # set when a segment may be reused
+        for written in self.written:
+            written.set()
+        self.events = 0
+        self.dropped = 0
+        self.file = open(path, "wb")
+        self.file.write(FILE_HEADER_STRUCT.pack(MAGIC, TRACE_VERSION, EVENT_STRUCT.size))
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.write_segments, daemon=True)
+        self.thread.start()
+
+    def record(self, event, connection_id=0, stream_id=0, packet_number=0, a=0, b=0):
+        if self.position == self.end and not self.next_segment():
+            self.dropped += 1
+            return
+        EVENT_STRUCT.pack_into(self.buffer, self.position, time.monotonic(), event, stream_id, connection_id,
+                               packet_number, a, b)
+        self.position += EVENT_STRUCT.size
+        self.events += 1
+
+    def next_segment(self):
+        # hand the full segment to the writer and continue in the next one, False while it is not written yet
+        if not self.queued:
+            self.written[self.segment].clear()
+            self.queue.put((self.segment, self.position))
+            self.queued = True
+        following = (self.segment + 1) % self.segments
+        if not self.written[following].is_set():
+            return False
+        self.segment = following
+        self.position = following * self.segment_size
+        self.end = self.position + self.segment_size
+        self.queued = False
+        return True
+
+    def write_segments(self):
+        # the writer thread, file writes release the GIL
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            segment, end = item
+            self.file.write(self.view[segment * self.segment_size:end])
+            self.written[segment].set()
+
+    def close(self):
+        # write the events of the current segment and wait for the writer, the trace is complete after it
+        if self.file.closed:
+            return
+        if not self.queued and self.position > self.segment * self.segment_size:
+            self.queue.put((self.segment, self.position))
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+
+def read_events(path, batch=65536):
+    # the events of a trace file, in the order they were recorded
+    with open(path, "rb") as f:
+        magic, version, record_size = FILE_HEADER_STRUCT.unpack(f.read(FILE_HEADER_STRUCT.size))
+        if magic != MAGIC or version != TRACE_VERSION or record_size != EVENT_STRUCT.size:
+            raise ValueError(f"{path} is not a trace of version {TRACE_VERSION}")
+        while True:
+            data = f.read(record_size * batch)
+            if len(data) < record_size:
+                return
+            for values in EVENT_STRUCT.iter_unpack(data[:len(data) - len(data) % record_size]):
+                yield Event(*values)
+
+
+def stream_timelines(events):
+    """
+    When each stream received its frames.
+
+    :return: {stream id: {"first", "last", "bytes", "frames"}}, times from the first event of the trace.
+    """
+    timelines = {}
+    start = None
+    for event in events:
+        start = event.time if start is None else start
+        if event.event != FRAME_PLACED:
+            continue
+        timeline = timelines.setdefault(event.stream_id, {"first": event.time - start, "bytes": 0, "frames": 0})
+        timeline["last"] = event.time - start
+        timeline["bytes"] += event.b
+        timeline["frames"] += 1
+    return timelines
+
+
+def throughput(events, interval=0.1, kind=PACKET_RECEIVED):
+    """
+    Bytes and packets per second over time, of the received packets (or PACKET_SENT for a client trace).
+
+    :return: list of (time from the first event, bytes/sec, packets/sec) of every interval.
+    """
+    bins = []
+    start = None
+    for event in events:
+        start = event.time if start is None else start
+        if event.event != kind:
+            continue
+        index = int((event.time - start) / interval)
+        while len(bins) <= index:
+            bins.append([0, 0])
+        bins[index][0] += event.a
+        bins[index][1] += 1
+    return [(i * interval, size / interval, packets / interval) for i, (size, packets) in enumerate(bins)]
+
+
+def run_rates(events):
+    """
+    Average rates of a server trace from the first to the last received packet, as main.py reports them.
+
+    :return: {"streams", "bytes_per_sec", "packets_per_sec"}.
+    """
+    first = last = None
+    size = packets = 0
+    streams = set()
+    for event in events:
+        if event.event == FRAME_PLACED:
+            streams.add(event.stream_id)
+        elif event.event == PACKET_RECEIVED:
+            first = event.time if first is None else first
+            last = event.time
+            size += event.a
+            packets += 1
+    duration = last - first if packets > 1 else 0
+    return {"streams": len(streams), "bytes_per_sec": size / duration if duration else 0,
+            "packets_per_sec": packets / duration if duration else 0}
+
+
+def plot(paths, interval=0.1, prefix="trace"):
+    # the throughput curve of every trace, and the rate graphs of main.py over the traces
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(12, 6))
+    for path in paths:
+        curve = throughput(read_events(path), interval)
+        plt.plot([point[0] for point in curve], [point[1] for point in curve], label=path)
+    plt.xlabel('Time (sec)')
+    plt.ylabel('Byte Rate')
+    plt.title('Received Bytes per Second Over Time')
+    plt.legend()
+    plt.savefig(f'{prefix}_throughput.png')
+
+    runs = sorted((run_rates(read_events(path)) for path in paths), key=lambda run: run["streams"])
+    for key, label, name in (("bytes_per_sec", "Average Byte Rate", "bytes"),
+                             ("packets_per_sec", "Average Packets per Second", "packets")):
+        plt.figure(figsize=(12, 6))
+        plt.plot([run["streams"] for run in runs], [run[key] for run in runs], marker='o')
+        plt.xlabel('Number of Streams')
+        plt.ylabel(label)
+        plt.title(f'{label} As Function Of Streams Number')
+        plt.savefig(f'{prefix}_{name}_statistics.png')
+    plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Timelines and throughput of trace files.")
+    parser.add_argument("traces", nargs="+")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds of a throughput point")
+    parser.add_argument("--plot", metavar="PREFIX", help="draw the graphs into PREFIX_*.png (needs matplotlib)")
+    args = parser.parse_args()
+    for path in args.traces:
+        counts = {}
+        for event in read_events(path):
+            name = EVENT_NAMES.get(event.event, str(event.event))
+            counts[name] = counts.get(name, 0) + 1
+        print(f"== {path}: {counts}")
+        print(run_rates(read_events(path)))
+        for stream_id, timeline in sorted(stream_timelines(read_events(path)).items()):
+            print(f"Stream {stream_id}: {timeline['bytes']} bytes in {timeline['frames']} frames, "
+                  f"{timeline['first']:.4f} to {timeline['last']:.4f} sec")
+        for start, byte_rate, packet_rate in throughput(read_events(path), args.interval):
+            print(f"{start:8.3f} sec  {byte_rate:14.0f} bytes/sec  {packet_rate:10.0f} packets/sec")
+    if args.plot:
+        plot(args.traces, args.interval, args.plot)
@@ -0,0 +1,162 @@
+# asyncio transport layer for the server and the client
+# the packet handling itself lives in Server.dispatch and in the Client's transfer methods
+# (begin_transfer / next_packet / on_packet / end_transfer), this module only drives them
+# from an event loop: datagrams are delivered by an asyncio.DatagramProtocol and the sender
+# paces itself with loop timers, so receiving ACKs, timers and sending share one thread
+# without blocking recvfrom calls or time.sleep between packets.
+
+import asyncio
+
+from quic import *
+
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    # feeds every received datagram to Server.dispatch, closed is resolved by the first FIN
+    # (None when serving connections until the server is stopped)
+    def __init__(self, server, closed):
+        self.server = server
+        self.closed = closed
+        self.ack_timer = None
+
+    def connection_made(self, transport):
+        self.server.transport = transport
+
+    def datagram_received(self, data, client_address):
+        if self.closed is not None and self.closed.done():
+            return
+        packet = Quic_packet.deserialize(data)
+        if self.server.dispatch(packet, client_address) and self.closed is not None:
+            self.closed.set_result(client_address)
+        self.schedule_acks()
+
+    def schedule_acks(self):
+        # one loop timer for the earliest delayed ACK of all the connections
+        timeout = self.server.next_ack_timeout()
+        if timeout is not None and self.ack_timer is None:
+            self.ack_timer = asyncio.get_running_loop().call_later(timeout, self.flush_acks)
+
+    def flush_acks(self):
+        self.ack_timer = None
+        self.server.flush_acks()
+        self.schedule_acks()
+
+    def cancel(self):
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+
+    def error_received(self, exc):
+        pass    # ICMP errors of a previous sendto (e.g. the client already closed)
+
+
+class ClientProtocol(asyncio.DatagramProtocol):
+    # resolves the handshake futures and hands every other packet to Client.on_packet
+    def __init__(self, client):
+        self.client = client
+        loop = asyncio.get_running_loop()
+        self.syn_ack = loop.create_future()
+        self.fin_ack = loop.create_future()
+        self.progress = asyncio.Event()     # set whenever an ACK arrived
+
+    def datagram_received(self, data, server_address):
+        packet = Quic_packet.deserialize(data)
+        if packet.header.flags & 0b00000001:
+            if not self.syn_ack.done():
+                self.client.on_syn_ack(packet)
+                self.syn_ack.set_result(packet)
+        elif packet.header.flags & 0b00000100:
+            if not self.fin_ack.done():
+                self.fin_ack.set_result(packet)
+        else:
+            self.client.on_packet(packet)
+            self.progress.set()
+
+    def error_received(self, exc):
+        pass
+
+
+async def serve(server, forever=False, poll_interval=0.5):
+    """
+    Run the server on the running event loop.
+
+    :param forever: keep serving connections until server.stop(), instead of until the first FIN.
+    :param poll_interval: seconds between two checks for idle connections and for stop().
+    """
+    loop = asyncio.get_running_loop()
+    closed = loop.create_future()
+    datagram_transport, protocol = await loop.create_datagram_endpoint(
+        lambda: ServerProtocol(server, None if forever else closed), sock=server.server_socket)
+    try:
+        if forever:
+            while server.running:
+                await asyncio.sleep(poll_interval)
+                server.evict_idle()
+        else:
+            await closed
+    finally:
+        protocol.cancel()
+        datagram_transport.close()
+        server.transport = None
+
+
+async def connect(client, timeout=2.0):
+    """
+    Attach the client's socket to the running loop and do the SYN / SYN-ACK handshake.
+    """
+    loop = asyncio.get_running_loop()
+    datagram_transport, protocol = await loop.create_datagram_endpoint(
+        lambda: ClientProtocol(client), sock=client.client_socket)
+    client.transport = datagram_transport
+    client.protocol = protocol
+    client.send_syn()
+    try:
+        packet = await asyncio.wait_for(protocol.syn_ack, timeout)
+    except asyncio.TimeoutError:
+        client.close()
+        raise Exception("No response received from the server. Closing the connection.")
+    print(f"Received SYN-ACK with packet number {packet.header.packet_number} and connection ID {packet.header.connection_id}")
+
+
+async def send_all(client, data, max_burst=16, fin_timeout=2.0):
+    """
+    Send all the streams of data, as the congestion window and the pacer of the client allow,
+    until every packet is acknowledged, then close with FIN.
+
+    :param max_burst: packets sent back to back before yielding to the loop.
+    :param fin_timeout: seconds to wait for the FIN-ACK, the FIN is sent again meanwhile.
+    """
+    loop = asyncio.get_running_loop()
+    protocol = client.protocol
+    client.begin_transfer(data)
+    while client.has_data() or client.in_flight():
+        # the loop clock is time.monotonic, as the client's timers
+        burst = 0
+        while burst < max_burst:
+            send_time = client.send_time()
+            if send_time is None or send_time > loop.time():
+                break
+            client.send_packet(client.next_packet())
+            burst += 1
+        if burst == max_burst:
+            await asyncio.sleep(0)      # let the loop deliver the ACKs
+        else:
+            # wake up on the next ACK, when the pacer allows the next packet or on the recovery timer
+            wake = client.wake_time()
+            protocol.progress.clear()
+            timeout = max(wake - loop.time(), 0) if wake is not None else None     # None: no timer, the next ACK
+            try:
+                await asyncio.wait_for(protocol.progress.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        client.check_timeout()
+    client.end_transfer()
+    deadline = loop.time() + fin_timeout
+    for _ in range(client.fin_retries):
+        try:
+            await asyncio.wait_for(asyncio.shield(protocol.fin_ack), min(client.recovery.rtt.pto(), fin_timeout))
+            return
+        except asyncio.TimeoutError:
+            if loop.time() >= deadline:
+                break
+            client.send_fin_massage(client.server_address, client.packet_number, client.connection_id)
+    print("No FIN-ACK received from the server.")
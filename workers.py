@@ -0,0 +1,145 @@
+# multi-process server: N worker processes serve the same UDP port
+# every worker is a full Server bound with SO_REUSEPORT, the kernel spreads the datagrams over
+# the workers by hashing the (client address, server address) 4-tuple, so all the packets of a
+# connection reach the same worker and every worker keeps its own connection table. Packet
+# decoding and reassembly then run on as many cores as there are workers. When the pool is
+# stopped each worker sends its Server.statistics() to the parent, which adds them up.
+
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+
+from server import Server, add_per_stream
+
+
+def run_worker(ip, port, server_options, ready, stop_event, results, quiet):
+    # entry point of a worker process
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    server = Server(ip, port, reuse_port=True, **server_options)
+    ready.put(os.getpid())
+
+    def wait_for_stop():
+        stop_event.wait()
+        server.stop()
+
+    threading.Thread(target=wait_for_stop, daemon=True).start()
+    server.serve_forever(poll_interval=0.1)
+    statistics = server.statistics()
+    statistics["pid"] = os.getpid()
+    results.put(statistics)
+
+
+class WorkerPool:
+    def __init__(self, ip, port, workers=None, quiet=False, **server_options):
+        """
+        :param port: port shared by the workers, 0 picks a free one (see self.port after start()).
+        :param workers: number of worker processes, one per core by default.
+        :param quiet: silence the per-packet prints of the workers.
+        :param server_options: passed to every worker's Server (sink_dir, idle_timeout, ...).
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise OSError("SO_REUSEPORT is not supported on this platform")
+        self.ip = ip
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.server_options = server_options
+        self.quiet = quiet
+        self.context = multiprocessing.get_context("spawn")
+        self.processes = []
+        self.worker_statistics = []
+
+    def start(self, timeout=30):
+        # start the workers and wait until all of them are bound to the port
+        probe = None
+        if self.port == 0:
+            # reserve a free port for the group, the probe socket leaves before any client comes
+            probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            probe.bind((self.ip, 0))
+            self.port = probe.getsockname()[1]
+        ready = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.results = self.context.Queue()
+        for _ in range(self.workers):
+            process = self.context.Process(target=run_worker, args=(self.ip, self.port, self.server_options,
+                                                                     ready, self.stop_event, self.results, self.quiet))
+            process.start()
+            self.processes.append(process)
+        for _ in range(self.workers):
+            ready.get(timeout=timeout)
+        if probe is not None:
+            probe.close()
+        print(f"- {self.workers} workers listening on {(self.ip, self.port)}")
+
+    def stop(self, timeout=30):
+        """
+        Stop the workers and collect their statistics.
+
+        :return: the aggregated statistics.
+        """
+        self.stop_event.set()
+        self.worker_statistics = [self.results.get(timeout=timeout) for _ in self.processes]
+        for process in self.processes:
+            process.join(timeout)
+        self.processes = []
+        return self.statistics()
+
+    def statistics(self):
+        # the sum of the workers' Server.statistics()
+        total = {"total_bytes": 0, "total_packets": 0, "finished_connections": 0, "active_connections": 0,
+                 "bytes_per_stream": [], "packets_per_stream": []}
+        for statistics in self.worker_statistics:
+            for key in ("total_bytes", "total_packets", "finished_connections", "active_connections"):
+                total[key] += statistics[key]
+            add_per_stream(total["bytes_per_stream"], statistics["bytes_per_stream"])
+            add_per_stream(total["packets_per_stream"], statistics["packets_per_stream"])
+        # the rates of the pool are over the time from the first packet of any worker to the last one
+        # of any worker, adding up the worker rates would overstate them when the workers are not busy
+        # at the same time
+        busy = [statistics for statistics in self.worker_statistics if statistics["first_packet_time"] is not None]
+        duration = 0
+        if busy:
+            duration = (max(statistics["last_packet_time"] for statistics in busy)
+                        - min(statistics["first_packet_time"] for statistics in busy))
+        total["duration"] = duration
+        total["bytes_per_sec"] = total["total_bytes"] / duration if duration > 0 else 0
+        total["packets_per_sec"] = total["total_packets"] / duration if duration > 0 else 0
+        return total
+
+    def print_statistics(self):
+        """
+        Print the aggregated statistics of all the workers, in the format of Server.print_statistics.
+        """
+        total = self.statistics()
+        print("\n------------------------------ Worker Statistics -------------------------------")
+        for statistics in self.worker_statistics:
+            print(f"Worker {statistics['pid']}: {statistics['finished_connections']} connections, "
+                  f"{statistics['total_bytes']} bytes, {statistics['total_packets']} packets, "
+                  f"{statistics['bytes_per_sec']:.0f} bytes/sec over {statistics['duration']:.3f} s")
+        print("--------------------------------------------------------------------------------")
+        print(f"\na.     Total Bytes Received For Each Stream:\n")
+        for i, received in enumerate(total["bytes_per_stream"]):
+            print(f"Stream {i}: {received} bytes")
+        print("--------------------------------------------------------------------------------")
+        print(f"\nb.     Total Packets Received For Each Stream:\n")
+        for i, received in enumerate(total["packets_per_stream"]):
+            print(f"Stream {i}: {received} packets")
+        print("--------------------------------------------------------------------------------")
+        print(f"\nd.     Overall Average Data Rate: {total['bytes_per_sec']} bytes/sec\n")
+        print("--------------------------------------------------------------------------------")
+        print(f"\ne.     Overall Average Packet Rate: {total['packets_per_sec']} packets/sec\n")
+        print("--------------------------------------------------------------------------------")
+        return total
+
+
+if __name__ == "__main__":
+    pool = WorkerPool("localhost", 12346)
+    pool.start()
+    try:
+        input("Press Enter to stop the workers\n")
+    finally:
+        pool.stop()
+        pool.print_statistics()